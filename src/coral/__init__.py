@@ -1,8 +1,9 @@
 """CORAL: Multi-Species Mutation Extraction Pipeline"""
 
-from .pipeline import MutationExtractionPipeline, MultiSpeciesMutationPipeline
+from .pipeline import CohortPipeline, MutationExtractionPipeline, MultiSpeciesMutationPipeline
 
 __all__ = [
+    "CohortPipeline",
     "MutationExtractionPipeline",
     "MultiSpeciesMutationPipeline",
 ]
@@ -6,6 +6,8 @@ import sys
 import multiprocessing
 
 import pysam
+from .plot_queue import render
+from .progress_manager import PROGRESS_BATCH, ProgressReporter
 from .utils import run_cmd, log  
 from typing import Optional, TextIO
 import matplotlib.pyplot as plt
@@ -22,6 +24,20 @@ def log_to_file(log_path: Optional[str], message: str):
         with open(log_path, 'a') as f:
             f.write(message + '\n')
 
+def plot_mapq_histogram(mapq_values, out_path, log_path: Optional[str] = None):
+    scores = sorted(mapq_values.keys())
+    counts = [mapq_values[score] for score in scores]
+
+    plt.figure(figsize=(8, 5))
+    plt.bar(scores, counts, color='steelblue', edgecolor='black', log=True)
+    plt.title("MAPQ Score Distribution")
+    plt.xlabel("MAPQ")
+    plt.ylabel("Read Count (log scale)")
+    plt.tight_layout()
+    plt.savefig(out_path)
+    plt.close()
+    log_to_file(log_path, f"MAPQ histogram saved to {out_path}")
+
 def filter_sam(
     input_stream: TextIO,
     output_stream: TextIO,
@@ -30,6 +46,8 @@ def filter_sam(
     hist_name: str = None,
     verbose: bool = True,
     log_path: Optional[str] = None,
+    progress_path: Optional[str] = None,
+    plot_queue=None,
 ):
     total_reads = 0
     kept_reads = 0
@@ -51,43 +69,34 @@ def filter_sam(
 
     def plot_histogram():
         if mapq_hist_folder:
-            scores = sorted(mapq_values.keys())
-            counts = [mapq_values[score] for score in scores]
-
-            plt.figure(figsize=(8, 5))
-            plt.bar(scores, counts, color='steelblue', edgecolor='black', log=True)
-            plt.title("MAPQ Score Distribution")
-            plt.xlabel("MAPQ")
-            plt.ylabel("Read Count (log scale)")
-            plt.tight_layout()
-
             os.makedirs(mapq_hist_folder, exist_ok=True)
             out_path = os.path.join(mapq_hist_folder, hist_name)
-            plt.savefig(out_path)
-            msg = f"MAPQ histogram saved to {out_path}"
-            if verbose:
-                print(msg)
-            log_to_file(log_path, msg)
-
-    for i, line in enumerate(input_stream):
-        if line.startswith('@'):
-            output_stream.write(line)
-            continue
-        fields = line.split('\t')
-        try:
-            mapq = int(fields[4])
-            mapq_values[mapq] += 1
-            total_reads += 1
-            if mapq >= mapq_threshold:
+            render(plot_queue, plot_mapq_histogram, dict(mapq_values), out_path, log_path,
+                   message=f"MAPQ histogram saved to {out_path}", verbose=verbose)
+
+    with ProgressReporter("filter reads", progress_path=progress_path, verbose=verbose) as progress:
+        for i, line in enumerate(input_stream):
+            if line.startswith('@'):
                 output_stream.write(line)
-                kept_reads += 1
-            else:
-                filtered_mapq += 1
-        except Exception:
-            msg = f"Invalid line {i+1}"
-            print(msg, file=sys.stderr)
-            log_to_file(log_path, msg)
+                continue
+            fields = line.split('\t')
+            try:
+                mapq = int(fields[4])
+                mapq_values[mapq] += 1
+                total_reads += 1
+                if total_reads % PROGRESS_BATCH == 0:
+                    progress.update(total_reads, kept_reads, fields[2])
+                if mapq >= mapq_threshold:
+                    output_stream.write(line)
+                    kept_reads += 1
+                else:
+                    filtered_mapq += 1
+            except Exception:
+                msg = f"Invalid line {i+1}"
+                print(msg, file=sys.stderr)
+                log_to_file(log_path, msg)
 
+        progress.update(total_reads, kept_reads)
     write_summary()
     plot_histogram()
 
@@ -109,6 +118,8 @@ def with_continuity_filter_sam(
     hist_name: str = None,
     verbose: bool = True,
     log_path: Optional[str] = None,
+    progress_path: Optional[str] = None,
+    plot_queue=None,
 ):
     total_reads = 0
     kept_reads = 0
@@ -136,20 +147,10 @@ def with_continuity_filter_sam(
 
     def plot_histogram():
         if mapq_hist_folder:
-            scores = sorted(mapq_values.keys())
-            counts = [mapq_values[score] for score in scores]
-            plt.figure(figsize=(8, 5))
-            plt.bar(scores, counts, color='steelblue', edgecolor='black', log=True)
-            plt.title("MAPQ Score Distribution")
-            plt.xlabel("MAPQ")
-            plt.ylabel("Read Count (log scale)")
-            plt.tight_layout()
             os.makedirs(mapq_hist_folder, exist_ok=True)
             out_path = os.path.join(mapq_hist_folder, hist_name)
-            plt.savefig(out_path)
-            msg = f"MAPQ histogram saved to {out_path}"
-            log(msg, verbose)
-            log_to_file(log_path, msg)
+            render(plot_queue, plot_mapq_histogram, dict(mapq_values), out_path, log_path,
+                   message=f"MAPQ histogram saved to {out_path}", verbose=verbose)
 
     prev_reads = []
     cur_reads = []
@@ -160,52 +161,56 @@ def with_continuity_filter_sam(
     bamfile = pysam.AlignmentFile(input_stream, "rb")
     output_sam = pysam.AlignmentFile(output_stream, "wh", template=bamfile)
 
-    for read in bamfile.fetch():
-        total_reads += 1
-        if read.is_unmapped or read.is_secondary or read.is_supplementary:
-            filtered_poor_mapping += 1
-            continue
-        if read.mapping_quality < low_mapq:
-            filtered_mapq += 1
-            continue
-        if next_read_name == read.query_name:
-            next_reads.append(read)
-        else:
-            for cur_read in cur_reads:
-                mapq_values[cur_read.mapping_quality] += 1
-                chrom = cur_read.reference_name
-                if any(keyword in chrom for keyword in skip_contigs):
-                    filtered_chrom += 1
-                    continue
-                if cur_read.mapping_quality >= mapq_threshold or \
-                   overlaps(cur_read, prev_reads) or overlaps(cur_read, next_reads):
-                    output_sam.write(cur_read)
-                    kept_reads += 1
-                else:
-                    filtered_disjoint += 1
-
-            prev_reads, cur_reads, next_reads = cur_reads, next_reads, [read]
-            next_read_name = read.query_name
-
-    # Final group processing
-    for cur_read in next_reads:
-        total_reads += 1
-        mapq_values[cur_read.mapping_quality] += 1
-        chrom = cur_read.reference_name
-        if any(keyword in chrom for keyword in skip_contigs):
-            filtered_chrom += 1
-            continue
-        if cur_read.mapping_quality < low_mapq:
-            filtered_mapq += 1
-            continue
-        if cur_read.mapping_quality >= mapq_threshold or overlaps(cur_read, cur_reads):
-            output_sam.write(cur_read)
-            kept_reads += 1
-        else:
-            filtered_disjoint += 1
+    with ProgressReporter("filter reads", progress_path=progress_path, verbose=verbose) as progress:
+        for read in bamfile.fetch():
+            total_reads += 1
+            if total_reads % PROGRESS_BATCH == 0:
+                progress.update(total_reads, kept_reads, read.reference_name)
+            if read.is_unmapped or read.is_secondary or read.is_supplementary:
+                filtered_poor_mapping += 1
+                continue
+            if read.mapping_quality < low_mapq:
+                filtered_mapq += 1
+                continue
+            if next_read_name == read.query_name:
+                next_reads.append(read)
+            else:
+                for cur_read in cur_reads:
+                    mapq_values[cur_read.mapping_quality] += 1
+                    chrom = cur_read.reference_name
+                    if any(keyword in chrom for keyword in skip_contigs):
+                        filtered_chrom += 1
+                        continue
+                    if cur_read.mapping_quality >= mapq_threshold or \
+                       overlaps(cur_read, prev_reads) or overlaps(cur_read, next_reads):
+                        output_sam.write(cur_read)
+                        kept_reads += 1
+                    else:
+                        filtered_disjoint += 1
+
+                prev_reads, cur_reads, next_reads = cur_reads, next_reads, [read]
+                next_read_name = read.query_name
+
+        # Final group processing
+        for cur_read in next_reads:
+            total_reads += 1
+            mapq_values[cur_read.mapping_quality] += 1
+            chrom = cur_read.reference_name
+            if any(keyword in chrom for keyword in skip_contigs):
+                filtered_chrom += 1
+                continue
+            if cur_read.mapping_quality < low_mapq:
+                filtered_mapq += 1
+                continue
+            if cur_read.mapping_quality >= mapq_threshold or overlaps(cur_read, cur_reads):
+                output_sam.write(cur_read)
+                kept_reads += 1
+            else:
+                filtered_disjoint += 1
 
-    bamfile.close()
-    output_sam.close()
+        bamfile.close()
+        output_sam.close()
+        progress.update(total_reads, kept_reads)
     write_summary()
     plot_histogram()
 
@@ -221,7 +226,8 @@ class Aligner:
         aligner_name=None,
         no_cache=False,
         cores = None,
-        verbose=True
+        verbose=True,
+        plot_queue=None
     ):
         self.species = species_genome.name
         self.reference = reference_genome.name
@@ -229,6 +235,7 @@ class Aligner:
         self.no_cache = no_cache
         self.verbose = verbose
         self.cores = cores if cores else multiprocessing.cpu_count()
+        self.plot_queue = plot_queue  # MAPQ histograms are drawn in the background when set
 
         self.species_fasta = species_genome.fasta_path
         self.reference_fasta = reference_genome.fasta_path
@@ -239,6 +246,7 @@ class Aligner:
         self.final_bam = f"{self.bam_dir}/{self.species}_to_{self.reference}.bam"
         self.hist_name = f"{self.species}_to_{self.reference}.png"
         self.log_path = self.final_bam.replace(".bam", ".log")
+        self.progress_path = os.path.join(self.output_dir, "progress.jsonl")
 
         os.makedirs(self.bam_dir, exist_ok=True)
         os.makedirs(self.plots_dir, exist_ok=True)
@@ -303,7 +311,9 @@ class Aligner:
                 mapq_hist_folder=self.plots_dir,
                 hist_name=self.hist_name,
                 verbose=self.verbose,
-                log_path=self.log_path
+                log_path=self.log_path,
+                progress_path=self.progress_path,
+                plot_queue=self.plot_queue
                 )
             else:
                 filter_sam(
@@ -313,7 +323,9 @@ class Aligner:
                     mapq_hist_folder=self.plots_dir,
                     hist_name=self.hist_name,
                     verbose=self.verbose,
-                    log_path=self.log_path
+                    log_path=self.log_path,
+                    progress_path=self.progress_path,
+                    plot_queue=self.plot_queue
                 )
         sort_proc.stdin.close()
         sort_proc.wait()
@@ -356,7 +368,9 @@ class Aligner:
                     mapq_hist_folder=self.plots_dir,
                     hist_name=self.hist_name,
                     verbose=self.verbose,
-                    log_path=self.log_path
+                    log_path=self.log_path,
+                    progress_path=self.progress_path,
+                    plot_queue=self.plot_queue
                 )
             else:
                 filter_sam(
@@ -366,7 +380,9 @@ class Aligner:
                     mapq_hist_folder=self.plots_dir,
                     hist_name=self.hist_name,
                     verbose=self.verbose,
-                    log_path=self.log_path
+                    log_path=self.log_path,
+                    progress_path=self.progress_path,
+                    plot_queue=self.plot_queue
                 )
             
             sort_proc.stdin.close()
@@ -0,0 +1,193 @@
+import itertools
+import json
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pysam
+
+from .progress_manager import ProgressReporter
+from .utils import log
+
+TRACK_BATCH_LINES = 1_000_000  # single-BAM pileup lines per vectorized batch
+
+# Per-position codes; any other value is the ASCII code of the sample's first base call
+TRACK_ABSENT = 0  # no read covers the position (samtools mpileup prints no line)
+TRACK_FAIL = 1  # covered, but the first call is a deletion or a read start/end mark
+TRACK_MATCH = 2  # ',' '.' or an empty base field: the reference base
+
+_NEWLINE, _TAB = ord("\n"), ord("\t")
+_FAIL = np.zeros(256, dtype=bool)
+_FAIL[list(b"*^$[]")] = True
+_MATCH = np.zeros(256, dtype=bool)
+_MATCH[list(b",.")] = True
+
+
+def base_call_track_path(track_dir, species, reference):
+    return os.path.join(track_dir, f"{species}_to_{reference}.track")
+
+
+def fasta_chromosome_lengths(fasta_path):
+    """{chromosome: length} in .fai order (the index is built if missing)."""
+    if not os.path.exists(fasta_path + ".fai"):
+        pysam.faidx(fasta_path)
+    with open(fasta_path + ".fai") as f:
+        return {fields[0]: int(fields[1]) for fields in (line.split("\t") for line in f if line.strip())}
+
+
+def _source_signature(bam, reference_fasta):
+    stat = os.stat(bam)
+    return {"bam": os.path.abspath(bam), "size": stat.st_size, "mtime": stat.st_mtime,
+            "reference": os.path.abspath(reference_fasta)}
+
+
+class BaseCallTrackWriter:
+    """
+    Fills one uint8 array per chromosome from single-BAM pileup text, written chromosome by
+    chromosome (only the current one is held in memory) into a temporary directory that close()
+    moves into place.
+    """
+    def __init__(self, path, chromosome_lengths):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.chromosome_lengths = dict(chromosome_lengths)
+        self._index = {name: i for i, name in enumerate(self.chromosome_lengths)}
+        self.chromosome = None
+        self._array = None
+        self.lines = 0
+        if os.path.exists(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+
+    def _switch(self, name):
+        if name == self.chromosome:
+            return
+        self._save()
+        if name not in self._index:
+            raise ValueError(f"Chromosome {name!r} is not in the reference index")
+        array_path = os.path.join(self.tmp_path, f"{self._index[name]}.npy")
+        if os.path.exists(array_path):
+            self._array = np.load(array_path)  # chromosome seen before in an unsorted pileup
+        else:
+            self._array = np.zeros(self.chromosome_lengths[name], dtype=np.uint8)
+        self.chromosome = name
+
+    def _save(self):
+        if self.chromosome is not None:
+            np.save(os.path.join(self.tmp_path, f"{self._index[self.chromosome]}.npy"), self._array)
+
+    def add(self, data):
+        """Add whole, newline-terminated single-BAM pileup lines (bytes)."""
+        buf = np.frombuffer(data, dtype=np.uint8)
+        ends = np.flatnonzero(buf == _NEWLINE)
+        if not len(ends):
+            return
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        tabs = np.flatnonzero(buf == _TAB)
+        tab_first = np.searchsorted(tabs, starts)
+        if (np.searchsorted(tabs, ends) - tab_first != 5).any():
+            raise ValueError("Base-call tracks are built from single-BAM pileup lines (6 columns)")
+        line_tabs = tabs[tab_first[:, None] + np.arange(5)]
+
+        digits = line_tabs[:, 1] - line_tabs[:, 0] - 1
+        positions = np.zeros(len(starts), dtype=np.int64)
+        for k in range(int(digits.max())):
+            digit = buf[np.minimum(line_tabs[:, 0] + 1 + k, len(buf) - 1)].astype(np.int64) - ord("0")
+            positions = np.where(k < digits, positions * 10 + digit, positions)
+
+        first = buf[line_tabs[:, 3] + 1]
+        codes = np.where(_MATCH[first] | (line_tabs[:, 3] + 1 == line_tabs[:, 4]), TRACK_MATCH,
+                         np.where(_FAIL[first], TRACK_FAIL, first)).astype(np.uint8)
+
+        # Lines are grouped by chromosome; only batches that cross a boundary are split by name
+        names = [bytes(data[start:tab]).decode() for start, tab in ((starts[0], line_tabs[0, 0]),
+                                                                      (starts[-1], line_tabs[-1, 0]))]
+        if names[0] == names[1]:
+            runs = [(names[0], 0, len(starts))]
+        else:
+            line_names = [bytes(data[s:t]).decode() for s, t in zip(starts.tolist(), line_tabs[:, 0].tolist())]
+            runs, lo = [], 0
+            for name, group in itertools.groupby(line_names):
+                n = sum(1 for _ in group)
+                runs.append((name, lo, lo + n))
+                lo += n
+        for name, lo, hi in runs:
+            self._switch(name)
+            self._array[positions[lo:hi] - 1] = codes[lo:hi]
+        self.lines += len(starts)
+
+    def close(self, source):
+        self._save()
+        with open(os.path.join(self.tmp_path, "meta.json"), "w") as f:
+            json.dump({"source": source, "lines": self.lines,
+                       "chromosomes": [[name, length] for name, length in self.chromosome_lengths.items()]}, f, indent=2)
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self.tmp_path, self.path)
+
+
+class BaseCallTrack:
+    """
+    Read-only view of a base-call track directory: meta.json plus <i>.npy, a uint8 array per
+    covered chromosome (i = its .fai index) holding TRACK_ABSENT, TRACK_FAIL, TRACK_MATCH or the
+    ASCII code of the sample's first base call at every position.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.source = meta["source"]
+        self.chromosome_lengths = {name: length for name, length in meta["chromosomes"]}
+        self._index = {name: i for i, name in enumerate(self.chromosome_lengths)}
+
+    @staticmethod
+    def is_current(path, bam, reference_fasta):
+        """True if the track at path was built from this BAM (same size and mtime) and reference."""
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return False
+        return BaseCallTrack(path).source == _source_signature(bam, reference_fasta)
+
+    def chromosome(self, name):
+        if name not in self._index:
+            raise KeyError(f"Chromosome {name!r} is not in track {self.path}")
+        array_path = os.path.join(self.path, f"{self._index[name]}.npy")
+        if os.path.exists(array_path):
+            return np.load(array_path, mmap_mode='r')
+        return np.zeros(self.chromosome_lengths[name], dtype=np.uint8)
+
+
+def build_base_call_track(bam, reference_fasta, path, no_cache=False, progress_path=None, verbose=True):
+    """
+    Base-call track of one BAM against the shared reference, from the same samtools mpileup call
+    as the N-BAM pileup restricted to this BAM. Reused while the BAM and reference are unchanged.
+    """
+    if not no_cache and BaseCallTrack.is_current(path, bam, reference_fasta):
+        log(f"Base-call track already exists: {path}", verbose)
+        return path
+
+    log(f"Building base-call track: {path}", verbose)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    writer = BaseCallTrackWriter(path, fasta_chromosome_lengths(reference_fasta))
+    cmd = ["samtools", "mpileup", "-f", reference_fasta, "-B", "-d", "100", bam]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    progress = ProgressReporter(f"base calls {os.path.basename(bam)}", progress_path=progress_path,
+                                verbose=verbose).start()
+    try:
+        while True:
+            lines = list(itertools.islice(proc.stdout, TRACK_BATCH_LINES))
+            if not lines:
+                break
+            data = b"".join(lines)
+            writer.add(data if data.endswith(b"\n") else data + b"\n")
+            progress.update(writer.lines, chromosome=writer.chromosome)
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+        progress.stop()
+    if returncode != 0:
+        shutil.rmtree(writer.tmp_path, ignore_errors=True)
+        raise RuntimeError(f"samtools mpileup failed with exit code {returncode}: {' '.join(cmd)}")
+    writer.close(_source_signature(bam, reference_fasta))
+    log(f"Base-call track written to: {path}", verbose)
+    return path
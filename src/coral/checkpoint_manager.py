@@ -0,0 +1,175 @@
+import gzip
+import io
+import itertools
+import json
+import os
+
+import pysam
+
+from .utils import log
+
+DEFAULT_CHECKPOINT_INTERVAL = 10_000_000  # pileup lines between checkpoints
+
+
+def is_bgzf(path):
+    """True if the file starts with a BGZF block header (gzip member with a 'BC' extra subfield)."""
+    with open(path, 'rb') as f:
+        header = f.read(18)
+    return (
+        len(header) == 18
+        and header[:4] == b"\x1f\x8b\x08\x04"
+        and header[12:14] == b"BC"
+    )
+
+
+class PileupReader:
+    """
+    Line reader over a gzipped pileup that can report and restore its position.
+
+    BGZF input is read with pysam and positioned by BGZF virtual offset, so resuming is a seek.
+    Plain gzip input cannot be seeked; its position is the number of lines read, and resuming
+    re-reads (but does not process) the skipped lines.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.bgzf = is_bgzf(path)
+        self.lines_read = 0
+        self.bytes_read = 0
+        self.total_bytes = os.path.getsize(path)
+        self._handle = pysam.BGZFile(path, 'rb') if self.bgzf else gzip.open(path, 'rt')
+
+    def readline(self):
+        line = self._handle.readline()
+        if not line:
+            return ''
+        self.lines_read += 1
+        self.bytes_read += len(line) + self.bgzf  # pysam strips the newline
+        return line.decode() if self.bgzf else line
+
+    def __iter__(self):
+        if self.bgzf:
+            for line in self._handle:
+                self.bytes_read += len(line) + 1
+                yield line.decode()
+        else:
+            for line in self._handle:
+                self.lines_read += 1
+                self.bytes_read += len(line)
+                yield line
+
+    def read_batch(self, max_lines):
+        """Up to max_lines lines as one newline-terminated string, and the number of lines read."""
+        lines = list(itertools.islice(self, max_lines))
+        if self.bgzf:
+            self.lines_read += len(lines)
+            return "\n".join(lines) + "\n" if lines else "", len(lines)
+        text = "".join(lines)
+        return text if not text or text.endswith("\n") else text + "\n", len(lines)
+
+    def compressed_offset(self):
+        """Bytes of compressed input consumed so far."""
+        if self.bgzf:
+            return self._handle.tell() >> 16
+        return self._handle.buffer.fileobj.tell()
+
+    def tell(self):
+        return self._handle.tell() if self.bgzf else self.lines_read
+
+    def seek(self, position):
+        if self.bgzf:
+            self._handle.seek(position)
+            return
+        self._handle.close()
+        self._handle = gzip.open(self.path, 'rt')
+        for _ in range(position):
+            self._handle.readline()
+        self.lines_read = position
+
+    def close(self):
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CheckpointedGzipWriter:
+    """
+    Gzip text writer that ends the current gzip member at every checkpoint.
+
+    The file is then a valid multi-member gzip up to the returned length, so a resumed run
+    can truncate it back to that length and keep appending.
+    """
+    def __init__(self, path, resume_length=None):
+        self.path = path
+        if resume_length is None:
+            self._raw = open(path, 'wb')
+        else:
+            self._raw = open(path, 'r+b')
+            self._raw.truncate(resume_length)
+            self._raw.seek(resume_length)
+        self._text = self._new_member()
+
+    def _new_member(self):
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=self._raw, mode='wb'), encoding='utf-8')
+
+    def write(self, text):
+        return self._text.write(text)
+
+    def checkpoint(self):
+        self._text.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        length = self._raw.tell()
+        self._text = self._new_member()
+        return length
+
+    def close(self):
+        self._text.close()
+        self._raw.close()
+
+
+class ExtractionCheckpoint:
+    """
+    JSON checkpoint of a long extraction: input position, sliding-window state, partial counters
+    and flushed output lengths. Written atomically; ignored if the input file has changed.
+    """
+    def __init__(self, path, input_path, interval=DEFAULT_CHECKPOINT_INTERVAL, verbose=True):
+        self.path = path
+        self.input_path = input_path
+        self.interval = interval
+        self.verbose = verbose
+
+    def _input_signature(self):
+        stat = os.stat(self.input_path)
+        return {"path": os.path.abspath(self.input_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        if not self.exists():
+            return None
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get("input") != self._input_signature():
+            log(f"Input changed since checkpoint {self.path}; starting over.", self.verbose)
+            self.clear()
+            return None
+        log(f"Resuming from checkpoint {self.path}", self.verbose)
+        return state
+
+    def save(self, state):
+        state = dict(state, input=self._input_signature())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
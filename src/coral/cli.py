@@ -2,17 +2,17 @@ import argparse
 import json
 import os
 import sys
-from .pipeline import MutationExtractionPipeline, MultiSpeciesMutationPipeline
-from .run_phylip import run_phylip
+from .pipeline import CohortPipeline, MutationExtractionPipeline, MultiSpeciesMutationPipeline
+from .run_phylip import MAX_PHYLIP_SITES, run_phylip
 
 def main():
     parser = argparse.ArgumentParser(description="Species Mutation Extraction CLI")
     subparsers = parser.add_subparsers(dest="subcmd")
 
     # === Single-Pipeline ===
-    single = subparsers.add_parser("run_single", help="Run 3-species pipeline (outgroup + 2)")
+    single = subparsers.add_parser("run_single", help="Run triad pipeline (outgroup + 2, or every pair of K ingroups from one pileup)")
     single.add_argument("--outgroup", nargs=2, metavar=("NAME", "ACCESSION"), required=True)
-    single.add_argument("--species", nargs=4, metavar=("NAME1", "ACC1", "NAME2", "ACC2"), required=True)
+    single.add_argument("--species", nargs="+", metavar="NAME ACC", required=True, help="Ingroup NAME ACCESSION pairs; with more than two ingroups, every pair's triad spectra are extracted from one pileup")
     single.add_argument("--output", required=True)
     single.add_argument("--no-cache", action="store_true")
     verbose_group = single.add_mutually_exclusive_group()
@@ -29,7 +29,37 @@ def main():
     continuity_group.add_argument("--continuity", action="store_true", default=True, help="Enable continuity mode (default)")
     continuity_group.add_argument("--no-continuity", dest="continuity", action="store_false", help="Disable continuity mode")
     single.add_argument("--cores", type=int, default=None)
+    single.add_argument("--plot-jobs", type=int, default=None, help="Processes drawing plots in the background while later stages run (0: draw inline; default: up to 4)")
     single.add_argument("--divergence-time", type=int, default=None)
+    single.add_argument("--filter-profiles", type=json.loads, default=None, help='Named QC profiles as JSON, evaluated in one pileup pass, e.g. \'[{"name": "strict"}, {"name": "relaxed", "max_discordant": 1, "min_depth": 2, "allow_flank_deletions": true}]\'')
+    single.add_argument("--kmer-sizes", type=int, nargs="+", default=None, help="Extra odd k-mer context sizes (3-11) to count in one pileup pass, e.g. 5 7 9 (5 replaces the separate 5-mer pass)")
+    single.add_argument("--spectra-only", action="store_true", help="Only produce the Tables/ spectra: skip per-site mutation CSVs, 5-mers, intervals and coverage/density plots")
+
+    # === Cohort of triads sharing genomes and alignments ===
+    cohort = subparsers.add_parser("run_cohort", help="Run many triads, aligning each (species, outgroup, MAPQ settings) once")
+    cohort.add_argument("--triads", type=json.loads, required=True, help='Triads as JSON, e.g. \'[{"outgroup": ["O", "GCF_..."], "species": [["A", "GCF_..."], ["B", "GCF_..."]]}, ...]\'; a triad may also set "run_id" and override settings such as "mapq" or "suffix"')
+    cohort.add_argument("--output", required=True)
+    cohort.add_argument("--cohort-id", default="cohort")
+    cohort.add_argument("--jobs", type=int, default=2, help="Alignments and triads run concurrently (default: 2)")
+    cohort.add_argument("--no-cache", action="store_true")
+    verbose_group_cohort = cohort.add_mutually_exclusive_group()
+    verbose_group_cohort.add_argument("--verbose", dest="verbose", action="store_true", help="Enable verbose logging (default: enabled)")
+    verbose_group_cohort.add_argument("--quiet", dest="verbose", action="store_false", help="Disable verbose logging")
+    cohort.set_defaults(verbose=True)
+    cohort.add_argument("--aligner-name", default="bwa")
+    cohort.add_argument("--aligner-cmd", default=None)
+    cohort.add_argument("--streamed", action="store_true")
+    cohort.add_argument("--mapq", type=int, default=60)
+    cohort.add_argument("--low-mapq", type=int, default=1)
+    continuity_group_cohort = cohort.add_mutually_exclusive_group()
+    continuity_group_cohort.add_argument("--continuity", action="store_true", default=True, help="Enable continuity mode (default)")
+    continuity_group_cohort.add_argument("--no-continuity", dest="continuity", action="store_false", help="Disable continuity mode")
+    cohort.add_argument("--cores", type=int, default=None, help="Cores per alignment job")
+    cohort.add_argument("--plot-jobs", type=int, default=1, help="Background plot processes per triad (0: draw inline)")
+    cohort.add_argument("--divergence-time", type=int, default=None)
+    cohort.add_argument("--filter-profiles", type=json.loads, default=None)
+    cohort.add_argument("--kmer-sizes", type=int, nargs="+", default=None)
+    cohort.add_argument("--spectra-only", action="store_true")
 
     multi = subparsers.add_parser("run_multi", help="Run multi-species pipeline from Newick")
     multi.add_argument("--newick-tree", default=None)
@@ -51,15 +81,24 @@ def main():
     multi.add_argument("--mapq", type=int, default=60)
     multi.add_argument("--low-mapq", type=int, default=1)
     multi.add_argument("--cores", type=int, default=None)
+    multi.add_argument("--plot-jobs", type=int, default=None, help="Processes drawing plots in the background while later stages run (0: draw inline; default: up to 4)")
+    multi.add_argument("--export-csv", action="store_true", help="Also export the variable-site matrix as matching_bases.csv.gz")
+    multi.add_argument("--bootstrap", type=int, default=0, help="Number of bootstrap replicates for the PHYLIP tree")
+    multi.add_argument("--base-call-tracks", action="store_true", help="Build the site matrix by joining cached per-species base-call tracks instead of one N-BAM pileup")
 
     # === Run PHYLIP ===
     phylip = subparsers.add_parser("run_phylip", help="Run PHYLIP on mutation matrix")
-    phylip.add_argument("--df", required=True, help="Path to matching_bases.csv.gz")
+    phylip.add_argument("--df", required=True, help="Path to matching_bases.sites (site matrix) or matching_bases.csv.gz")
     phylip.add_argument("--tree", required=True, help="Path to annotated_tree.nwk")
     phylip.add_argument("--mapping", required=True, help="Path to species_mapping.json")
     phylip.add_argument("--phylip-command", dest="phylip_command", default="dnapars", help="PHYLIP command: dnapars, dnapenny, etc.")
     phylip.add_argument("--prefix", default="phylip_run")
     phylip.add_argument("--input-string", default="Y\n")
+    phylip.add_argument("--max-sites", dest="max_sites", type=int, default=None, help=f"Random sample size of variable sites given to PHYLIP (default: all sites as weighted patterns for dnapars/dnapenny/dnacomp, else {MAX_PHYLIP_SITES})")
+    phylip.add_argument("--stratify", action="store_true", help="Sample sites per chromosome, proportionally to its number of variable sites")
+    phylip.add_argument("--seed", type=int, default=42, help="Seed for the site sample and bootstrap replicates")
+    phylip.add_argument("--bootstrap", type=int, default=0, help="Number of bootstrap replicates for a majority-rule consensus with support values")
+    phylip.add_argument("--cores", type=int, default=None, help="Concurrent PHYLIP runs (default: all cores)")
     verbose_group_phylip = phylip.add_mutually_exclusive_group()
     verbose_group_phylip.add_argument("--verbose", dest="verbose", action="store_true", help="Enable verbose logging (default: enabled)")
     verbose_group_phylip.add_argument("--quiet", dest="verbose", action="store_false", help="Disable verbose logging")
@@ -69,8 +108,10 @@ def main():
 
     try:
         if args.subcmd == "run_single":
+            if len(args.species) < 4 or len(args.species) % 2:
+                parser.error("--species takes NAME ACCESSION pairs for at least two ingroups")
             pipeline = MutationExtractionPipeline(
-                species_list=[(args.species[0], args.species[1]), (args.species[2], args.species[3])],
+                species_list=list(zip(args.species[::2], args.species[1::2])),
                 outgroup=(args.outgroup[0], args.outgroup[1]),
                 base_output_dir=args.output,
                 no_cache=args.no_cache,
@@ -84,6 +125,33 @@ def main():
                 cores=args.cores,
                 continuity=args.continuity,
                 divergence_time=args.divergence_time,
+                kmer_sizes=args.kmer_sizes,
+                spectra_only=args.spectra_only,
+                filter_profiles=args.filter_profiles,
+                plot_jobs=args.plot_jobs,
+            )
+            pipeline.run()
+
+        elif args.subcmd == "run_cohort":
+            pipeline = CohortPipeline(
+                triads=args.triads,
+                base_output_dir=args.output,
+                cohort_id=args.cohort_id,
+                jobs=args.jobs,
+                no_cache=args.no_cache,
+                verbose=args.verbose,
+                aligner_name=args.aligner_name,
+                aligner_cmd=args.aligner_cmd,
+                streamed=args.streamed,
+                mapq=args.mapq,
+                low_mapq=args.low_mapq,
+                cores=args.cores,
+                continuity=args.continuity,
+                divergence_time=args.divergence_time,
+                kmer_sizes=args.kmer_sizes,
+                spectra_only=args.spectra_only,
+                filter_profiles=args.filter_profiles,
+                plot_jobs=args.plot_jobs,
             )
             pipeline.run()
 
@@ -103,6 +171,10 @@ def main():
                 low_mapq=args.low_mapq,
                 cores=args.cores,
                 continuity=args.continuity,
+                export_csv=args.export_csv,
+                bootstrap=args.bootstrap,
+                base_call_tracks=args.base_call_tracks,
+                plot_jobs=args.plot_jobs,
             )
             pipeline.run()
 
@@ -117,6 +189,11 @@ def main():
                 prefix=args.prefix,
                 input_string=args.input_string,
                 mapping=mapping,
+                max_sites=args.max_sites,
+                stratify=args.stratify,
+                seed=args.seed,
+                bootstrap=args.bootstrap,
+                workers=args.cores,
                 verbose=args.verbose
             )
 
@@ -0,0 +1,140 @@
+import numpy as np
+from collections import defaultdict
+
+BASES = "ACGT"
+BASE_INDEX = {base: idx for idx, base in enumerate(BASES)}
+MIN_K = 3
+MAX_K = 11
+
+
+def validate_k(k):
+    if not isinstance(k, (int, np.integer)) or k % 2 == 0 or not MIN_K <= k <= MAX_K:
+        raise ValueError(f"k must be an odd integer between {MIN_K} and {MAX_K}, got {k!r}")
+    return int(k)
+
+
+def encode_kmer(kmer):
+    """Return the base-4 integer code of a k-mer, or None if it contains a non-ACGT base."""
+    code = 0
+    for base in kmer:
+        idx = BASE_INDEX.get(base)
+        if idx is None:
+            return None
+        code = code * 4 + idx
+    return code
+
+
+def decode_kmer(code, k):
+    bases = []
+    for _ in range(k):
+        code, idx = divmod(int(code), 4)
+        bases.append(BASES[idx])
+    return ''.join(reversed(bases))
+
+
+def encode_mutation(context_code, k, alt):
+    """Mutation code = context_code * 3 + rank of the derived base among the three non-reference bases."""
+    ref_idx = (context_code >> (k - 1)) & 3
+    alt_idx = BASE_INDEX[alt]
+    return context_code * 3 + alt_idx - (alt_idx > ref_idx)
+
+
+def decode_mutation(code, k):
+    context_code, alt_rank = divmod(int(code), 3)
+    context = decode_kmer(context_code, k)
+    center = k // 2
+    ref_idx = BASE_INDEX[context[center]]
+    alt = BASES[alt_rank + (alt_rank >= ref_idx)]
+    return f"{context[:center]}[{context[center]}>{alt}]{context[center + 1:]}"
+
+
+def _code_digits(codes, k):
+    codes = np.asarray(codes, dtype=np.int64)
+    shifts = 2 * np.arange(k - 1, -1, -1, dtype=np.int64)
+    return (codes[:, None] >> shifts) & 3
+
+
+def _digits_to_codes(digits):
+    k = digits.shape[1]
+    shifts = 2 * np.arange(k - 1, -1, -1, dtype=np.int64)
+    return (digits.astype(np.int64) << shifts).sum(axis=1)
+
+
+def reverse_complement_codes(codes, k):
+    return _digits_to_codes(3 - _code_digits(codes, k)[:, ::-1])
+
+
+def _sum_by_code(codes, counts):
+    unique, inverse = np.unique(codes, return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts, minlength=len(unique)).astype(np.int64)
+
+
+def collapse_context_codes(codes, counts, k):
+    """Fold contexts with a purine center onto their pyrimidine-centered reverse complement."""
+    codes = np.asarray(codes, dtype=np.int64)
+    if len(codes) == 0:
+        return codes, np.asarray(counts, dtype=np.int64)
+    center = (codes >> (k - 1)) & 3
+    purine = (center == BASE_INDEX['A']) | (center == BASE_INDEX['G'])
+    folded = np.where(purine, reverse_complement_codes(codes, k), codes)
+    return _sum_by_code(folded, counts)
+
+
+def collapse_mutation_codes(codes, counts, k):
+    """Strand-collapse mutation codes the same way MutationNormalizer.collapse_mutations does for strings."""
+    codes = np.asarray(codes, dtype=np.int64)
+    if len(codes) == 0:
+        return codes, np.asarray(counts, dtype=np.int64)
+    context_codes, alt_rank = np.divmod(codes, 3)
+    ref_idx = (context_codes >> (k - 1)) & 3
+    alt_idx = alt_rank + (alt_rank >= ref_idx)
+    purine = (ref_idx == BASE_INDEX['A']) | (ref_idx == BASE_INDEX['G'])
+
+    rc_context = reverse_complement_codes(context_codes, k)
+    rc_ref = 3 - ref_idx
+    rc_alt = 3 - alt_idx
+    rc_codes = rc_context * 3 + rc_alt - (rc_alt > rc_ref)
+
+    folded = np.where(purine, rc_codes, codes)
+    return _sum_by_code(folded, counts)
+
+
+class SparseKmerCounts:
+    """Counts keyed by integer k-mer (or k-mer mutation) codes, saved as sorted code/count arrays."""
+
+    def __init__(self, k, kind="contexts"):
+        if kind not in {"contexts", "mutations"}:
+            raise ValueError(f"Unknown count kind: {kind}")
+        self.k = validate_k(k)
+        self.kind = kind
+        self.counts = defaultdict(int)
+
+    def add(self, code, n=1):
+        self.counts[code] += n
+
+    def __len__(self):
+        return len(self.counts)
+
+    def to_arrays(self):
+        codes = np.fromiter(self.counts.keys(), dtype=np.uint32, count=len(self.counts))
+        counts = np.fromiter(self.counts.values(), dtype=np.int64, count=len(self.counts))
+        order = np.argsort(codes)
+        return codes[order], counts[order]
+
+    def to_dict(self):
+        decode = decode_mutation if self.kind == "mutations" else decode_kmer
+        codes, counts = self.to_arrays()
+        return {decode(code, self.k): int(count) for code, count in zip(codes, counts)}
+
+    def save(self, path):
+        codes, counts = self.to_arrays()
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, k=np.int64(self.k), kind=np.array(self.kind), codes=codes, counts=counts)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            store = cls(int(data["k"]), str(data["kind"]))
+            for code, count in zip(data["codes"].tolist(), data["counts"].tolist()):
+                store.counts[code] = count
+        return store
@@ -1,23 +1,219 @@
-import csv
 import os
 import gzip
 import json
-from collections import defaultdict
+import numpy as np
 import pandas as pd
-from .multiple_species_utils import annotate_tree_with_indices, save_annotated_tree, collapse_mutations, filter_mutations_dict
+import pysam
+from .base_call_tracks import TRACK_ABSENT, TRACK_FAIL, TRACK_MATCH, BaseCallTrack
+from .checkpoint_manager import DEFAULT_CHECKPOINT_INTERVAL, ExtractionCheckpoint, PileupReader
+from .multiple_species_utils import annotate_tree_with_indices, save_annotated_tree
+from .parsimony import (ACGT_INDEX, COLLAPSED_CONTEXT_INDEX, COLLAPSED_CONTEXTS, CONTEXTS, MUTATION_CLASSES, CompiledTree,
+                        context_counts, run_fitch)
+from .plot_queue import render
 from .plot_utils import MutationSpectraPlotter
+from .progress_manager import ProgressReporter
+from .site_matrix import SiteMatrix, SiteMatrixWriter, site_matrix_path
 from .utils import log
 
+FITCH_CHUNK_SIZE = 100_000  # matching-bases rows per vectorized Fitch batch
+SCAN_BATCH_LINES = 100_000  # pileup lines per vectorized scan batch
+TRACK_JOIN_BLOCK = 10_000_000  # reference positions per block when joining base-call tracks
+
+_NEWLINE, _TAB = ord("\n"), ord("\t")
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[list(b" \t\n\r\x0b\x0c")] = True
+_QC_FAIL = np.zeros(256, dtype=bool)  # '*' and read start/end marks fail the per-sample check
+_QC_FAIL[list(b"*^$[]")] = True
+_MATCH = np.zeros(256, dtype=bool)
+_MATCH[list(b",.")] = True
+_UPPER = np.arange(256, dtype=np.uint8)
+_UPPER[ord("a"):ord("z") + 1] -= 32
+
+
+class PileupBlockScanner:
+    """
+    Vectorized scan of the pileup in windows of three lines parsed by _parse_line.
+
+    A batch of pileup text becomes a lines x (1 + samples) uint8 array of ASCII codes (reference
+    base, then each sample's first base call with ',' '.' or an empty field replaced by the
+    reference). QC and flank conservation are then column operations, and the variable sites
+    go straight into a SiteMatrixWriter. Lines that do not have the standard 3 * n_species
+    column layout, or carry surrounding whitespace, go through parse_line instead.
+
+    Windows that pass the same QC with conserved flanks and the same base in every taxon are
+    callable invariant sites; their trinucleotides are counted in `contexts` (CONTEXTS order) as
+    the denominators shared by all branches.
+
+    The last two lines of every batch are kept in `carry` and rescanned with the next one, so the
+    result does not depend on where batches are cut; `carry` and `contexts` are all the state a
+    checkpoint needs.
+    """
+    def __init__(self, n_species, parse_line, carry="", contexts=None):
+        self.n_species = n_species
+        self.parse_line = parse_line
+        self.n_tabs = 3 * n_species - 1
+        self.carry = carry
+        self.contexts = np.zeros(len(CONTEXTS), dtype=np.int64) if contexts is None else np.asarray(contexts, dtype=np.int64)
+
+    def _codes(self, text, buf, starts, ends, tabs, tab_first, tab_count):
+        n_lines = len(starts)
+        codes = np.zeros((n_lines, self.n_species), dtype=np.uint8)
+        valid = np.zeros(n_lines, dtype=bool)
+
+        standard = (tab_count == self.n_tabs) & (ends > starts)
+        rows = np.flatnonzero(standard)
+        standard[rows] = ~_WHITESPACE[buf[starts[rows]]] & ~_WHITESPACE[buf[ends[rows] - 1]]
+        rows = np.flatnonzero(standard)
+        line_tabs = tabs[tab_first[rows][:, None] + np.arange(self.n_tabs)]
+        standard[rows] = line_tabs[:, 2] - line_tabs[:, 1] == 2  # single-character reference
+        keep = standard[rows]
+        rows, line_tabs = rows[keep], line_tabs[keep]
+
+        ref = buf[line_tabs[:, 1] + 1]
+        base_starts = line_tabs[:, 3::3] + 1
+        first = buf[base_starts]
+        use_ref = _MATCH[first] | (base_starts == line_tabs[:, 4::3])
+        codes[rows, 0] = ref
+        codes[rows, 1:] = np.where(use_ref, ref[:, None], first)
+        valid[rows] = True
+
+        for row in np.flatnonzero(~standard).tolist():
+            fields = self.parse_line(text[starts[row]:ends[row]])
+            if fields is None or len(fields) != self.n_species + 2 or any(len(f) != 1 for f in fields[2:]):
+                continue  # not representable as one base per taxon; fails QC
+            codes[row] = np.frombuffer("".join(fields[2:]).encode("latin-1", "replace"), dtype=np.uint8)
+            valid[row] = True
+        return codes, valid
+
+    def scan(self, batch, writer):
+        """
+        Scan a batch of whole, newline-terminated lines and append its variable sites to writer.
+        Returns (new lines, new lines passing QC, last chromosome seen).
+        """
+        text = self.carry + batch
+        buf = np.frombuffer(text.encode("latin-1", "replace"), dtype=np.uint8)
+        ends = np.flatnonzero(buf == _NEWLINE)
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        tabs = np.flatnonzero(buf == _TAB)
+        tab_first = np.searchsorted(tabs, starts)
+        tab_count = np.searchsorted(tabs, ends) - tab_first
+        n_carried = self.carry.count("\n")
+        self.carry = text[starts[-2]:] if len(starts) > 2 else text
+
+        codes, valid = self._codes(text, buf, starts, ends, tabs, tab_first, tab_count)
+        passed, centers = self.windows(codes, valid)
+        if len(centers):
+            chromosome_ids, positions = [], []
+            for row in centers.tolist():
+                chrom_end, pos_end = tabs[tab_first[row]], tabs[tab_first[row] + 1]
+                chromosome_ids.append(writer.chromosome_id(text[starts[row]:chrom_end]))
+                positions.append(int(text[chrom_end + 1:pos_end]))
+            writer.append_block(chromosome_ids, positions, _UPPER[codes[centers - 1, 1]],
+                                _UPPER[codes[centers + 1, 1]], _UPPER[codes[centers]])
+
+        chromosome = text[starts[-1]:tabs[tab_first[-1]]] if len(starts) and tab_count[-1] else None
+        return len(starts) - n_carried, int(passed[n_carried:].sum()), chromosome
+
+    def windows(self, codes, valid):
+        """
+        QC of consecutive lines x (1 + samples) codes: returns (passed per line, rows of the variable
+        window centers) and adds the contexts of the callable invariant centers.
+        """
+        samples = codes[:, 1:]
+        passed = valid & ~_QC_FAIL[samples].any(axis=1)
+        conserved = (samples == samples[:, :1]).all(axis=1)
+
+        window = passed[:-2] & passed[1:-1] & passed[2:] & conserved[:-2] & conserved[2:]
+        invariant = np.flatnonzero(window & conserved[1:-1] & (_UPPER[codes[1:-1, 0]] == _UPPER[codes[1:-1, 1]])) + 1
+        self.contexts += context_counts(_UPPER[codes[invariant - 1, 1]], ACGT_INDEX[_UPPER[codes[invariant, 1]]],
+                                        _UPPER[codes[invariant + 1, 1]])
+        return passed, np.flatnonzero(window & ~conserved[1:-1]) + 1
+
+
+class TrackJoinScanner:
+    """
+    Site-matrix scan over per-species BaseCallTracks instead of an N-BAM pileup.
+
+    The rows are the positions covered in at least one species, in reference order: exactly the
+    lines samtools mpileup prints for the N BAMs. Sample codes are resolved against the reference
+    (TRACK_MATCH -> reference base, absent or failed calls -> '*') and go through the same
+    PileupBlockScanner.windows, with the last two rows carried over block and chromosome
+    boundaries, so the matrix is the one the pileup scan would write.
+    """
+    def __init__(self, reference_fasta, tracks, block_size=None):
+        self.reference_fasta = reference_fasta
+        self.tracks = tracks
+        self.block_size = block_size or TRACK_JOIN_BLOCK
+        self.scanner = PileupBlockScanner(len(tracks) + 1, parse_line=None)
+
+    def scan(self, writer, progress=None):
+        carry = None
+        rows = passed = 0
+        with pysam.FastaFile(self.reference_fasta) as fasta:
+            for chromosome in fasta.references:
+                chromosome_id = None
+                reference = np.frombuffer(fasta.fetch(chromosome).encode("latin-1", "replace"), dtype=np.uint8)
+                arrays = [track.chromosome(chromosome) for track in self.tracks]
+                for start in range(0, len(reference), self.block_size):
+                    calls = np.stack([array[start:start + self.block_size] for array in arrays], axis=1)
+                    covered = np.flatnonzero((calls != TRACK_ABSENT).any(axis=1))
+                    if not len(covered):
+                        continue
+                    if chromosome_id is None:
+                        chromosome_id = writer.chromosome_id(chromosome)
+                    ref = reference[start + covered]
+                    calls = calls[covered]
+                    samples = np.where(calls == TRACK_MATCH, ref[:, None],
+                                       np.where(calls <= TRACK_FAIL, ord("*"), calls)).astype(np.uint8)
+                    block = (np.column_stack([ref, samples]), np.full(len(covered), chromosome_id, dtype=np.int32),
+                             (start + covered + 1).astype(np.int32))
+                    n_carried = 0
+                    if carry is not None:
+                        n_carried = len(carry[0])
+                        block = tuple(np.concatenate([old, new]) for old, new in zip(carry, block))
+                    codes, chromosome_ids, positions = block
+                    block_passed, centers = self.scanner.windows(codes, np.ones(len(codes), dtype=bool))
+                    if len(centers):
+                        writer.append_block(chromosome_ids[centers], positions[centers], _UPPER[codes[centers - 1, 1]],
+                                            _UPPER[codes[centers + 1, 1]], _UPPER[codes[centers]])
+                    carry = tuple(array[-2:] for array in block)
+                    rows += len(codes) - n_carried
+                    passed += int(block_passed[n_carried:].sum())
+                    if progress is not None:
+                        progress.update(rows, passed, chromosome)
+        return rows, passed
+
+    @property
+    def contexts(self):
+        return self.scanner.contexts
+
 
 class MultipleSpeciesMutationExtractor:
-    def __init__(self, pileup_file, output_dir, n_species, tree=None, species_list=None, mapping=None, no_cache=False, verbose=False):
+    def __init__(self, pileup_file, output_dir, n_species, tree=None, species_list=None, mapping=None, no_cache=False,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, progress_path=None, workers=1, export_csv=False,
+                 tracks=None, reference_fasta=None, plot_queue=None, verbose=False):
+        """
+        With tracks (BaseCallTrack paths, one per sample column) and reference_fasta, the site matrix
+        is joined from the cached per-species tracks instead of scanned from pileup_file; it is
+        rebuilt whenever the set of tracks changes. With a plot_queue, the per-branch spectra are
+        drawn in the background and the caller waits for them.
+        """
+        if tracks is not None and reference_fasta is None:
+            raise ValueError("reference_fasta is required to join base-call tracks.")
         self.pileup_file = pileup_file
+        self.tracks = tracks
+        self.reference_fasta = reference_fasta
         self.output_dir = output_dir
         self.n_species = n_species
         self.tree = tree
         self.species_list = species_list
         self.mapping = mapping
         self.no_cache = no_cache
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_path = progress_path
+        self.workers = workers
+        self.export_csv = export_csv
+        self.plot_queue = plot_queue
         self.verbose = verbose
         if self.tree is None and self.species_list is None:
             raise ValueError("Either newick_tree or species_list must be provided.")
@@ -31,17 +227,6 @@ class MultipleSpeciesMutationExtractor:
         self.plots_dir = os.path.join(self.output_dir, "Plots")
         self.csv_dir = os.path.join(self.output_dir, "CSVs")
 
-    def _all_same(self, seq):
-        return len(seq) > 0 and all(ch == seq[0] for ch in seq)
-
-    def _quality_check(self, fields):
-        sample_fields = fields[3:]
-        return (
-            sample_fields
-            and all('*' not in field for field in sample_fields)
-            and all(self._all_same(field.translate(str.maketrans('', '', '^$[]'))) for field in sample_fields)
-        )
-    
     def _parse_line(self, line):
         parts = line.strip().split('\t')
         if len(parts) < self.n_species * 3:
@@ -51,108 +236,172 @@ class MultipleSpeciesMutationExtractor:
         normalized = [base[0] if base and base[0] not in {',', '.'} else ref_base for base in base_calls]
         return [chrom, pos, ref_base] + normalized
 
-    def _detect_mutations(self, buffer):
-        triplets = [fields[3:] for fields in buffer]
-        prev_bases, curr_bases, next_bases = triplets
-        if self._all_same(prev_bases) and self._all_same(next_bases) and len(set(curr_bases)) > 1:
-            return [
-                buffer[1][0],  # chrom
-                buffer[1][1],  # pos
-                prev_bases[0].upper(),
-                next_bases[0].upper(),
-                buffer[1][2].upper()
-            ] + [b.upper() for b in curr_bases]
-        return None
-
-    def _recursive_state_check(self, node, row):
-        if node.is_leaf():
-            node.add_feature("state", {row[f"taxa{self.mapping[node.name]}"]})
-            return node.state
-        # Handle nodes with any number of children (supporting multifurcating trees)
-        child_states = [self._recursive_state_check(child, row) for child in node.children]
-        # Intersect all child states if any intersection exists, otherwise union
-        node_state = child_states[0]
-        for child_state in child_states[1:]:
-            intersect = node_state & child_state
-            node_state = intersect if intersect else node_state | child_state
-        node.add_feature("state", node_state)
-        return node_state
-
-    def _recursive_fitch(self, node, parent_state, row, mutation_dict, ambiguous_count):
-        next_state = parent_state
-        # Ensure node.state exists (should be set by _recursive_state_check, but add safety check)
-        if not hasattr(node, 'state'):
-            raise RuntimeError(f"Node {node.name} missing state attribute. Tree may not have been properly initialized.")
-        if parent_state not in node.state:
-            if len(node.state) > 1:
-                return mutation_dict, ambiguous_count + 1
-            next_state = list(node.state)[0]
-            parent_name = node.up.custom_name if node.up else "ROOT"
-            branch_key = f"{parent_name}→{node.custom_name}"
-            mutation = f"{row['left']}[{parent_state}>{next_state}]{row['right']}"
-            mutation_dict.setdefault(branch_key, []).append((row['chromosome'], row['position'], mutation))
-        if not node.is_leaf():
-            for child in node.children:
-                mutation_dict, ambiguous_count = self._recursive_fitch(child, next_state, row, mutation_dict, ambiguous_count)
-        return mutation_dict, ambiguous_count
-
-    def _fitch(self, tree_root, row, mutation_dict):
-        root_state = self._recursive_state_check(tree_root, row)
-        if len(root_state) == 1:
-            return self._recursive_fitch(tree_root, list(root_state)[0], row, mutation_dict, 0)
-        return mutation_dict, 1
+    def _join_tracks(self, matrix_path):
+        tracks = [BaseCallTrack(path) for path in self.tracks]
+        sources = [track.source for track in tracks]
+        if SiteMatrix.exists(matrix_path) and not self.no_cache and SiteMatrix(matrix_path).sources == sources:
+            log(f'Using cached matching positions from site matrix at {matrix_path}', self.verbose)
+            return
+
+        writer = SiteMatrixWriter(matrix_path, self.n_species)
+        scanner = TrackJoinScanner(self.reference_fasta, tracks)
+        with ProgressReporter("matching bases (tracks)", progress_path=self.progress_path,
+                              verbose=self.verbose) as progress:
+            rows, passed = scanner.scan(writer, progress)
+            progress.update(rows, passed)
+        writer.close(callable_contexts=scanner.contexts, sources=sources)
+        log(f"Joined {len(tracks)} base-call tracks into {writer.n_sites} variable sites at {matrix_path}", self.verbose)
 
     def extract(self):
         csv_path = os.path.join(self.output_dir, "matching_bases.csv.gz")
-        header = ["chromosome", "position", "left", "right"] + [f"taxa{i}" for i in range(self.n_species)]
+        matrix_path = site_matrix_path(self.output_dir)
 
-        if os.path.exists(csv_path) and not self.no_cache:
+        checkpoint = ExtractionCheckpoint(os.path.join(self.output_dir, "matching_bases.checkpoint.json"),
+                                          self.pileup_file, interval=self.checkpoint_interval, verbose=self.verbose)
+
+        if self.tracks is not None:
+            self._join_tracks(matrix_path)
+        elif SiteMatrix.exists(matrix_path) and not self.no_cache and not checkpoint.exists():
+            log(f'Using cached matching positions from site matrix at {matrix_path}', self.verbose)
+        elif os.path.exists(csv_path) and not self.no_cache and not checkpoint.exists():
             log(f'Using cached matching positions from csv at {csv_path}', self.verbose)
         else:
-            with gzip.open(csv_path, 'wt', newline='') as outfile:
-                writer = csv.writer(outfile)
-                writer.writerow(header)
-
-                with gzip.open(self.pileup_file, 'rt') as infile:
-                    buffer = [None, self._parse_line(infile.readline()), self._parse_line(infile.readline())]
-                    qc_flags = [False, self._quality_check(buffer[1]), self._quality_check(buffer[2])]
-
-                    for line in infile:
-                        buffer = [buffer[1], buffer[2], self._parse_line(line)]
-                        qc_flags = [qc_flags[1], qc_flags[2], self._quality_check(buffer[2])]
-                        if all(qc_flags):
-                            result = self._detect_mutations(buffer)
-                            if result:
-                                writer.writerow(result)
+            state = None if self.no_cache else checkpoint.load()
+            writer = SiteMatrixWriter(matrix_path, self.n_species, resume=state["outputs"]["sites"] if state else None)
+
+            scanner = PileupBlockScanner(self.n_species, self._parse_line, carry=state["carry"] if state else "",
+                                         contexts=state["contexts"] if state else None)
+
+            with PileupReader(self.pileup_file) as infile:
+                def save_checkpoint():
+                    checkpoint.save({
+                        "offset": infile.tell(),
+                        "carry": scanner.carry,
+                        "contexts": scanner.contexts.tolist(),
+                        "outputs": {"sites": writer.checkpoint()},
+                    })
+
+                if state:
+                    infile.seek(state["offset"])
+                else:
+                    save_checkpoint()
+
+                interval = self.checkpoint_interval or 0
+                lines_since_checkpoint = 0
+                lines = passed = 0
+                with ProgressReporter("matching bases", total_bytes=infile.total_bytes,
+                                      progress_path=self.progress_path, verbose=self.verbose) as progress:
+                    while True:
+                        batch, n_lines = infile.read_batch(SCAN_BATCH_LINES)
+                        if not n_lines:
+                            break
+                        batch_lines, batch_passed, chromosome = scanner.scan(batch, writer)
+                        lines += batch_lines
+                        passed += batch_passed
+                        progress.update(lines, passed, chromosome, infile.compressed_offset(), infile.bytes_read)
+
+                        lines_since_checkpoint += n_lines
+                        if interval and lines_since_checkpoint >= interval:
+                            with progress.stage("checkpoint"):
+                                save_checkpoint()
+                            lines_since_checkpoint = 0
+
+                    progress.update(lines, passed, None, infile.compressed_offset(), infile.bytes_read)
+
+            writer.close(callable_contexts=scanner.contexts)
+            checkpoint.clear()
+            log(f"Saved {writer.n_sites} variable sites to {matrix_path}", self.verbose)
+
+        if self.export_csv and SiteMatrix.exists(matrix_path) and (self.no_cache or self.tracks is not None
+                                                                   or not os.path.exists(csv_path)):
+            SiteMatrix(matrix_path).to_csv(csv_path)
+            log(f"Exported matching positions to {csv_path}", self.verbose)
 
         if self.tree:
-            mutation_dict = defaultdict(list)
             ambiguous_counter = 0
+            rows = 0
+            patterns = 0
+
+            compiled_tree = CompiledTree(self.tree, self.mapping)
+            counts = np.zeros((compiled_tree.n_nodes, len(MUTATION_CLASSES)), dtype=np.int64)
+            contexts = np.zeros((compiled_tree.n_nodes, len(CONTEXTS)), dtype=np.int64)
+            writers = {}
+            os.makedirs(self.csv_dir, exist_ok=True)
 
-            for chunk in pd.read_csv(csv_path, chunksize=1000):
-                for _, row in chunk.iterrows():
-                    mutation_dict, ambiguous = self._fitch(self.tree.copy(), row, mutation_dict)
-                    ambiguous_counter += ambiguous
+            invariant_contexts = None
+            if SiteMatrix.exists(matrix_path):
+                matrix = SiteMatrix(matrix_path)
+                invariant_contexts = matrix.callable_contexts
+                chunks = matrix.chunks(FITCH_CHUNK_SIZE)
+            else:
+                chunks = pd.read_csv(csv_path, chunksize=FITCH_CHUNK_SIZE)
+            with ProgressReporter("fitch", progress_path=self.progress_path, verbose=self.verbose) as progress:
+                try:
+                    for chunk_mutations, chunk_counts, ambiguous, sites, reconstructed, chunk_contexts in run_fitch(
+                            chunks, compiled_tree, self.workers):
+                        counts += chunk_counts
+                        contexts += chunk_contexts
+                        for branch_key, mutations in chunk_mutations.items():
+                            if branch_key not in writers:
+                                writers[branch_key] = gzip.open(os.path.join(self.csv_dir, f"{branch_key}.csv.gz"), 'wt')
+                            writers[branch_key].writelines(f"{chrom}\t{pos}\t{mutation}\n" for chrom, pos, mutation in mutations)
+                        ambiguous_counter += ambiguous
+                        rows += sites
+                        patterns += reconstructed
+                        progress.update(rows)
+                finally:
+                    for writer in writers.values():
+                        writer.close()
 
-            self._save_results(mutation_dict)
+                with progress.stage("save"):
+                    self._save_results({key: counts[compiled_tree.branch_index[key]] for key in writers})
+                    if invariant_contexts is None:
+                        log("No callable-site counts for these matching bases; skipping normalized spectra.", self.verbose)
+                    else:
+                        self._save_normalized_results(
+                            {key: counts[compiled_tree.branch_index[key]] for key in writers},
+                            {key: contexts[compiled_tree.branch_index[key]] + invariant_contexts for key in writers},
+                        )
+            log(f"Fitch reconstructed {patterns} site patterns for {rows} sites using {self.workers} worker(s)", self.verbose)
             log(f"Total ambiguous mutations: {ambiguous_counter}", self.verbose)
 
-    def _save_results(self, mutation_dict):
+    def _save_results(self, branch_counts):
+        """Spectra plots and mutation_spectras.tsv from per-branch MUTATION_CLASSES count vectors."""
         spectra_plotter = MutationSpectraPlotter()
         os.makedirs(self.plots_dir, exist_ok=True)
-        os.makedirs(self.csv_dir, exist_ok=True)
         spectra_dict = {}
 
-        for branch_key, mutations in mutation_dict.items():
-            df = pd.DataFrame(mutations, columns=["chromosome", "position", "mutation"])
-            csv_path = os.path.join(self.csv_dir, f"{branch_key}.csv.gz")
-            df.to_csv(csv_path, index=False, header=False, sep="\t", compression="gzip")
-            mutation_spectra = collapse_mutations(dict(df['mutation'].value_counts()))
-            mutation_spectra = filter_mutations_dict(mutation_spectra)
+        for branch_key, class_counts in branch_counts.items():
+            order = np.argsort(-class_counts, kind="stable")
+            mutation_spectra = {MUTATION_CLASSES[i]: int(class_counts[i]) for i in order if class_counts[i]}
             spectra_dict[branch_key] = mutation_spectra
             spectra_plot_path = os.path.join(self.plots_dir, f"{branch_key}_spectra.png")
-            spectra_plotter.plot_mutations(pd.Series(mutation_spectra), spectra_plot_path, f"Mutation Spectra: {branch_key}")
+            render(self.plot_queue, spectra_plotter.plot_mutations, pd.Series(mutation_spectra), spectra_plot_path,
+                   f"Mutation Spectra: {branch_key}")
 
         spectra_df = pd.DataFrame(spectra_dict)
         spectra_df.to_csv(os.path.join(self.output_dir, "mutation_spectras.tsv"), sep="\t")
 
+    def _save_normalized_results(self, branch_counts, branch_contexts, target_sum=10000):
+        """
+        callable_contexts.tsv (collapsed trinucleotides x branches) and normalized_mutation_spectras.tsv:
+        each branch's MUTATION_CLASSES counts divided by the callable count of their context, scaled
+        to target_sum as in the triad normalized_scaled.tsv.
+        """
+        callable_dict, normalized_dict = {}, {}
+        mutation_contexts = [COLLAPSED_CONTEXTS.index(m[0] + m[2] + m[-1]) for m in MUTATION_CLASSES]
+        for branch_key, class_counts in branch_counts.items():
+            collapsed = np.bincount(COLLAPSED_CONTEXT_INDEX, weights=branch_contexts[branch_key],
+                                    minlength=len(COLLAPSED_CONTEXTS)).astype(np.int64)
+            callable_dict[branch_key] = dict(zip(COLLAPSED_CONTEXTS, collapsed.tolist()))
+            denominators = collapsed[mutation_contexts]
+            rates = np.divide(class_counts, denominators, out=np.zeros(len(MUTATION_CLASSES)), where=denominators > 0)
+            total = rates.sum()
+            scaled = [round(rate / total * target_sum) if total else 0 for rate in rates.tolist()]
+            normalized_dict[branch_key] = dict(zip(MUTATION_CLASSES, scaled))
+
+        pd.DataFrame(callable_dict).to_csv(os.path.join(self.output_dir, "callable_contexts.tsv"), sep="\t")
+        pd.DataFrame(normalized_dict).to_csv(os.path.join(self.output_dir, "normalized_mutation_spectras.tsv"), sep="\t")
+        log(f"Saved normalized per-branch spectra to {os.path.join(self.output_dir, 'normalized_mutation_spectras.tsv')}",
+            self.verbose)
+
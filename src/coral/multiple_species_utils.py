@@ -1,9 +1,5 @@
 from collections import defaultdict
-import gzip
-import random
 import re
-import pandas as pd
-from io import StringIO
 from ete3 import Tree
 import sys
 import os
@@ -134,28 +130,6 @@ def collapse_mutations(mutation_dict):
     return collapsed
 
 
-def load_random_rows(file_path, max_rows=1000000, seed=42, verbose=True):
-    random.seed(seed)
-    
-    # Count total rows (excluding header)
-    with gzip.open(file_path, 'rt') as f:
-        header = f.readline()
-        total_rows = sum(1 for _ in f)
-    
-    log(f"File has {total_rows} rows (excluding header).", verbose)
-
-    if total_rows <= max_rows:
-        log("Loading full gzipped file.", verbose)
-        return pd.read_csv(file_path, index_col=0, compression='gzip').astype(str)
-    
-    sampled_indices = set(random.sample(range(total_rows), max_rows))
-
-    with gzip.open(file_path, 'rt') as f:
-        header = f.readline()
-        sampled_lines = [line for i, line in enumerate(f) if i in sampled_indices]
-
-    return pd.read_csv(StringIO(header + ''.join(sampled_lines)), index_col=0).astype(str)
-
 mutation_pattern = re.compile(r"^[ACGT]\[[ACGT]>[ACGT]\][ACGT]$")
 
 def filter_mutations_dict(d):
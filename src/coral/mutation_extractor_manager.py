@@ -2,8 +2,15 @@ import os
 import gzip
 import json
 import csv
-from collections import defaultdict
+import itertools
+from collections import Counter, defaultdict
+
+import numpy as np
 
+from .checkpoint_manager import DEFAULT_CHECKPOINT_INTERVAL, CheckpointedGzipWriter, ExtractionCheckpoint, PileupReader
+from .kmer_utils import (BASE_INDEX, SparseKmerCounts, collapse_context_codes, collapse_mutation_codes,
+                         decode_kmer, decode_mutation, encode_kmer, encode_mutation, validate_k)
+from .progress_manager import PROGRESS_BATCH, ProgressReporter
 from .utils import log
 
 REMOVE_CHARS = str.maketrans('', '', '^$[]')
@@ -12,9 +19,81 @@ PREV_IDX, CUR_IDX, NEXT_IDX = 0, 1, 2
 REF_IDX, TAXA1_IDX, TAXA2_IDX = 0, 1, 2
 
 
+class FilterProfile:
+    """
+    Named QC rule set applied to every pileup position of a MutationExtractor window.
+
+    min_depth: minimum number of read bases per taxon.
+    max_discordant: reads allowed to disagree with the majority base (0 = all reads identical).
+        Above 0, reference matches ('.', ',') count as ref_nuc and strands are not told apart.
+    allow_flank_deletions: deletion reads ('*') are ignored at the flanking positions instead of
+        failing them; the center position must never contain a deletion.
+
+    The default values reproduce MutationExtractor.quality_check.
+    """
+    def __init__(self, name, min_depth=1, max_discordant=0, allow_flank_deletions=False):
+        if not name or os.sep in name:
+            raise ValueError(f"Invalid filter profile name: {name!r}")
+        self.name = name
+        self.min_depth = max(1, int(min_depth))
+        self.max_discordant = int(max_discordant)
+        self.allow_flank_deletions = bool(allow_flank_deletions)
+
+    @classmethod
+    def from_value(cls, value):
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls(**value)
+        raise ValueError(f"Cannot build a filter profile from {value!r}")
+
+    def call_base(self, field, ref_nuc, flank):
+        if '*' in field:
+            if not (flank and self.allow_flank_deletions):
+                return None
+            field = field.replace('*', '')
+        bases = field.translate(REMOVE_CHARS)
+        if len(bases) < self.min_depth:
+            return None
+        if not self.max_discordant:
+            base = bases[0]
+            if bases.count(base) != len(bases):
+                return None
+            base = base.upper()
+            return ref_nuc if base in {',', '.'} else base
+        bases = bases.replace('.', ref_nuc).replace(',', ref_nuc).upper()
+        base, count = Counter(bases).most_common(1)[0]
+        if len(bases) - count > self.max_discordant:
+            return None
+        return base
+
+    def site(self, fields, flank):
+        """(ref, taxon1, taxon2) bases of a position passing this profile, else None."""
+        if not fields:
+            return None
+        ref_nuc = MutationExtractor.get_nuc(fields[REF_NUC_IDX])
+        nuc1 = self.call_base(fields[NUC_1_IDX], ref_nuc, flank)
+        if nuc1 is None:
+            return None
+        nuc2 = self.call_base(fields[NUC_2_IDX], ref_nuc, flank)
+        if nuc2 is None:
+            return None
+        return (ref_nuc, nuc1, nuc2)
+
+
+DEFAULT_PROFILE = FilterProfile("default")
+
+
 class MutationExtractor:
+    """
+    Extracts trinucleotide mutations and callable triplets for two taxa from a pileup.
+
+    With filter_profiles, every profile is evaluated in the same pass with its own counters, and
+    its outputs go to a subdirectory named after the profile in both output dirs.
+    """
     def __init__(self, reference, taxon1, taxon2, pileup_file, mutation_output_dir, triplet_output_dir,
-                 no_full_mutations=False, no_cache=False, verbose=True):
+                 no_full_mutations=False, no_cache=False, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 filter_profiles=None, progress_path=None, verbose=True):
         self.reference = reference
         self.taxon1 = taxon1
         self.taxon2 = taxon2
@@ -23,88 +102,180 @@ class MutationExtractor:
         self.triplet_output_dir = triplet_output_dir
         self.no_full_mutations = no_full_mutations
         self.no_cache = no_cache
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_path = progress_path
         self.verbose = verbose
 
-        self.pileup_file = pileup_file
-        self.out_json1 = os.path.join(self.mutation_output_dir, f"{taxon1}__{taxon2}__{reference}__mutations.json")
-        self.out_json2 = os.path.join(self.mutation_output_dir, f"{taxon2}__{taxon1}__{reference}__mutations.json")
-        self.trip_out_json1 = os.path.join(self.triplet_output_dir, f"{self.taxon1}__{self.taxon2}__{self.reference}__triplets.json")
-        self.trip_out_json2 = os.path.join(self.triplet_output_dir, f"{self.taxon2}__{self.taxon1}__{self.reference}__triplets.json")
+        if filter_profiles:
+            self.profiles = [FilterProfile.from_value(p) for p in filter_profiles]
+            if len({p.name for p in self.profiles}) != len(self.profiles):
+                raise ValueError("Filter profile names must be unique.")
+            self.outputs = {p.name: self._output_paths(os.path.join(mutation_output_dir, p.name),
+                                                       os.path.join(triplet_output_dir, p.name))
+                            for p in self.profiles}
+        else:
+            self.profiles = [DEFAULT_PROFILE]
+            self.outputs = {DEFAULT_PROFILE.name: self._output_paths(mutation_output_dir, triplet_output_dir)}
+
+        default_paths = next(iter(self.outputs.values()))
+        self.out_json1, self.out_json2 = default_paths["mut1"], default_paths["mut2"]
+        self.trip_out_json1, self.trip_out_json2 = default_paths["trip1"], default_paths["trip2"]
+        self.csv_path1, self.csv_path2 = default_paths["csv1"], default_paths["csv2"]
+        self.checkpoint_path = os.path.join(self.mutation_output_dir, f"{taxon1}__{taxon2}__{reference}__extract.checkpoint.json")
+
+    def _output_paths(self, mutation_dir, triplet_dir):
+        return self.pair_output_paths(self.taxon1, self.taxon2, self.reference, mutation_dir, triplet_dir,
+                                      self.no_full_mutations)
 
-        self.csv_path1 = None if no_full_mutations else os.path.join(self.mutation_output_dir, f"{taxon1}__{taxon2}__{reference}__mutations.csv.gz")
-        self.csv_path2 = None if no_full_mutations else os.path.join(self.mutation_output_dir, f"{taxon2}__{taxon1}__{reference}__mutations.csv.gz")
+    @staticmethod
+    def pair_output_paths(t1, t2, ref, mutation_dir, triplet_dir, no_full_mutations=False):
+        return {
+            "mutation_dir": mutation_dir,
+            "triplet_dir": triplet_dir,
+            "mut1": os.path.join(mutation_dir, f"{t1}__{t2}__{ref}__mutations.json"),
+            "mut2": os.path.join(mutation_dir, f"{t2}__{t1}__{ref}__mutations.json"),
+            "trip1": os.path.join(triplet_dir, f"{t1}__{t2}__{ref}__triplets.json"),
+            "trip2": os.path.join(triplet_dir, f"{t2}__{t1}__{ref}__triplets.json"),
+            "csv1": None if no_full_mutations else os.path.join(mutation_dir, f"{t1}__{t2}__{ref}__mutations.csv.gz"),
+            "csv2": None if no_full_mutations else os.path.join(mutation_dir, f"{t2}__{t1}__{ref}__mutations.csv.gz"),
+        }
+
+    def _outputs_exist(self):
+        keys = ["mut1", "mut2", "trip1", "trip2"] + ([] if self.no_full_mutations else ["csv1", "csv2"])
+        return all(os.path.exists(paths[key]) for paths in self.outputs.values() for key in keys)
+
+    def _position_sites(self, fields):
+        """Chromosome, position and per-profile (flank_site, center_site) for one pileup line."""
+        if not fields:
+            return [None, None, [(None, None)] * len(self.profiles)]
+        sites = []
+        for profile in self.profiles:
+            center = profile.site(fields, flank=False)
+            flank = profile.site(fields, flank=True) if profile.allow_flank_deletions else center
+            sites.append((flank, center))
+        return [fields[CHR_IDX], fields[POSITION_IDX], sites]
 
     def extract(self):
+        for paths in self.outputs.values():
+            os.makedirs(paths["mutation_dir"], exist_ok=True)
+            os.makedirs(paths["triplet_dir"], exist_ok=True)
         os.makedirs(self.mutation_output_dir, exist_ok=True)
-        os.makedirs(self.triplet_output_dir, exist_ok=True)
 
-        jsons_exist = all(os.path.exists(p) for p in [self.out_json1, self.out_json2, self.trip_out_json1, self.trip_out_json2])
-        csvs_exist = (self.no_full_mutations or
-                    all(os.path.exists(p) for p in [self.csv_path1, self.csv_path2]))
+        checkpoint = ExtractionCheckpoint(self.checkpoint_path, self.pileup_file,
+                                          interval=self.checkpoint_interval, verbose=self.verbose)
 
-        if not self.no_cache and jsons_exist and csvs_exist:
+        if not self.no_cache and self._outputs_exist() and not checkpoint.exists():
             log("Mutation counts already exist. Skipping.", self.verbose)
             return
 
-        species_mut1 = defaultdict(int)
-        species_mut2 = defaultdict(int)
-        species_triplet1 = defaultdict(int)
-        species_triplet2 = defaultdict(int)
-
-        csv1 = csv2 = None
-        if not self.no_full_mutations:
-            header = "chromosome,position,mutation\n"
-            csv1 = gzip.open(self.csv_path1, 'wt')
-            csv1.write(header)
-
-            csv2 = gzip.open(self.csv_path2, 'wt')
-            csv2.write(header)
-
-        with gzip.open(self.pileup_file, 'rt') as f:
-
-            line_fields = [None, self.parse_line(f.readline()), self.parse_line(f.readline())]
-            qc_flags = [False, self.quality_check(line_fields[1]), self.quality_check(line_fields[2])]
-
-            for line in f:
-                line_fields = [line_fields[1], line_fields[2], self.parse_line(line)]
-                qc_flags = [qc_flags[1], qc_flags[2], self.quality_check(line_fields[2])]
-
-                if all(qc_flags):
-                    triplets = self.extract_triplets(line_fields)
-                    mut1, mut2, trip1, trip2 = self.detect_mutation_triplet(triplets)
-                    chrom = line_fields[1][CHR_IDX]
-                    pos = int(line_fields[1][POSITION_IDX])
-
-                    if mut1:
-                        species_mut1[mut1] += 1
-                        csv1.write(f"{chrom},{pos},{mut1}\n")
-
-                    if mut2:
-                        species_mut2[mut2] += 1
-                        csv2.write(f"{chrom},{pos},{mut2}\n")
-
-                    if trip1:
-                        species_triplet1[trip1] += 1
-                    if trip2:
-                        species_triplet2[trip2] += 1
-        
-        if csv1:
-            csv1.close()
-        if csv2:
-            csv2.close()
-
-        with open(self.out_json1, 'w') as f:
-            json.dump(species_mut1, f, indent=2)
-        with open(self.out_json2, 'w') as f:
-            json.dump(species_mut2, f, indent=2)
-        
-        with open(self.trip_out_json1, 'w') as f:
-            json.dump(species_triplet1, f, indent=2)
-        with open(self.trip_out_json2, 'w') as f:
-            json.dump(species_triplet2, f, indent=2)
-
-        log(f"Saved mutation counts to {self.out_json1} and {self.out_json2}", self.verbose)
-        log(f"Saved triplet counts to {self.trip_out_json1} and {self.trip_out_json2}", self.verbose)
+        state = None if self.no_cache else checkpoint.load()
+        names = [profile.name for profile in self.profiles]
+        counters = {}
+        writers = {}
+        for name in names:
+            saved = state["counters"][name] if state else {}
+            counters[name] = {key: defaultdict(int, saved.get(key, {})) for key in ["mut1", "mut2", "trip1", "trip2"]}
+            if not self.no_full_mutations:
+                lengths = state["outputs"][name] if state else {}
+                writers[name] = {key: CheckpointedGzipWriter(self.outputs[name][key], resume_length=lengths.get(key))
+                                 for key in ["csv1", "csv2"]}
+                if not state:
+                    for writer in writers[name].values():
+                        writer.write("chromosome,position,mutation\n")
+
+        def save_checkpoint():
+            checkpoint.save({
+                "offset": f.tell(),
+                "window": window[1:],
+                "counters": counters,
+                "outputs": {name: {key: writer.checkpoint() for key, writer in profile_writers.items()}
+                            for name, profile_writers in writers.items()},
+            })
+
+        with PileupReader(self.pileup_file) as f:
+            if state:
+                f.seek(state["offset"])
+                window = [self._position_sites(None)] + [
+                    [chrom, pos, [tuple(tuple(site) if site else None for site in pair) for pair in sites]]
+                    for chrom, pos, sites in state["window"]
+                ]
+            else:
+                window = [self._position_sites(None),
+                          self._position_sites(self.parse_line(f.readline())),
+                          self._position_sites(self.parse_line(f.readline()))]
+                save_checkpoint()
+
+            interval = self.checkpoint_interval or 0
+            lines_since_checkpoint = 0
+            lines = passed = 0
+            with ProgressReporter(f"extract {self.taxon1}/{self.taxon2}", total_bytes=f.total_bytes,
+                                  progress_path=self.progress_path, verbose=self.verbose) as progress:
+                for line in f:
+                    window = [window[CUR_IDX], window[NEXT_IDX], self._position_sites(self.parse_line(line))]
+                    chrom, pos, cur_sites = window[CUR_IDX]
+                    prev_sites, next_sites = window[PREV_IDX][2], window[NEXT_IDX][2]
+
+                    lines += 1
+                    if lines % PROGRESS_BATCH == 0:
+                        progress.update(lines, passed, chrom, f.compressed_offset(), f.bytes_read)
+
+                    window_passed = False
+                    for i, name in enumerate(names):
+                        prev_site, cur_site, next_site = prev_sites[i][0], cur_sites[i][1], next_sites[i][0]
+                        if not (prev_site and cur_site and next_site):
+                            continue
+                        window_passed = True
+                        profile_counters = counters[name]
+                        if not writers:
+                            mut1, mut2, context = self.count_triplet(prev_site, cur_site, next_site)
+                            if context:
+                                profile_counters["trip1"][context] += 1
+                                profile_counters["trip2"][context] += 1
+                                if mut1:
+                                    profile_counters["mut1"][mut1] += 1
+                                if mut2:
+                                    profile_counters["mut2"][mut2] += 1
+                            continue
+
+                        triplets = [list(bases) for bases in zip(prev_site, cur_site, next_site)]
+                        mut1, mut2, trip1, trip2 = self.detect_mutation_triplet(triplets)
+
+                        if mut1:
+                            profile_counters["mut1"][mut1] += 1
+                            if writers:
+                                writers[name]["csv1"].write(f"{chrom},{int(pos)},{mut1}\n")
+                        if mut2:
+                            profile_counters["mut2"][mut2] += 1
+                            if writers:
+                                writers[name]["csv2"].write(f"{chrom},{int(pos)},{mut2}\n")
+                        if trip1:
+                            profile_counters["trip1"][trip1] += 1
+                        if trip2:
+                            profile_counters["trip2"][trip2] += 1
+                    passed += window_passed
+
+                    lines_since_checkpoint += 1
+                    if lines_since_checkpoint == interval:
+                        with progress.stage("checkpoint"):
+                            save_checkpoint()
+                        lines_since_checkpoint = 0
+
+                progress.update(lines, passed, None, f.compressed_offset(), f.bytes_read)
+
+                with progress.stage("write"):
+                    for profile_writers in writers.values():
+                        for writer in profile_writers.values():
+                            writer.close()
+
+                    for name in names:
+                        paths = self.outputs[name]
+                        for key in ["mut1", "mut2", "trip1", "trip2"]:
+                            with open(paths[key], 'w') as out:
+                                json.dump(counters[name][key], out, indent=2)
+                        log(f"Saved mutation counts to {paths['mut1']} and {paths['mut2']}", self.verbose)
+                        log(f"Saved triplet counts to {paths['trip1']} and {paths['trip2']}", self.verbose)
+
+                checkpoint.clear()
 
 
     @staticmethod
@@ -147,6 +318,24 @@ class MutationExtractor:
             
         return t1_mut, t2_mut, t1_3mer, t2_3mer
 
+    @staticmethod
+    def count_triplet(prev_site, cur_site, next_site):
+        """
+        Counts-only equivalent of detect_mutation_triplet on (ref, taxon1, taxon2) site tuples.
+        Returns (t1_mut, t2_mut, context); the mutation label is only formatted at mutated sites.
+        """
+        left, right = prev_site[REF_IDX], next_site[REF_IDX]
+        if not (left == prev_site[TAXA1_IDX] == prev_site[TAXA2_IDX] and
+                right == next_site[TAXA1_IDX] == next_site[TAXA2_IDX]):
+            return None, None, None
+        ref_base, t1_base, t2_base = cur_site
+        if ref_base == t1_base:
+            t2_mut = f"{left}[{ref_base}>{t2_base}]{right}" if ref_base != t2_base else None
+            return None, t2_mut, left + ref_base + right
+        if ref_base == t2_base:
+            return f"{left}[{ref_base}>{t1_base}]{right}", None, left + ref_base + right
+        return None, None, None
+
     @staticmethod
     def quality_check(fields):
         return fields and '*' not in fields[NUC_1_IDX] and '*' not in fields[NUC_2_IDX] and \
@@ -158,10 +347,198 @@ class MutationExtractor:
         return len(seq) > 0 and all(ch == seq[0] for ch in seq)
 
 
+class PairwiseMutationExtractor:
+    """
+    Extracts trinucleotide mutations and callable triplets for every pair of K taxa from one
+    pileup with a column per taxon, in a single pass.
+
+    Each taxon's base is called once per position and filter profile; a pair's window then passes
+    exactly when MutationExtractor's would on a pileup of those two taxa alone, so the outputs
+    (taxon1__taxon2__reference__*) are the same as K*(K-1)/2 separate two-taxon runs.
+    """
+    def __init__(self, reference, taxa, pileup_file, mutation_output_dir, triplet_output_dir,
+                 no_full_mutations=False, no_cache=False, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 filter_profiles=None, progress_path=None, verbose=True):
+        if len(taxa) < 2 or len(set(taxa)) != len(taxa):
+            raise ValueError(f"Pairwise extraction needs at least two distinct taxa, got {taxa}")
+        self.reference = reference
+        self.taxa = list(taxa)
+        self.pileup_file = pileup_file
+        self.mutation_output_dir = mutation_output_dir
+        self.triplet_output_dir = triplet_output_dir
+        self.no_full_mutations = no_full_mutations
+        self.no_cache = no_cache
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_path = progress_path
+        self.verbose = verbose
+
+        # Ordered (taxon, other) pairs: the "1" outputs of pair (a, b) are direction (a, b), the "2" outputs (b, a)
+        self.directions = list(itertools.permutations(range(len(self.taxa)), 2))
+        self.direction_index = {direction: i for i, direction in enumerate(self.directions)}
+
+        if filter_profiles:
+            self.profiles = [FilterProfile.from_value(p) for p in filter_profiles]
+            if len({p.name for p in self.profiles}) != len(self.profiles):
+                raise ValueError("Filter profile names must be unique.")
+            dirs = {p.name: (os.path.join(mutation_output_dir, p.name), os.path.join(triplet_output_dir, p.name))
+                    for p in self.profiles}
+        else:
+            self.profiles = [DEFAULT_PROFILE]
+            dirs = {DEFAULT_PROFILE.name: (mutation_output_dir, triplet_output_dir)}
+
+        self.outputs = {}
+        for name, (mutation_dir, triplet_dir) in dirs.items():
+            paths = []
+            for a, b in self.directions:
+                pair = MutationExtractor.pair_output_paths(self.taxa[a], self.taxa[b], reference, mutation_dir,
+                                                           triplet_dir, no_full_mutations)
+                paths.append({"mutation_dir": mutation_dir, "triplet_dir": triplet_dir,
+                              "mut": pair["mut1"], "trip": pair["trip1"], "csv": pair["csv1"]})
+            self.outputs[name] = paths
+        self.checkpoint_path = os.path.join(self.mutation_output_dir, f"{'__'.join(self.taxa)}__{reference}__pairwise.checkpoint.json")
+
+    def _outputs_exist(self):
+        keys = ["mut", "trip"] + ([] if self.no_full_mutations else ["csv"])
+        return all(os.path.exists(paths[key]) for profile_paths in self.outputs.values()
+                   for paths in profile_paths for key in keys)
+
+    def parse_line(self, line):
+        """(chrom, pos, ref, [base field per taxon]) or None if the line has too few columns."""
+        parts = line.strip().split('\t')
+        if len(parts) < 3 * len(self.taxa) + 3:
+            return None
+        return parts[CHR_IDX], parts[POSITION_IDX], parts[REF_NUC_IDX], parts[4::3][:len(self.taxa)]
+
+    def _position_sites(self, parsed):
+        """[chrom, pos, ref, per-profile (flank calls, center calls)]; a call is None where the taxon fails QC."""
+        if not parsed:
+            missing = [None] * len(self.taxa)
+            return [None, None, None, [(missing, missing)] * len(self.profiles)]
+        chrom, pos, ref_field, fields = parsed
+        ref_nuc = MutationExtractor.get_nuc(ref_field)
+        sites = []
+        for profile in self.profiles:
+            center = [profile.call_base(field, ref_nuc, False) for field in fields]
+            flank = [profile.call_base(field, ref_nuc, True) for field in fields] \
+                if profile.allow_flank_deletions else center
+            sites.append((flank, center))
+        return [chrom, pos, ref_nuc, sites]
+
+    def extract(self):
+        for profile_paths in self.outputs.values():
+            os.makedirs(profile_paths[0]["mutation_dir"], exist_ok=True)
+            os.makedirs(profile_paths[0]["triplet_dir"], exist_ok=True)
+        os.makedirs(self.mutation_output_dir, exist_ok=True)
+
+        checkpoint = ExtractionCheckpoint(self.checkpoint_path, self.pileup_file,
+                                          interval=self.checkpoint_interval, verbose=self.verbose)
+
+        if not self.no_cache and self._outputs_exist() and not checkpoint.exists():
+            log("Pairwise mutation counts already exist. Skipping.", self.verbose)
+            return
+
+        state = None if self.no_cache else checkpoint.load()
+        names = [profile.name for profile in self.profiles]
+        counters = {}
+        writers = {}
+        for name in names:
+            saved = state["counters"][name] if state else [{} for _ in self.directions]
+            counters[name] = [{key: defaultdict(int, direction.get(key, {})) for key in ["mut", "trip"]}
+                              for direction in saved]
+            if not self.no_full_mutations:
+                lengths = state["outputs"][name] if state else [None] * len(self.directions)
+                writers[name] = [CheckpointedGzipWriter(paths["csv"], resume_length=length)
+                                 for paths, length in zip(self.outputs[name], lengths)]
+                if not state:
+                    for writer in writers[name]:
+                        writer.write("chromosome,position,mutation\n")
+
+        def save_checkpoint():
+            checkpoint.save({
+                "offset": f.tell(),
+                "window": window[1:],
+                "counters": counters,
+                "outputs": {name: [writer.checkpoint() for writer in profile_writers]
+                            for name, profile_writers in writers.items()},
+            })
+
+        with PileupReader(self.pileup_file) as f:
+            if state:
+                f.seek(state["offset"])
+                window = [self._position_sites(None)] + state["window"]
+            else:
+                window = [self._position_sites(None),
+                          self._position_sites(self.parse_line(f.readline())),
+                          self._position_sites(self.parse_line(f.readline()))]
+                save_checkpoint()
+
+            interval = self.checkpoint_interval or 0
+            lines_since_checkpoint = 0
+            lines = passed = 0
+            with ProgressReporter(f"pairwise extract {len(self.taxa)} taxa", total_bytes=f.total_bytes,
+                                  progress_path=self.progress_path, verbose=self.verbose) as progress:
+                for line in f:
+                    window = [window[CUR_IDX], window[NEXT_IDX], self._position_sites(self.parse_line(line))]
+                    (_, _, left, prev_sites), (chrom, pos, ref_base, cur_sites), (_, _, right, next_sites) = window
+
+                    lines += 1
+                    if lines % PROGRESS_BATCH == 0:
+                        progress.update(lines, passed, chrom, f.compressed_offset(), f.bytes_read)
+
+                    window_passed = False
+                    for i, name in enumerate(names):
+                        prev_calls, cur_calls, next_calls = prev_sites[i][0], cur_sites[i][1], next_sites[i][0]
+                        # Taxa whose window passes QC with flanks matching the reference; any two of them
+                        # form a window that MutationExtractor would accept for that pair.
+                        callable_taxa = [t for t, base in enumerate(cur_calls) if base is not None
+                                         and prev_calls[t] is not None and prev_calls[t] == left
+                                         and next_calls[t] is not None and next_calls[t] == right]
+                        if len(callable_taxa) < 2:
+                            continue
+                        window_passed = True
+                        context = left + ref_base + right
+                        profile_counters = counters[name]
+                        for a, b in itertools.permutations(callable_taxa, 2):
+                            a_same, b_same = cur_calls[a] == ref_base, cur_calls[b] == ref_base
+                            if not (a_same or b_same):
+                                continue
+                            direction = self.direction_index[a, b]
+                            profile_counters[direction]["trip"][context] += 1
+                            if not a_same:
+                                mutation = f"{left}[{ref_base}>{cur_calls[a]}]{right}"
+                                profile_counters[direction]["mut"][mutation] += 1
+                                if writers:
+                                    writers[name][direction].write(f"{chrom},{int(pos)},{mutation}\n")
+                    passed += window_passed
+
+                    lines_since_checkpoint += 1
+                    if lines_since_checkpoint == interval:
+                        with progress.stage("checkpoint"):
+                            save_checkpoint()
+                        lines_since_checkpoint = 0
+
+                progress.update(lines, passed, None, f.compressed_offset(), f.bytes_read)
+
+                with progress.stage("write"):
+                    for profile_writers in writers.values():
+                        for writer in profile_writers:
+                            writer.close()
+
+                    for name in names:
+                        for paths, direction_counters in zip(self.outputs[name], counters[name]):
+                            for key in ["mut", "trip"]:
+                                with open(paths[key], 'w') as out:
+                                    json.dump(direction_counters[key], out, indent=2)
+                        log(f"Saved pairwise mutation and triplet counts for {len(self.directions) // 2} pairs "
+                            f"to {self.outputs[name][0]['mutation_dir']} and {self.outputs[name][0]['triplet_dir']}", self.verbose)
+
+                checkpoint.clear()
+
+
 FLANK = 2
 
 class FiveMerExtractor:
-    def __init__(self, reference, taxon1, taxon2, pileup_file, output_dir, no_cache=False, verbose=True):
+    def __init__(self, reference, taxon1, taxon2, pileup_file, output_dir, no_cache=False, progress_path=None, verbose=True):
         self.reference = reference
         self.taxon1 = taxon1
         self.taxon2 = taxon2
@@ -169,6 +546,7 @@ class FiveMerExtractor:
         self.json1_path = os.path.join(output_dir, f"{taxon1}__{taxon2}__{reference}__5mers.json")
         self.json2_path = os.path.join(output_dir, f"{taxon2}__{taxon1}__{reference}__5mers.json")
         self.no_cache = no_cache
+        self.progress_path = progress_path
         self.verbose = verbose
         os.makedirs(output_dir, exist_ok=True)
 
@@ -224,24 +602,34 @@ class FiveMerExtractor:
         species_mut1 = defaultdict(int)
         species_mut2 = defaultdict(int)
 
-        with gzip.open(self.pileup_file, 'rt') as f:
+        with PileupReader(self.pileup_file) as f:
             window = [None] * (2 * FLANK + 1)
             qc = [False] * (2 * FLANK + 1)
             for i in range(2 * FLANK):
                 window[i] = self.parse_line(f.readline())
                 qc[i] = self.quality_check(window[i])
 
-            for line in f:
-                window = window[1:] + [self.parse_line(line)]
-                qc = qc[1:] + [self.quality_check(window[-1])]
+            lines = passed = 0
+            with ProgressReporter(f"5-mers {self.taxon1}/{self.taxon2}", total_bytes=f.total_bytes,
+                                  progress_path=self.progress_path, verbose=self.verbose) as progress:
+                for line in f:
+                    window = window[1:] + [self.parse_line(line)]
+                    qc = qc[1:] + [self.quality_check(window[-1])]
+
+                    lines += 1
+                    if lines % PROGRESS_BATCH == 0:
+                        progress.update(lines, passed, window[-1] and window[-1][CHR_IDX], f.compressed_offset(), f.bytes_read)
 
-                if all(qc):
-                    five_mers = self.extract_5mer(window)
-                    mut1, mut2 = self.detect_mutation_5mer(five_mers)
-                    if mut1:
-                        species_mut1[mut1] += 1
-                    if mut2:
-                        species_mut2[mut2] += 1
+                    if all(qc):
+                        passed += 1
+                        five_mers = self.extract_5mer(window)
+                        mut1, mut2 = self.detect_mutation_5mer(five_mers)
+                        if mut1:
+                            species_mut1[mut1] += 1
+                        if mut2:
+                            species_mut2[mut2] += 1
+
+                progress.update(lines, passed, None, f.compressed_offset(), f.bytes_read)
 
         with open(self.json1_path, 'w') as f:
             json.dump(species_mut1, f, indent=2)
@@ -251,7 +639,173 @@ class FiveMerExtractor:
         log(f"Written: {self.json1_path}, {self.json2_path}", self.verbose)
 
         return self.json1_path, self.json2_path
-    
+
+
+class KmerExtractor:
+    """
+    Counts k-mer mutations and callable k-mer contexts for any odd k (3 to 11).
+
+    Several k can be requested at once; they are all filled from a single pass over the pileup
+    using a window of the largest k. Counts are stored as SparseKmerCounts (.npz) keyed by
+    integer codes, mutations under the mutation dir and callable contexts under the context dir.
+    With filter_profiles, each profile gets its own counts in a subdirectory named after it, as
+    in MutationExtractor.
+    """
+    def __init__(self, reference, taxon1, taxon2, pileup_file, mutation_output_dir, context_output_dir,
+                 kmer_sizes=(5,), no_cache=False, filter_profiles=None, progress_path=None, verbose=True):
+        self.reference = reference
+        self.taxon1 = taxon1
+        self.taxon2 = taxon2
+        self.pileup_file = pileup_file
+        self.mutation_output_dir = mutation_output_dir
+        self.context_output_dir = context_output_dir
+        self.kmer_sizes = sorted({validate_k(k) for k in kmer_sizes})
+        self.no_cache = no_cache
+        self.progress_path = progress_path
+        self.verbose = verbose
+
+        if filter_profiles:
+            self.profiles = [FilterProfile.from_value(p) for p in filter_profiles]
+            if len({p.name for p in self.profiles}) != len(self.profiles):
+                raise ValueError("Filter profile names must be unique.")
+            self.outputs = {p.name: self._kmer_paths(os.path.join(mutation_output_dir, p.name),
+                                                     os.path.join(context_output_dir, p.name))
+                            for p in self.profiles}
+        else:
+            self.profiles = None
+            self.outputs = {DEFAULT_PROFILE.name: self._kmer_paths(mutation_output_dir, context_output_dir)}
+        self.paths = next(iter(self.outputs.values()))
+
+    def _kmer_paths(self, mutation_dir, context_dir):
+        t1, t2, ref = self.taxon1, self.taxon2, self.reference
+        return {
+            k: {
+                "mut1": os.path.join(mutation_dir, f"{t1}__{t2}__{ref}__{k}mer_mutations.npz"),
+                "mut2": os.path.join(mutation_dir, f"{t2}__{t1}__{ref}__{k}mer_mutations.npz"),
+                "ctx1": os.path.join(context_dir, f"{t1}__{t2}__{ref}__{k}mer_contexts.npz"),
+                "ctx2": os.path.join(context_dir, f"{t2}__{t1}__{ref}__{k}mer_contexts.npz"),
+            }
+            for k in self.kmer_sizes
+        }
+
+    def _position_sites(self, fields):
+        """Per-profile (flank_site, center_site) bases of one pileup line."""
+        if self.profiles is None:
+            site = self.site_bases(fields)
+            return [(site, site)]
+        if not fields:
+            return [(None, None)] * len(self.profiles)
+        sites = []
+        for profile in self.profiles:
+            center = profile.site(fields, flank=False)
+            sites.append((profile.site(fields, flank=True) if profile.allow_flank_deletions else center, center))
+        return sites
+
+    @staticmethod
+    def parse_line(line):
+        return MutationExtractor.parse_line(line)
+
+    @staticmethod
+    def site_bases(fields):
+        """Return (ref, taxon1, taxon2) bases for a line passing QC, else None."""
+        if not MutationExtractor.quality_check(fields):
+            return None
+        ref_nuc = MutationExtractor.get_nuc(fields[REF_NUC_IDX])
+        nuc1 = MutationExtractor.get_nuc(fields[NUC_1_IDX])
+        nuc2 = MutationExtractor.get_nuc(fields[NUC_2_IDX])
+        return (ref_nuc,
+                ref_nuc if nuc1 in {',', '.'} else nuc1,
+                ref_nuc if nuc2 in {',', '.'} else nuc2)
+
+    @staticmethod
+    def detect_mutation_kmer(sites, k):
+        """
+        Returns (context_code, t1_alt, t2_alt) for a window of k sites, or None when the flanks are
+        not conserved across the three taxa or the context contains a non-ACGT base.
+        """
+        center = k // 2
+        for i, site in enumerate(sites):
+            if i != center and not (site[REF_IDX] == site[TAXA1_IDX] == site[TAXA2_IDX]):
+                return None
+        ref_base, t1_base, t2_base = sites[center]
+        if ref_base != t1_base and ref_base != t2_base:
+            return None
+        context_code = encode_kmer(''.join(site[REF_IDX] for site in sites))
+        if context_code is None:
+            return None
+        t1_alt = t1_base if t1_base != ref_base and t1_base in BASE_INDEX else None
+        t2_alt = t2_base if t2_base != ref_base and t2_base in BASE_INDEX else None
+        return context_code, t1_alt, t2_alt
+
+    def extract(self):
+        all_paths = [p for outputs in self.outputs.values() for paths in outputs.values() for p in paths.values()]
+        for path in all_paths:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if all(os.path.exists(p) for p in all_paths) and not self.no_cache:
+            log(f"{', '.join(f'{k}-mer' for k in self.kmer_sizes)} counts already exist. Skipping.", self.verbose)
+            return self.paths
+
+        names = list(self.outputs)
+        stores = {
+            name: {
+                k: {
+                    "mut1": SparseKmerCounts(k, "mutations"),
+                    "mut2": SparseKmerCounts(k, "mutations"),
+                    "ctx": SparseKmerCounts(k, "contexts"),
+                }
+                for k in self.kmer_sizes
+            }
+            for name in names
+        }
+        size = max(self.kmer_sizes)
+        half = size // 2
+        offsets = [(k, half - k // 2, half + k // 2 + 1) for k in self.kmer_sizes]
+
+        with PileupReader(self.pileup_file) as f:
+            window = [[(None, None)] * len(names)] * size
+            lines = passed = 0
+            with ProgressReporter(f"{size}-mers {self.taxon1}/{self.taxon2}", total_bytes=f.total_bytes,
+                                  progress_path=self.progress_path, verbose=self.verbose) as progress:
+                for line in f:
+                    window = window[1:] + [self._position_sites(self.parse_line(line))]
+                    lines += 1
+                    if lines % PROGRESS_BATCH == 0:
+                        progress.update(lines, passed, line.split('\t', 1)[0], f.compressed_offset(), f.bytes_read)
+                    window_passed = False
+                    for i, name in enumerate(names):
+                        if window[half][i][1] is None:
+                            continue
+                        window_passed = True
+                        for k, start, end in offsets:
+                            sites = [window[j][i][1 if j == half else 0] for j in range(start, end)]
+                            if None in sites:
+                                continue
+                            result = self.detect_mutation_kmer(sites, k)
+                            if result is None:
+                                continue
+                            context_code, t1_alt, t2_alt = result
+                            store = stores[name][k]
+                            store["ctx"].add(context_code)
+                            if t1_alt:
+                                store["mut1"].add(encode_mutation(context_code, k, t1_alt))
+                            if t2_alt:
+                                store["mut2"].add(encode_mutation(context_code, k, t2_alt))
+                    passed += window_passed
+
+                progress.update(lines, passed, None, f.compressed_offset(), f.bytes_read)
+
+        for name in names:
+            for k, store in stores[name].items():
+                paths = self.outputs[name][k]
+                store["mut1"].save(paths["mut1"])
+                store["mut2"].save(paths["mut2"])
+                # Callable contexts are shared by both branches, as in the triplet counts
+                store["ctx"].save(paths["ctx1"])
+                store["ctx"].save(paths["ctx2"])
+                log(f"Written {k}-mer counts: {paths['mut1']}, {paths['mut2']}", self.verbose)
+
+        return self.paths
+
 
 class TripletExtractor:
     def __init__(self, reference, taxon1, taxon2, pileup_file, output_dir, no_cache=False, verbose=True):
@@ -356,10 +910,11 @@ class MutationNormalizer:
     valid_bases = {'A', 'C', 'G', 'T'}
     mutation_pattern = re.compile(r"^[ACGT]\[[ACGT]>[ACGT]\][ACGT]$")
 
-    def __init__(self, input_dir, output_dir=None, divergence_time=None, verbose=True):
+    def __init__(self, input_dir, output_dir=None, divergence_time=None, k=3, mutation_dir=None, triplet_dir=None, verbose=True):
         self.input_dir = input_dir
-        self.mutation_dir = os.path.join(input_dir, "Mutations")
-        self.triplet_dir = os.path.join(input_dir, "Triplets")
+        self.k = validate_k(k)
+        self.mutation_dir = mutation_dir or os.path.join(input_dir, "Mutations")
+        self.triplet_dir = triplet_dir or os.path.join(input_dir, "Triplets")
         self.output_dir = output_dir or os.path.join(input_dir, "Tables")
         self.divergence_time = divergence_time
         self.verbose = verbose
@@ -421,6 +976,9 @@ class MutationNormalizer:
         return {k: round(v / total * target_sum) for k, v in d.items()}
 
     def normalize(self):
+        if self.k != 3:
+            return self.normalize_kmers()
+
         for file in os.listdir(self.mutation_dir):
             if not file.endswith(".json"):
                 continue
@@ -450,16 +1008,55 @@ class MutationNormalizer:
 
         self._export()
 
-    def _export(self):
+    def normalize_kmers(self):
+        """
+        Normalize the sparse k-mer stores written by KmerExtractor. Collapsing and normalization
+        are done on integer codes; labels are only decoded for the exported tables.
+        """
+        suffix = f"__{self.k}mer_mutations.npz"
+        for file in sorted(os.listdir(self.mutation_dir)):
+            if not file.endswith(suffix):
+                continue
+
+            mutation_path = os.path.join(self.mutation_dir, file)
+            context_path = os.path.join(self.triplet_dir, file.replace("mutations", "contexts"))
+            key = file.replace('.npz', '')
+
+            if not os.path.exists(context_path):
+                continue
+
+            mut_codes, mut_counts = SparseKmerCounts.load(mutation_path).to_arrays()
+            ctx_codes, ctx_counts = SparseKmerCounts.load(context_path).to_arrays()
+            mut_codes, mut_counts = collapse_mutation_codes(mut_codes, mut_counts, self.k)
+            ctx_codes, ctx_counts = collapse_context_codes(ctx_codes, ctx_counts, self.k)
+
+            context_of_mut = mut_codes // 3
+            if len(ctx_codes):
+                idx = np.minimum(np.searchsorted(ctx_codes, context_of_mut), len(ctx_codes) - 1)
+                denominators = np.where(ctx_codes[idx] == context_of_mut, ctx_counts[idx], 0)
+            else:
+                denominators = np.zeros(len(mut_codes), dtype=np.int64)
+            norm_counts = np.divide(mut_counts, denominators, out=np.zeros(len(mut_codes)), where=denominators > 0)
+
+            labels = [decode_mutation(code, self.k) for code in mut_codes]
+            collapsed_mut = dict(zip(labels, mut_counts.tolist()))
+            self.all_collapsed_mut[key] = collapsed_mut
+            self.all_triplets[key] = {decode_kmer(code, self.k): int(count) for code, count in zip(ctx_codes, ctx_counts)}
+            self.all_norm_mut[key] = self.scale_counts(dict(zip(labels, norm_counts.tolist())))
+            self.all_scaled_mut[key] = self.scale_counts(collapsed_mut)
+
+        self._export(suffix=f"_{self.k}mer", context_name=f"{self.k}mer_contexts", context_label=f"{self.k}-mer")
+
+    def _export(self, suffix="", context_name="triplets", context_label="triplet"):
         collapsed_mutations_df = pd.DataFrame(self.all_collapsed_mut)
-        collapsed_mutations_df.to_csv(os.path.join(self.output_dir, "collapsed_mutations.tsv"), sep='\t')
-        pd.DataFrame(self.all_norm_mut).to_csv(os.path.join(self.output_dir, "normalized_scaled.tsv"), sep='\t')
-        pd.DataFrame(self.all_scaled_mut).to_csv(os.path.join(self.output_dir, "scaled_raw.tsv"), sep='\t')
+        collapsed_mutations_df.to_csv(os.path.join(self.output_dir, f"collapsed_mutations{suffix}.tsv"), sep='\t')
+        pd.DataFrame(self.all_norm_mut).to_csv(os.path.join(self.output_dir, f"normalized_scaled{suffix}.tsv"), sep='\t')
+        pd.DataFrame(self.all_scaled_mut).to_csv(os.path.join(self.output_dir, f"scaled_raw{suffix}.tsv"), sep='\t')
         triplets_df = pd.DataFrame(self.all_triplets)
-        triplets_df.to_csv(os.path.join(self.output_dir, "triplets.tsv"), sep='\t')
+        triplets_df.to_csv(os.path.join(self.output_dir, f"{context_name}.tsv"), sep='\t')
 
         mutations_per_triplet = collapsed_mutations_df.sum() / triplets_df.sum()
-        log("Mutations per triplet from divergence:", self.verbose)
+        log(f"Mutations per {context_label} from divergence:", self.verbose)
         for col in mutations_per_triplet.index:
             log(f"{col.split('__')[0]}: {mutations_per_triplet[col]:.2e}", self.verbose)
 
@@ -0,0 +1,452 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from ete3 import Tree
+
+from .multiple_species_utils import get_complement
+from .site_matrix import SiteBlock
+
+DEFAULT_PATTERN_CACHE_SIZE = 200_000  # memoized leaf patterns kept across chunks
+
+# Raw X[Y>Z]W labels over ACGT mapped to the 96 pyrimidine-reference classes of collapse_mutations
+_RAW_MUTATIONS = [f"{left}[{ref}>{alt}]{right}" for ref in "ACGT" for alt in "ACGT" if alt != ref
+                  for left in "ACGT" for right in "ACGT"]
+MUTATION_CLASSES = sorted({m for m in _RAW_MUTATIONS if m[2] in "CT"})
+CLASS_INDEX = {m: MUTATION_CLASSES.index(get_complement(m) if m[2] in "AG" else m) for m in _RAW_MUTATIONS}
+
+# Callable trinucleotide contexts, indexed 16 * left + 4 * middle + right over ACGT
+CONTEXTS = [left + middle + right for left in "ACGT" for middle in "ACGT" for right in "ACGT"]
+NO_BASE = 255
+ACGT_INDEX = np.full(256, NO_BASE, dtype=np.uint8)  # ASCII code -> ACGT index
+for _i, _base in enumerate("ACGT"):
+    ACGT_INDEX[ord(_base)] = _i
+_COMPLEMENT_CONTEXT = {ctx: "".join({"A": "T", "C": "G", "G": "C", "T": "A"}[b] for b in reversed(ctx)) for ctx in CONTEXTS}
+COLLAPSED_CONTEXTS = sorted(ctx for ctx in CONTEXTS if ctx[1] in "CT")
+COLLAPSED_CONTEXT_INDEX = np.array(
+    [COLLAPSED_CONTEXTS.index(ctx if ctx[1] in "CT" else _COMPLEMENT_CONTEXT[ctx]) for ctx in CONTEXTS], dtype=np.int64
+)
+
+
+def context_counts(lefts, middles, rights, n_columns=None):
+    """
+    Count trinucleotide contexts from ASCII left/right flank codes (sites) and ACGT-index middles
+    (sites, or sites x columns for one count row per column). Sites with a non-ACGT base are skipped.
+    Returns a CONTEXTS vector, or a columns x CONTEXTS array.
+    """
+    left = ACGT_INDEX[lefts].astype(np.int64)
+    right = ACGT_INDEX[rights].astype(np.int64)
+    middles = np.asarray(middles)
+    if n_columns is None:
+        codes = 16 * left + 4 * middles.astype(np.int64) + right
+        valid = (left < 4) & (middles < 4) & (right < 4)
+        return np.bincount(codes[valid], minlength=len(CONTEXTS))
+    codes = (16 * left + right)[:, None] + 4 * middles.astype(np.int64) + len(CONTEXTS) * np.arange(n_columns)
+    valid = ((left < 4) & (right < 4))[:, None] & (middles < 4)
+    return np.bincount(codes[valid], minlength=n_columns * len(CONTEXTS)).reshape(n_columns, len(CONTEXTS))
+
+
+class StateEncoder:
+    """
+    Maps base characters to single-bit state masks. A, C, G and T take the first four bits;
+    any other character (N, IUPAC codes, ...) gets the next free bit the first time it is seen,
+    so Fitch sets over arbitrary characters become bitwise AND/OR on uint64 masks.
+    """
+    MAX_STATES = 64
+
+    def __init__(self):
+        self.chars = list("ACGT")
+        self.bits = {char: i for i, char in enumerate(self.chars)}
+
+    def _bit(self, char):
+        if char not in self.bits:
+            if len(self.chars) == self.MAX_STATES:
+                raise ValueError(f"More than {self.MAX_STATES} distinct base characters in input.")
+            self.bits[char] = len(self.chars)
+            self.chars.append(char)
+        return self.bits[char]
+
+    def encode(self, codes):
+        """Encode an array of ASCII base codes (uint8) into bit indices (uint8) of the same shape."""
+        lut = np.zeros(256, dtype=np.uint8)
+        for code in np.unique(codes).tolist():
+            lut[code] = self._bit(chr(code))
+        return lut[codes]
+
+    @staticmethod
+    def masks(bit_indices):
+        return np.left_shift(np.uint64(1), bit_indices.astype(np.uint64))
+
+    def decode(self, masks):
+        """Characters of an array of single-bit masks."""
+        bit_indices = np.log2(masks.astype(np.float64)).astype(np.int64)
+        return np.asarray(self.chars)[bit_indices]
+
+
+def _is_single(masks):
+    return (masks & (masks - np.uint64(1))) == 0
+
+
+class CompiledTree:
+    """
+    An annotated ete3 tree flattened once into index arrays for batched Fitch parsimony.
+
+    Reproduces MultipleSpeciesMutationExtractor._fitch over a whole chunk of matching-bases rows:
+    the up pass folds child state sets left to right (intersection if non-empty, else union);
+    the down pass walks in preorder, records a mutation where the parent state is not in a
+    single-state child, and stops with one ambiguity where the child has several states.
+
+    The result only depends on the leaf states, so each chunk is reduced to its unique leaf
+    patterns and reconstructed once per pattern; results are kept in a bounded LRU memo that
+    persists across chunks and fanned out to the member sites.
+    """
+    def __init__(self, tree, mapping, cache_size=DEFAULT_PATTERN_CACHE_SIZE):
+        self.encoder = StateEncoder()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.sites = 0
+        self.patterns_reconstructed = 0
+        nodes = list(tree.traverse("preorder"))
+        index = {node: i for i, node in enumerate(nodes)}
+
+        self.n_nodes = len(nodes)
+        self.parent = np.array([index[node.up] if node.up in index else -1 for node in nodes], dtype=np.int64)
+        self.children = [[index[child] for child in node.children] for node in nodes]
+        self.postorder = [index[node] for node in tree.traverse("postorder")]
+        self.leaves = [index[node] for node in nodes if node.is_leaf()]
+        self.leaf_taxa = np.array([mapping[node.name] for node in nodes if node.is_leaf()], dtype=np.int64)
+        self.branch_keys = [
+            f"{node.up.custom_name if node.up else 'ROOT'}→{node.custom_name}" for node in nodes
+        ]
+        self.branch_index = {key: i for i, key in enumerate(self.branch_keys)}
+
+    def up_pass(self, leaf_masks):
+        """State masks of every node (preorder index) for every site, given {node: site masks}."""
+        n_sites = len(next(iter(leaf_masks.values())))
+        states = np.zeros((self.n_nodes, n_sites), dtype=np.uint64)
+        for node in self.postorder:
+            children = self.children[node]
+            if not children:
+                states[node] = leaf_masks[node]
+                continue
+            state = states[children[0]].copy()
+            for child in children[1:]:
+                intersect = state & states[child]
+                state = np.where(intersect != 0, intersect, state | states[child])
+            states[node] = state
+        return states
+
+    def down_pass(self, states):
+        """
+        Returns (mutated, parent_states, ambiguous, reached): a nodes x sites mutation matrix, the
+        parent state each node received, the number of ambiguous stops per site, and whether
+        the walk reached each node with a resolved parent state.
+        """
+        n_sites = states.shape[1]
+        mutated = np.zeros(states.shape, dtype=bool)
+        incoming = np.zeros(states.shape, dtype=np.uint64)
+        next_states = np.zeros(states.shape, dtype=np.uint64)
+        proceed = np.zeros(states.shape, dtype=bool)
+        ambiguous = np.zeros(n_sites, dtype=np.int64)
+        reached = np.zeros(states.shape, dtype=bool)
+
+        root_single = _is_single(states[0])
+        ambiguous += ~root_single
+        proceed[0] = root_single
+        next_states[0] = states[0]
+
+        for node in range(1, self.n_nodes):
+            parent = self.parent[node]
+            visited = proceed[parent]
+            parent_state = next_states[parent]
+            state = states[node]
+            hit = (parent_state & state) != 0
+            single = _is_single(state)
+
+            ambiguous += visited & ~hit & ~single
+            mutated[node] = visited & ~hit & single
+            reached[node] = visited
+            proceed[node] = visited & (hit | single)
+            incoming[node] = parent_state
+            next_states[node] = np.where(hit, parent_state, state)
+        return mutated, incoming, ambiguous, reached
+
+    def reconstruct(self, patterns):
+        """
+        Fitch on a patterns x leaves array of bit indices (columns in self.leaves order). Returns,
+        per pattern, ([(node, branch_key, mutation without flanks), ...] in preorder, ambiguous count,
+        per-node parent base as an ACGT index, NO_BASE where unresolved or not ACGT).
+        """
+        masks = self.encoder.masks(patterns)
+        states = self.up_pass({node: masks[:, i] for i, node in enumerate(self.leaves)})
+        mutated, incoming, ambiguous, reached = self.down_pass(states)
+
+        # A, C, G and T are the encoder's bits 0-3, so a single-bit parent mask below 16 is its ACGT index
+        parent_bases = np.full(incoming.shape, NO_BASE, dtype=np.uint8)
+        acgt = reached & (incoming > 0) & (incoming < 16)
+        parent_bases[acgt] = np.log2(incoming[acgt].astype(np.float64)).astype(np.uint8)
+
+        pattern_idx, nodes = np.nonzero(mutated.T)
+        parents = self.encoder.decode(incoming[nodes, pattern_idx]).tolist()
+        childs = self.encoder.decode(states[nodes, pattern_idx]).tolist()
+        changes = [(node, self.branch_keys[node], f"[{p}>{c}]") for node, p, c in zip(nodes.tolist(), parents, childs)]
+
+        bounds = np.searchsorted(pattern_idx, np.arange(patterns.shape[0] + 1)).tolist()
+        return [(changes[bounds[j]:bounds[j + 1]], amb, parent_bases[:, j].copy())
+                for j, amb in enumerate(ambiguous.tolist())]
+
+    def _lookup(self, patterns):
+        keys = [pattern.tobytes() for pattern in patterns]
+        missing = [j for j, key in enumerate(keys) if key not in self.cache]
+        computed = dict(zip(missing, self.reconstruct(patterns[missing]))) if missing else {}
+        self.patterns_reconstructed += len(missing)
+
+        results = []
+        for j, key in enumerate(keys):
+            if j in computed:
+                result = self.cache[key] = computed[j]
+            else:
+                result = self.cache[key]
+                self.cache.move_to_end(key)
+            results.append(result)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return results
+
+    def fitch(self, chunk, mutation_dict, counts=None, contexts=None):
+        """
+        Run Fitch over a SiteBlock (or matching-bases DataFrame) chunk, appending (chromosome, position, mutation)
+        per branch to mutation_dict in the same order as the per-row recursion. If given, counts
+        (nodes x MUTATION_CLASSES) is incremented with the collapsed ACGT mutations of each branch,
+        and contexts (nodes x CONTEXTS) with the trinucleotide each branch's parent had at the site.
+        Returns the number of ambiguous assignments.
+        """
+        if not isinstance(chunk, SiteBlock):
+            chunk = SiteBlock.from_frame(chunk)
+        bit_indices = np.ascontiguousarray(self.encoder.encode(chunk.bases[:, self.leaf_taxa]))
+        rows = bit_indices.view(np.dtype((np.void, bit_indices.shape[1]))).reshape(-1)
+        _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+        results = self._lookup(bit_indices[first])
+        self.sites += len(chunk)
+
+        chromosomes = chunk.chromosomes
+        positions = chunk.positions.tolist()
+        lefts = chunk.left_chars()
+        rights = chunk.right_chars()
+
+        if contexts is not None:
+            parent_bases = np.stack([result[2] for result in results])[inverse.reshape(-1)]  # sites x nodes
+            contexts += context_counts(chunk.lefts, parent_bases, chunk.rights, self.n_nodes)
+
+        ambiguous = 0
+        hits = []
+        n_classes = len(MUTATION_CLASSES)
+        for site, pattern in enumerate(inverse.tolist()):
+            changes, pattern_ambiguous, _ = results[pattern]
+            ambiguous += pattern_ambiguous
+            for node, branch_key, change in changes:
+                mutation = f"{lefts[site]}{change}{rights[site]}"
+                mutation_dict.setdefault(branch_key, []).append((chromosomes[site], positions[site], mutation))
+                if counts is not None and mutation in CLASS_INDEX:
+                    hits.append(node * n_classes + CLASS_INDEX[mutation])
+        if hits:
+            counts += np.bincount(hits, minlength=counts.size).reshape(counts.shape)
+        return ambiguous
+
+
+_worker_tree = None
+
+
+def _init_worker(compiled_tree):
+    global _worker_tree
+    _worker_tree = compiled_tree
+
+
+def _fitch_chunk(chunk, compiled_tree=None):
+    compiled_tree = compiled_tree or _worker_tree
+    reconstructed = compiled_tree.patterns_reconstructed
+    mutation_dict = {}
+    counts = np.zeros((compiled_tree.n_nodes, len(MUTATION_CLASSES)), dtype=np.int64)
+    contexts = np.zeros((compiled_tree.n_nodes, len(CONTEXTS)), dtype=np.int64)
+    ambiguous = compiled_tree.fitch(chunk, mutation_dict, counts, contexts)
+    return (mutation_dict, counts, ambiguous, len(chunk), compiled_tree.patterns_reconstructed - reconstructed,
+            contexts)
+
+
+def run_fitch(chunks, compiled_tree, workers=1):
+    """
+    Yield (mutation_dict, counts, ambiguous, sites, patterns_reconstructed, contexts) per chunk, in
+    input order, where counts is a nodes x MUTATION_CLASSES array of collapsed mutation counts and
+    contexts a nodes x CONTEXTS array of the parent trinucleotides of the variable sites.
+
+    With workers > 1, chunks are reconstructed in a process pool; every worker gets its own copy
+    of the compiled tree (and pattern memo) once, and at most 2 * workers chunks are in flight.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield _fitch_chunk(chunk, compiled_tree)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(compiled_tree,)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_fitch_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# PHYLIP DNA characters as state sets over A, C, G, T and gap (dnapars treats '-' as a fifth state)
+_BASE_SETS = {
+    "A": "A", "C": "C", "G": "G", "T": "T", "U": "T", "-": "-",
+    "R": "AG", "Y": "CT", "M": "AC", "K": "GT", "S": "CG", "W": "AT",
+    "B": "CGT", "D": "AGT", "H": "ACT", "V": "ACG", "N": "ACGT", "X": "ACGT", "?": "ACGT-", "O": "ACGT-",
+}
+_STATE_BITS = {state: 1 << i for i, state in enumerate("ACGT-")}
+N_SCORE_STATES = len(_STATE_BITS)
+SCORE_MASKS = np.full(256, sum(_STATE_BITS.values()), dtype=np.uint8)  # unknown characters: any state
+for _char, _states in _BASE_SETS.items():
+    for _code in {ord(_char), ord(_char.lower())}:
+        SCORE_MASKS[_code] = sum(_STATE_BITS[state] for state in _states)
+SCORE_MASKS[ord(" ")] = _STATE_BITS["-"]  # blanks are written to PHYLIP as gaps
+
+DEFAULT_SCORE_BLOCK_BYTES = 64 * 1024 ** 2  # trees x nodes x patterns state block per batch
+
+
+def tree_splits(tree, reference):
+    """Non-trivial bipartitions of a tree, each given as the leaf set without the reference leaf."""
+    leaves = frozenset(tree.get_leaf_names())
+    splits = set()
+    for node in tree.traverse():
+        if node.is_leaf() or node.is_root():
+            continue
+        side = frozenset(node.get_leaf_names())
+        if reference in side:
+            side = leaves - side
+        if 1 < len(side) < len(leaves) - 1:
+            splits.add(side)
+    return splits
+
+
+def nni_neighbours(tree):
+    """
+    Distinct (unrooted) topologies one nearest-neighbour interchange away from an ete3 tree:
+    for every internal edge, a child of the lower node is swapped with a sibling of it.
+    """
+    reference = tree.get_leaf_names()[0]
+    seen = {frozenset(tree_splits(tree, reference))}
+    neighbours = []
+    for node_index, node in enumerate(tree.traverse("preorder")):
+        if node.is_leaf() or node.is_root():
+            continue
+        for child_index in range(len(node.children)):
+            for sibling_index, sibling in enumerate(node.up.children):
+                if sibling is node:
+                    continue
+                candidate = tree.copy()
+                lower = list(candidate.traverse("preorder"))[node_index]
+                upper = lower.up
+                child = lower.children[child_index].detach()
+                other = upper.children[sibling_index].detach()
+                lower.add_child(other)
+                upper.add_child(child)
+                key = frozenset(tree_splits(candidate, reference))
+                if key not in seen:
+                    seen.add(key)
+                    neighbours.append(candidate)
+    return neighbours
+
+
+class ParsimonyScorer:
+    """
+    Parsimony length of candidate trees on a compressed site-pattern matrix, without PHYLIP.
+
+    Sites are given as distinct patterns (patterns x taxa ASCII codes) with their counts; each
+    character becomes a state set over A, C, G, T and gap as in dnapars. Trees are scored with
+    the Fitch-Hartigan count, which also handles multifurcations: a node whose k children share
+    at most m copies of any state costs k - m changes and keeps the states reaching m.
+
+    Trees are compiled to child-index tables and scored together: node j of every tree is
+    evaluated in one array operation over all trees and patterns. Leaves are named taxa<i>
+    (the PHYLIP infile names) unless leaf_index maps names to pattern columns.
+    """
+    def __init__(self, patterns, counts, leaf_index=None, block_bytes=DEFAULT_SCORE_BLOCK_BYTES):
+        self.masks = SCORE_MASKS[np.asarray(patterns, dtype=np.uint8)]  # patterns x taxa
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.n_taxa = self.masks.shape[1]
+        self.leaf_index = leaf_index or {f"taxa{i}": i for i in range(self.n_taxa)}
+        self.block_bytes = block_bytes
+
+    def _compile(self, trees):
+        """(trees x internal nodes x max children) child table; leaves are 0..n_taxa-1, padding is -1."""
+        tables = []
+        for tree in trees:
+            index = {}
+            rows = []
+            for node in tree.traverse("postorder"):
+                if node.is_leaf():
+                    if node.name not in self.leaf_index:
+                        raise ValueError(f"Leaf '{node.name}' is not a taxon of the site patterns.")
+                    index[node] = self.leaf_index[node.name]
+                else:
+                    index[node] = self.n_taxa + len(rows)
+                    rows.append([index[child] for child in node.children])
+            tables.append(rows)
+        n_internal = max(len(rows) for rows in tables)
+        max_children = max(len(children) for rows in tables for children in rows)
+        children = np.full((len(tables), n_internal, max_children), -1, dtype=np.int64)
+        for t, rows in enumerate(tables):
+            for j, row in enumerate(rows):
+                children[t, j, :len(row)] = row
+        return children
+
+    def _score_block(self, children, leaf_masks, counts):
+        n_trees, n_internal, max_children = children.shape
+        n_rows = self.n_taxa + n_internal + 1  # per tree: leaves, internal nodes, an empty padding row
+        n_patterns = leaf_masks.shape[0]
+        states = np.zeros((n_trees * n_rows, n_patterns), dtype=np.uint8)
+        by_tree = states.reshape(n_trees, n_rows, n_patterns)
+        by_tree[:, :self.n_taxa] = leaf_masks.T
+        present = children >= 0
+        n_present = present.sum(axis=2)
+        rows = np.where(present, children, n_rows - 1) + (np.arange(n_trees) * n_rows)[:, None, None]
+
+        changes = np.zeros((n_trees, n_patterns), dtype=np.int64)
+        for j in range(n_internal):
+            if (n_present[:, j] == 2).all():  # bifurcation in every tree: plain Fitch
+                left, right = states[rows[:, j, 0]], states[rows[:, j, 1]]
+                shared = left & right
+                disjoint = shared == 0
+                changes += disjoint
+                by_tree[:, self.n_taxa + j] = np.where(disjoint, left | right, shared)
+                continue
+            copies = np.zeros((N_SCORE_STATES, n_trees, n_patterns), dtype=np.uint8)
+            for c in range(max_children):
+                child = states[rows[:, j, c]]
+                for bit in range(N_SCORE_STATES):
+                    copies[bit] += (child >> bit) & 1
+            best = copies.max(axis=0)
+            changes += n_present[:, j, None] - best.astype(np.int64)
+            node_states = np.zeros((n_trees, n_patterns), dtype=np.uint8)
+            for bit in range(N_SCORE_STATES):
+                node_states |= (copies[bit] == best).astype(np.uint8) << bit
+            by_tree[:, self.n_taxa + j] = node_states
+        return changes @ counts
+
+    def score(self, trees):
+        """Weighted parsimony length of each ete3 tree (or Newick string), as an int64 array."""
+        trees = [Tree(tree, format=1) if isinstance(tree, str) else tree for tree in trees]
+        if not trees:
+            return np.zeros(0, dtype=np.int64)
+        children = self._compile(trees)
+        per_tree = (self.n_taxa + children.shape[1] + 1) * max(len(self.counts), 1)
+        tree_batch = max(1, self.block_bytes // per_tree)
+        pattern_batch = max(1, self.block_bytes // ((self.n_taxa + children.shape[1] + 1) * min(tree_batch, len(trees))))
+        scores = np.zeros(len(trees), dtype=np.int64)
+        for t in range(0, len(trees), tree_batch):
+            for p in range(0, len(self.counts), pattern_batch):
+                scores[t:t + tree_batch] += self._score_block(children[t:t + tree_batch],
+                                                              self.masks[p:p + pattern_batch],
+                                                              self.counts[p:p + pattern_batch])
+        return scores
@@ -1,4 +1,5 @@
 import os
+import shutil
 import subprocess
 from .utils import log, run_cmd
 
@@ -40,7 +41,9 @@ class Pileup:
         try:
             with open(tmp_path, "wb") as out:
                 proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-                gzip_proc = subprocess.Popen(["gzip"], stdin=proc.stdout, stdout=out)
+                # BGZF output stays gzip-compatible and lets extractors checkpoint by virtual offset
+                compressor = ["bgzip", "-c"] if shutil.which("bgzip") else ["gzip"]
+                gzip_proc = subprocess.Popen(compressor, stdin=proc.stdout, stdout=out)
                 proc.stdout.close()
                 gzip_proc.communicate()
 
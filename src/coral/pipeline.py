@@ -1,18 +1,27 @@
 # species_mutation_extraction/mutextractor/pipeline.py
 
+import hashlib
 import json
 import os
 import time 
 import gc
+import multiprocessing
 
 import pandas as pd
 from .cleanup_manager import PipelineCleaner
 from .genome_manager import Genome
 from .alignment_manager import Aligner
+from .base_call_tracks import base_call_track_path, build_base_call_track, fasta_chromosome_lengths
 from .multiple_species_mutation_extractor_manager import MultipleSpeciesMutationExtractor
-from .mutation_extractor_manager import FiveMerExtractor, MutationExtractor, MutationNormalizer, TripletExtractor
+from .mutation_extractor_manager import (FilterProfile, FiveMerExtractor, KmerExtractor, MutationExtractor, MutationNormalizer,
+                                         PairwiseMutationExtractor, TripletExtractor)
 from .pileup_manager import Pileup
-from .plot_utils import CoveragePlotter, MutationDensityPlotter, MutationSpectraPlotter
+from .plot_queue import PlotQueue
+from .plot_utils import (CoveragePlotter, MutationDensityPlotter, MutationSpectraPlotter, PlotDataCache,
+                         list_interval_files, list_mutation_files)
+from .site_matrix import SiteMatrix, site_matrix_path
+from .summary_tracks import SummaryTracks, summary_tracks_path, write_summary_tracks
+from .task_scheduler import TaskScheduler
 from .utils import get_top_n_chromosomes, log
 import psutil
 import pysam
@@ -49,9 +58,15 @@ class MutationExtractionPipeline:
         self.alignments = []
         self.verbose = verbose
         self.no_cache = no_cache
+        self.plot_queue = None
 
     
-    def run(self):
+    def run(self, shared_alignments=False):
+        """
+        Run every stage. With shared_alignments, self.reference, self.genomes and self.alignments
+        were set from a shared store (see CohortPipeline): download and alignment are skipped and
+        cleanup only removes this run's pileup.
+        """
         log("Starting mutation extraction pipeline...", self.verbose)
         timings = {}
         memory_log = {}
@@ -75,13 +90,28 @@ class MutationExtractionPipeline:
             log(f"{stage_name} completed in {timings[stage_name]} seconds", self.verbose)
             log(f"Memory usage: {mem_before} → {mem_after} MB", self.verbose)
 
-        timed_stage("Download and Fragment Genomes", self.download_index_and_fragment_genomes)
-        timed_stage("Align Species", self.align_species)
-        timed_stage("Generate Pileup", self.generate_pileup)
-        timed_stage("Extract Mutations and Triplets", self.extract_mutations_and_triplets)
-        timed_stage("Extract Intervals", self.extract_intervals)
-        timed_stage("Run Plots", self.run_plots)
-        timed_stage("Cleanup files", self.cleanup)
+        # Figures are drawn in the background while later stages run (plot_jobs=0 draws them inline)
+        if self.params.get("plot_jobs") != 0:
+            self.plot_queue = PlotQueue(self.params.get("plot_jobs"), verbose=self.verbose)
+
+        try:
+            if shared_alignments:
+                os.makedirs(self.output_dir, exist_ok=True)
+            else:
+                timed_stage("Download and Fragment Genomes", self.download_index_and_fragment_genomes)
+                timed_stage("Align Species", self.align_species)
+            timed_stage("Generate Pileup", self.generate_pileup)
+            timed_stage("Extract Mutations and Triplets", self.extract_mutations_and_triplets)
+            if not self.params.get("spectra_only", False):
+                timed_stage("Extract Intervals", self.extract_intervals)
+            timed_stage("Run Plots", self.run_plots)
+            timed_stage("Cleanup files", self.cleanup_pileup if shared_alignments else self.cleanup)
+            if self.plot_queue is not None:
+                timed_stage("Wait for Plots", self.plot_queue.close)
+        except BaseException:
+            if self.plot_queue is not None:
+                self.plot_queue.cancel()
+            raise
 
         total_runtime = round(time.time() - start_pipeline, 2)
         timings["Total Runtime"] = total_runtime
@@ -135,21 +165,10 @@ class MutationExtractionPipeline:
                 aligner_name=self.aligner_name,              
                 cores=self.params.get("cores", None),
                 verbose=self.verbose,
+                plot_queue=self.plot_queue,
             )
 
-            if self.params.get("streamed", False):
-                aligner.align_streamed(
-                    mapq=self.params.get("mapq", 60),
-                    low_mapq=self.params.get("low_mapq", 1),
-                    max_sort_mem=self.params.get("max_samtools_mem", None),
-                    continuity=self.params.get("continuity", True)
-                )
-            else:
-                aligner.align_disk_cached(
-                    mapq=self.params.get("mapq", 60),
-                    low_mapq=self.params.get("low_mapq", 1),
-                    continuity=self.params.get("continuity", True)
-                )
+            _align(aligner, self.params)
             self.alignments.append(aligner)
             
 
@@ -178,25 +197,64 @@ class MutationExtractionPipeline:
 
     def extract_mutations_and_triplets(self):
         # log("Extracting 3mer mutations and triplets from pileup...", self.verbose)
-        mutation_extractor = MutationExtractor(reference=self.reference.name,
-                              taxon1=self.genomes[0].name,
-                              taxon2=self.genomes[1].name,
-                              pileup_file=self.pileup_path,
-                              mutation_output_dir=os.path.join(self.output_dir, 'Mutations'),
-                              triplet_output_dir=os.path.join(self.output_dir, 'Triplets'),
-                              no_full_mutations=False,
-                              no_cache=False,
-                              verbose=self.verbose)
+        spectra_only = self.params.get("spectra_only", False)
+        pairwise = len(self.genomes) > 2
+        if pairwise:
+            # One pileup over every ingroup BAM gives all pairwise triad spectra in a single pass
+            mutation_extractor = PairwiseMutationExtractor(reference=self.reference.name,
+                                  taxa=[genome.name for genome in self.genomes],
+                                  pileup_file=self.pileup_path,
+                                  mutation_output_dir=os.path.join(self.output_dir, 'Mutations'),
+                                  triplet_output_dir=os.path.join(self.output_dir, 'Triplets'),
+                                  no_full_mutations=spectra_only,
+                                  no_cache=False,
+                                  filter_profiles=self.params.get("filter_profiles"),
+                                  progress_path=os.path.join(self.output_dir, "progress.jsonl"),
+                                  verbose=self.verbose)
+        else:
+            mutation_extractor = MutationExtractor(reference=self.reference.name,
+                                  taxon1=self.genomes[0].name,
+                                  taxon2=self.genomes[1].name,
+                                  pileup_file=self.pileup_path,
+                                  mutation_output_dir=os.path.join(self.output_dir, 'Mutations'),
+                                  triplet_output_dir=os.path.join(self.output_dir, 'Triplets'),
+                                  no_full_mutations=spectra_only,
+                                  no_cache=False,
+                                  filter_profiles=self.params.get("filter_profiles"),
+                                  progress_path=os.path.join(self.output_dir, "progress.jsonl"),
+                                  verbose=self.verbose)
         mutation_extractor.extract()
 
-        fivemer_extractor = FiveMerExtractor(reference=self.reference.name,
-                              taxon1=self.genomes[0].name,
-                              taxon2=self.genomes[1].name,
-                              pileup_file=self.pileup_path,
-                              output_dir=os.path.join(self.output_dir, 'Mutations'),
-                              no_cache=False,
-                              verbose=self.verbose)
-        fivemer_extractor.extract()
+        if pairwise and (not spectra_only or self.params.get("kmer_sizes")):
+            log("5-mer and k-mer counts are only extracted for runs with two ingroups; skipping them.", self.verbose)
+
+        kmer_sizes = None if pairwise else self.params.get("kmer_sizes")
+        if not spectra_only and not pairwise and 5 in (kmer_sizes or []):
+            log("5-mer counts come from the --kmer-sizes pass; skipping the separate 5-mer pass.", self.verbose)
+        elif not spectra_only and not pairwise:
+            fivemer_extractor = FiveMerExtractor(reference=self.reference.name,
+                                  taxon1=self.genomes[0].name,
+                                  taxon2=self.genomes[1].name,
+                                  pileup_file=self.pileup_path,
+                                  output_dir=os.path.join(self.output_dir, 'Mutations'),
+                                  no_cache=False,
+                                  progress_path=os.path.join(self.output_dir, "progress.jsonl"),
+                                  verbose=self.verbose)
+            fivemer_extractor.extract()
+
+        if kmer_sizes:
+            kmer_extractor = KmerExtractor(reference=self.reference.name,
+                                  taxon1=self.genomes[0].name,
+                                  taxon2=self.genomes[1].name,
+                                  pileup_file=self.pileup_path,
+                                  mutation_output_dir=os.path.join(self.output_dir, 'Mutations'),
+                                  context_output_dir=os.path.join(self.output_dir, 'Triplets'),
+                                  kmer_sizes=kmer_sizes,
+                                  no_cache=False,
+                                  filter_profiles=self.params.get("filter_profiles"),
+                                  progress_path=os.path.join(self.output_dir, "progress.jsonl"),
+                                  verbose=self.verbose)
+            kmer_extractor.extract()
 
         # log("Extracting triplets from pileup...", self.verbose)
         # triplet_extractor = TripletExtractor(reference=self.reference.name,
@@ -208,13 +266,39 @@ class MutationExtractionPipeline:
         #                       verbose=self.verbose)
         # triplet_extractor.extract()
 
-        normalizer = MutationNormalizer(
-            input_dir=self.output_dir,
-            output_dir= os.path.join(self.output_dir, "Tables"),
-            verbose=True,
-            divergence_time= self.params.get("divergence_time", None),
-        )
-        normalizer.normalize()
+        for profile in self._profile_names():
+            normalizer = MutationNormalizer(
+                input_dir=self.output_dir,
+                output_dir=self._profile_dir("Tables", profile),
+                mutation_dir=self._profile_dir("Mutations", profile),
+                triplet_dir=self._profile_dir("Triplets", profile),
+                verbose=True,
+                divergence_time= self.params.get("divergence_time", None),
+            )
+            normalizer.normalize()
+
+        for profile in self._profile_names():
+            for k in kmer_sizes or []:
+                MutationNormalizer(
+                    input_dir=self.output_dir,
+                    output_dir=self._profile_dir("Tables", profile),
+                    mutation_dir=self._profile_dir("Mutations", profile),
+                    triplet_dir=self._profile_dir("Triplets", profile),
+                    verbose=True,
+                    divergence_time=self.params.get("divergence_time", None),
+                    k=k,
+                ).normalize_kmers()
+
+    def _profile_names(self):
+        profiles = self.params.get("filter_profiles")
+        if not profiles:
+            return [None]
+        return [FilterProfile.from_value(profile).name for profile in profiles]
+
+    def _profile_dir(self, kind, profile):
+        if profile is None:
+            return os.path.join(self.output_dir, kind)
+        return os.path.join(self.output_dir, kind, profile)
 
     def _extract_bam_intervals(self, input_bam, output_dir, sorted=False, merge=False, no_cache=False):
             os.makedirs(output_dir, exist_ok=True)
@@ -278,33 +362,242 @@ class MutationExtractionPipeline:
 
     def run_plots(self):
         spectra_plotter = MutationSpectraPlotter()
-        spectra_plotter.plot(tables_dir = os.path.join(self.output_dir, 'Tables'))
+        for profile in self._profile_names():
+            spectra_plotter.plot(tables_dir = self._profile_dir('Tables', profile),
+                                 output_dir = self._profile_dir('Plots', profile),
+                                 plot_queue = self.plot_queue)
+        if self.params.get("spectra_only", False):
+            log("Spectra-only run: skipping coverage and mutation density plots.", self.verbose)
+            return
         fai_file = self.reference.fasta_path + '.fai'
-        coverage_plotter = CoveragePlotter(fai_file=fai_file)
-        mutation_density_plotter = MutationDensityPlotter(fai_file=fai_file)
-
-        top_chroms = get_top_n_chromosomes(fai_file, n=3)
-        log("Plotting coverage and mutation density for top chromosomes...", self.verbose)
-        for chrom in top_chroms:
-            log(f"Plotting for {chrom}...", self.verbose)
-
-            coverage_plotter.plot(interval_dir=os.path.join(self.output_dir, 'Intervals'),
-                                 chromosome=chrom,
-                                 output_dir=os.path.join(self.output_dir, 'Plots', f"coverage_{chrom}.png"))
-
-            mutation_density_plotter.plot(mutation_dir=os.path.join(self.output_dir, 'Mutations'),
-                                 chromosome=chrom,
-                                 output_dir=os.path.join(self.output_dir, 'Plots'))
-            
-            mutation_density_plotter.plot(mutation_dir=os.path.join(self.output_dir, 'Mutations'),
-                                 chromosome=chrom,
-                                 output_dir=os.path.join(self.output_dir, 'Plots'),
-                                 mutation_category = r"[ACTG][C>T]G")
+        # Each interval and mutation file is parsed once and served to every chromosome and plot
+        cache = PlotDataCache()
+        with self.write_summary_tracks(cache) as summary_tracks:
+            coverage_plotter = CoveragePlotter(fai_file=fai_file, cache=cache, plot_queue=self.plot_queue,
+                                               summary_tracks=summary_tracks)
+            mutation_density_plotter = MutationDensityPlotter(fai_file=fai_file, cache=cache, plot_queue=self.plot_queue,
+                                                              summary_tracks=summary_tracks)
+
+            top_chroms = get_top_n_chromosomes(fai_file, n=3)
+            log("Plotting coverage and mutation density for top chromosomes...", self.verbose)
+            for chrom in top_chroms:
+                log(f"Plotting for {chrom}...", self.verbose)
+
+                coverage_plotter.plot(interval_dir=os.path.join(self.output_dir, 'Intervals'),
+                                     chromosome=chrom,
+                                     output_dir=os.path.join(self.output_dir, 'Plots', f"coverage_{chrom}.png"))
+
+                for profile in self._profile_names():
+                    mutation_density_plotter.plot(mutation_dir=self._profile_dir('Mutations', profile),
+                                         chromosome=chrom,
+                                         output_dir=self._profile_dir('Plots', profile))
+                
+                    mutation_density_plotter.plot(mutation_dir=self._profile_dir('Mutations', profile),
+                                         chromosome=chrom,
+                                         output_dir=self._profile_dir('Plots', profile),
+                                         mutation_category = r"[ACTG][C>T]G")
             
+    def write_summary_tracks(self, cache=None):
+        """Genome-wide coverage and per-class mutation counts at every zoom level (summary_tracks.npz)."""
+        mutation_files = []
+        for profile in self._profile_names():
+            mutation_files += list_mutation_files(self._profile_dir('Mutations', profile))
+        path = write_summary_tracks(
+            summary_tracks_path(self.output_dir),
+            fasta_chromosome_lengths(self.reference.fasta_path),
+            interval_files=list_interval_files(os.path.join(self.output_dir, 'Intervals')),
+            mutation_files=mutation_files,
+            cache=cache,
+            verbose=self.verbose,
+        )
+        return SummaryTracks(path)
+
     def cleanup(self):
         cleaner = PipelineCleaner(self.genomes + [self.reference], self.alignments, self.pileup, base_dir=self.output_dir, verbose=True)
         cleaner.run(bams=True, pileup=True, genomes=True)
 
+    def cleanup_pileup(self):
+        cleaner = PipelineCleaner([], self.alignments, self.pileup, base_dir=self.output_dir, verbose=True)
+        cleaner.run(pileup=True)
+
+
+def _align(aligner, params):
+    if params.get("streamed", False):
+        aligner.align_streamed(
+            mapq=params.get("mapq", 60),
+            low_mapq=params.get("low_mapq", 1),
+            max_sort_mem=params.get("max_samtools_mem", None),
+            continuity=params.get("continuity", True)
+        )
+    else:
+        aligner.align_disk_cached(
+            mapq=params.get("mapq", 60),
+            low_mapq=params.get("low_mapq", 1),
+            continuity=params.get("continuity", True)
+        )
+
+
+def alignment_settings_tag(params, aligner_name="bwa", aligner_cmd=None):
+    """Directory name identifying the alignment settings a shared BAM was made with."""
+    tag = (f"mapq{params.get('mapq', 60)}_low{params.get('low_mapq', 1)}_"
+           f"{'continuity' if params.get('continuity', True) else 'nocontinuity'}_{aligner_name}")
+    if aligner_cmd:
+        tag += "_" + hashlib.sha1(aligner_cmd.encode()).hexdigest()[:8]
+    return tag
+
+
+def _store_genome(entry, store_dir, no_cache, verbose):
+    name, accession = entry
+    genome = Genome(name=name, accession=accession, output_dir=store_dir, no_cache=no_cache, verbose=verbose)
+    fastq_path = os.path.join(genome.output_dir, f"{name}.fastq")
+    genome.fastq_path = fastq_path if os.path.exists(fastq_path) else None
+    return genome
+
+
+def _prepare_store_genome(entry, store_dir, index_aligner, fragment, params, no_cache, verbose):
+    genome = _store_genome(entry, store_dir, no_cache, verbose)
+    genome.download()
+    if index_aligner:
+        genome.index(aligner=index_aligner)
+    if fragment:
+        genome.generate_fragment_fastq(length=params.get("fragment_length", 150),
+                                       offset=params.get("fragment_offset", 75), force=no_cache)
+
+
+def _store_aligner(species, outgroup, alignment_dir, store_dir, aligner_name, aligner_cmd, params, no_cache, verbose):
+    return Aligner(
+        species_genome=_store_genome(species, store_dir, no_cache, verbose),
+        reference_genome=_store_genome(outgroup, store_dir, no_cache, verbose),
+        base_output_dir=alignment_dir,
+        aligner_cmd=aligner_cmd,
+        aligner_name=aligner_name,
+        no_cache=no_cache,
+        cores=params.get("cores", None),
+        verbose=verbose,
+    )
+
+
+def _align_to_store(species, outgroup, alignment_dir, store_dir, aligner_name, aligner_cmd, params, no_cache, verbose):
+    _align(_store_aligner(species, outgroup, alignment_dir, store_dir, aligner_name, aligner_cmd, params, no_cache,
+                          verbose), params)
+
+
+def _run_triad(triad, cohort_dir, store_dir, alignment_dir, aligner_name, aligner_cmd, params, no_cache, verbose):
+    pipeline = MutationExtractionPipeline(
+        species_list=triad["species"],
+        outgroup=triad["outgroup"],
+        aligner_name=aligner_name,
+        aligner_cmd=aligner_cmd,
+        base_output_dir=cohort_dir,
+        no_cache=no_cache,
+        verbose=verbose,
+        run_id=triad.get("run_id"),
+        **params,
+    )
+    pipeline.reference = _store_genome(triad["outgroup"], store_dir, no_cache, verbose)
+    pipeline.genomes = [_store_genome(species, store_dir, no_cache, verbose) for species in triad["species"]]
+    pipeline.alignments = [
+        _store_aligner(species, triad["outgroup"], alignment_dir, store_dir, aligner_name, aligner_cmd, params,
+                       no_cache, verbose)
+        for species in triad["species"]
+    ]
+    pipeline.run(shared_alignments=True)
+    return pipeline.output_dir
+
+
+class CohortPipeline:
+    """
+    Runs many triads (an outgroup and two or more ingroups) against one shared store.
+
+    Every genome is downloaded once into <cohort>/Store/Genomes, outgroups are indexed once,
+    ingroups fragmented once, and every distinct (species, outgroup, alignment settings) BAM is made
+    once under <cohort>/Store/Alignments/<outgroup>/<settings>. Pileup, extraction, intervals and
+    plots then run per triad in <cohort>/<run_id>, as MutationExtractionPipeline would. All of it is
+    a task graph on a TaskScheduler with `jobs` worker processes, so independent alignments and
+    triads run concurrently.
+
+    A triad is {"outgroup": [name, accession], "species": [[name, accession], ...]}, optionally
+    with "run_id" and per-triad overrides of any pipeline setting (e.g. "mapq", "suffix").
+    """
+    def __init__(self,
+                 triads,
+                 base_output_dir="../Output",
+                 cohort_id="cohort",
+                 aligner_name="bwa",
+                 aligner_cmd=None,
+                 jobs=1,
+                 no_cache=False,
+                 verbose=True,
+                 **kwargs):
+        if not triads:
+            raise ValueError("A cohort needs at least one triad.")
+        self.triads = [self._parse_triad(triad) for triad in triads]
+        self.output_dir = os.path.join(base_output_dir, cohort_id)
+        self.store_dir = os.path.join(self.output_dir, "Store")
+        self.aligner_name = aligner_name
+        self.aligner_cmd = aligner_cmd
+        self.jobs = jobs
+        self.no_cache = no_cache
+        self.verbose = verbose
+        self.params = kwargs
+
+    @staticmethod
+    def _parse_triad(triad):
+        if not isinstance(triad, dict) or "outgroup" not in triad or "species" not in triad:
+            raise ValueError(f"A triad needs 'outgroup' and 'species': {triad!r}")
+        species = [tuple(entry) for entry in triad["species"]]
+        if len(species) < 2:
+            raise ValueError(f"A triad needs at least two ingroups: {triad!r}")
+        return dict(triad, outgroup=tuple(triad["outgroup"]), species=species)
+
+    def build_tasks(self):
+        """The cohort's TaskScheduler: one task per genome, per distinct alignment and per triad."""
+        scheduler = TaskScheduler(jobs=self.jobs, verbose=self.verbose)
+        genome_dir = os.path.join(self.store_dir, "Genomes")
+        genomes, indexed, fragmented = {}, set(), set()
+        for triad in self.triads:
+            for entry in [triad["outgroup"]] + triad["species"]:
+                if genomes.setdefault(entry[0], entry) != entry:
+                    raise ValueError(f"Species {entry[0]} is given with different accessions.")
+            indexed.add(triad["outgroup"][0])
+            fragmented.update(species[0] for species in triad["species"])
+        for name, entry in genomes.items():
+            scheduler.add(f"genome:{name}", _prepare_store_genome, entry, genome_dir,
+                          self.aligner_name if name in indexed else None, name in fragmented,
+                          self.params, self.no_cache, self.verbose)
+
+        for triad in self.triads:
+            params = {**self.params, **{k: v for k, v in triad.items() if k not in ("outgroup", "species", "run_id")}}
+            outgroup = triad["outgroup"]
+            tag = alignment_settings_tag(params, self.aligner_name, self.aligner_cmd)
+            alignment_dir = os.path.join(self.store_dir, "Alignments", outgroup[0], tag)
+            align_tasks = [
+                scheduler.add(f"align:{species[0]}->{outgroup[0]}:{tag}", _align_to_store, species, outgroup,
+                              alignment_dir, genome_dir, self.aligner_name, self.aligner_cmd, params,
+                              self.no_cache, self.verbose, deps=[f"genome:{species[0]}", f"genome:{outgroup[0]}"])
+                for species in triad["species"]
+            ]
+            run_id = triad.get("run_id") or '__'.join(entry[0] for entry in [outgroup] + triad["species"])
+            task = f"triad:{run_id}" + (f"_{params['suffix']}" if params.get("suffix") else "")
+            if task in scheduler.tasks:
+                raise ValueError(f"Duplicate triad run: {task}")
+            scheduler.add(task, _run_triad, dict(triad, run_id=run_id), self.output_dir, genome_dir, alignment_dir,
+                          self.aligner_name, self.aligner_cmd, params, self.no_cache, self.verbose, deps=align_tasks)
+        return scheduler
+
+    def run(self):
+        log(f"Starting cohort pipeline: {len(self.triads)} triads", self.verbose)
+        os.makedirs(self.store_dir, exist_ok=True)
+        scheduler = self.build_tasks()
+        n_align = sum(name.startswith("align:") for name in scheduler.tasks)
+        log(f"{n_align} distinct alignments shared by {len(self.triads)} triads, {self.jobs} concurrent jobs", self.verbose)
+        results = scheduler.run()
+        run_dirs = {name[len("triad:"):]: path for name, path in results.items() if name.startswith("triad:")}
+        with open(os.path.join(self.output_dir, "cohort_runs.json"), "w") as f:
+            json.dump(run_dirs, f, indent=2)
+        log("Cohort pipeline completed successfully.", self.verbose)
+        return run_dirs
+
 
 from .multiple_species_utils import (
     annotate_list_with_indices,
@@ -350,28 +643,43 @@ class MultiSpeciesMutationPipeline:
         self.genomes = {}
         self.alignments = []
         self.pileup_path = None
+        self.track_paths = None
+        self.plot_queue = None
 
         os.makedirs(self.output_dir, exist_ok=True)
 
     def run(self):
         log("Starting multi-species mutation extraction pipeline...", self.verbose)
-        if self.newick_tree:
-            self.parse_and_annotate_tree()
-        else:
-            self.parse_and_annotate_list()
-        self.download_index_and_fragment()
-        self.align_species_to_outgroup()
-        self.generate_pileup()
-        self._extract_mutations()
-        
-        # Validate PHYLIP is available before phylogenetic reconstruction
-        if not check_phylip_available('dnapars'):
-            raise RuntimeError(
-                "PHYLIP is required for multi-species phylogenetic reconstruction but was not found.\n"
-                "Please install PHYLIP via conda: `conda install -c bioconda phylip`"
-            )
-        
-        self._reconstruct_phylogeny()
+        # Figures are drawn in the background while later stages run (plot_jobs=0 draws them inline)
+        if self.params.get("plot_jobs") != 0:
+            self.plot_queue = PlotQueue(self.params.get("plot_jobs"), verbose=self.verbose)
+        try:
+            if self.newick_tree:
+                self.parse_and_annotate_tree()
+            else:
+                self.parse_and_annotate_list()
+            self.download_index_and_fragment()
+            self.align_species_to_outgroup()
+            if self.params.get("base_call_tracks", False):
+                self.build_base_call_tracks()
+            else:
+                self.generate_pileup()
+            self._extract_mutations()
+            
+            # Validate PHYLIP is available before phylogenetic reconstruction
+            if not check_phylip_available('dnapars'):
+                raise RuntimeError(
+                    "PHYLIP is required for multi-species phylogenetic reconstruction but was not found.\n"
+                    "Please install PHYLIP via conda: `conda install -c bioconda phylip`"
+                )
+            
+            self._reconstruct_phylogeny()
+            if self.plot_queue is not None:
+                self.plot_queue.close()
+        except BaseException:
+            if self.plot_queue is not None:
+                self.plot_queue.cancel()
+            raise
         log("Pipeline completed successfully.", self.verbose)
 
     def parse_and_annotate_tree(self):
@@ -430,7 +738,8 @@ class MultiSpeciesMutationPipeline:
                 aligner_cmd=self.aligner_cmd,
                 aligner_name=self.aligner_name,
                 cores=self.params.get('cores', None),
-                verbose=self.verbose
+                verbose=self.verbose,
+                plot_queue=self.plot_queue
             )
 
             if self.params.get("streamed", False):
@@ -460,6 +769,24 @@ class MultiSpeciesMutationPipeline:
         )
         self.pileup_path = pileup.generate()
 
+    def build_base_call_tracks(self):
+        """
+        One cached base-call track per alignment, in pileup column order. Tracks of unchanged BAMs
+        are reused, so adding a species only pileups that species' BAM before the join.
+        """
+        track_dir = os.path.join(self.output_dir, "Tracks")
+        self.track_paths = [
+            build_base_call_track(
+                aligner.final_bam,
+                self.reference.fasta_path,
+                base_call_track_path(track_dir, aligner.species, self.reference.name),
+                no_cache=self.no_cache,
+                progress_path=os.path.join(self.output_dir, "progress.jsonl"),
+                verbose=self.verbose
+            )
+            for aligner in self.alignments
+        ]
+
 
     def _extract_mutations(self):
         extractor = MultipleSpeciesMutationExtractor(
@@ -470,6 +797,12 @@ class MultiSpeciesMutationPipeline:
         species_list=self.species_list,
         mapping=self.terminal_mapping,
         no_cache=False,
+        progress_path=os.path.join(self.output_dir, "progress.jsonl"),
+        workers=self.params.get("cores") or multiprocessing.cpu_count(),
+        export_csv=self.params.get("export_csv", False),
+        tracks=self.track_paths,
+        reference_fasta=self.reference.fasta_path,
+        plot_queue=self.plot_queue,
         verbose=True
         )
         extractor.extract()
@@ -478,12 +811,15 @@ class MultiSpeciesMutationPipeline:
     def _reconstruct_phylogeny(self):
         run_phylip(
             command='dnapars',
-            df_path=os.path.join(self.output_dir, "matching_bases.csv.gz"),
+            df_path=site_matrix_path(self.output_dir) if SiteMatrix.exists(site_matrix_path(self.output_dir))
+                    else os.path.join(self.output_dir, "matching_bases.csv.gz"),
             tree_path=os.path.join(self.output_dir, "annotated_tree.nwk") if self.newick_tree else None,
             output_dir=self.output_dir,
             prefix="multi_species_phylip",
             input_string="5\nY\n",
             mapping=self.terminal_mapping,
+            bootstrap=self.params.get("bootstrap", 0),
+            workers=self.params.get("cores"),
             verbose=self.verbose
         )
 
@@ -0,0 +1,85 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .utils import log
+
+DEFAULT_PLOT_JOBS = 4
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def render(plot_queue, func, *args, message=None, verbose=True, **kwargs):
+    """Draw a figure with func now, or queue it on plot_queue when one is given."""
+    if plot_queue is None:
+        func(*args, **kwargs)
+        if message:
+            log(message, verbose)
+        return None
+    return plot_queue.submit(func, *args, message=message, **kwargs)
+
+
+class PlotQueue:
+    """
+    Renders figures in background worker processes with the non-interactive Agg backend, so
+    drawing PNGs overlaps with the stages that follow instead of blocking them.
+
+    Plot functions must be picklable and take only data (no plotter state). Workers are spawned,
+    not forked, so they never inherit the pipes of running samtools or aligner processes. close()
+    waits for every queued figure and raises if any of them failed.
+    """
+    def __init__(self, jobs=None, verbose=True):
+        self.jobs = jobs or min(DEFAULT_PLOT_JOBS, multiprocessing.cpu_count())
+        self.verbose = verbose
+        self._pool = None
+        self._pending = []
+
+    def submit(self, func, *args, message=None, **kwargs):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.jobs, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_use_agg)
+        future = self._pool.submit(func, *args, **kwargs)
+        self._pending.append((future, message))
+        return future
+
+    def wait(self):
+        """Block until every queued figure is drawn."""
+        pending, self._pending = self._pending, []
+        failures = []
+        for future, message in pending:
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(e)
+                log(f"[plots] Plot failed: {e!r}", self.verbose)
+            else:
+                if message:
+                    log(message, self.verbose)
+        if failures:
+            raise RuntimeError(f"{len(failures)} of {len(pending)} plot(s) failed: {failures[0]!r}")
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def cancel(self):
+        """Drop the figures not yet started and stop the workers, e.g. when a stage failed."""
+        self._pending = []
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.cancel()
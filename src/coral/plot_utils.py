@@ -1,12 +1,14 @@
 # plot_utils.py
 
 import os
+from collections import OrderedDict
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import re
 from typing import List, Tuple, Optional
 
+from .plot_queue import render
 from .utils import log
 
 COLOR_MUTATION = {
@@ -18,6 +20,8 @@ COLOR_TRIPLET = {
     "C": "#7E6148", "T": "#0B0B0A"
 }
 
+DEFAULT_PLOT_CACHE_BYTES = 2 * 1024 ** 3  # parsed interval/mutation arrays kept in memory across plots
+
 class MutationSpectraPlotter:
     @staticmethod
     def plot_mutations(series, output_path, title):
@@ -91,7 +95,7 @@ class MutationSpectraPlotter:
             plt.show()
         plt.close()
     
-    def plot(self, tables_dir, output_dir=None, verbose=True):
+    def plot(self, tables_dir, output_dir=None, verbose=True, plot_queue=None):
         """
         Generate all plots (raw, normalized, triplets, overlay) using MutationPlotter.
 
@@ -99,6 +103,7 @@ class MutationSpectraPlotter:
             input_dir (str): Path to directory with summary TSVs.
             output_dir (str or None): Where to save plots. Defaults to sibling 'Plots/' folder.
             verbose (bool): Whether to print progress updates.
+            plot_queue (PlotQueue or None): Draw the figures in the background instead of one by one.
         """
         input_dir = tables_dir
         if output_dir is None:
@@ -119,21 +124,21 @@ class MutationSpectraPlotter:
         # Plot per-column mutation and triplet spectra
         for col in norm.columns:
             log(f"Plotting normalized mutations for {col}")
-            self.plot_mutations(
+            render(plot_queue, self.plot_mutations,
                 norm[col], os.path.join(output_dir, f"{col}_normalized.png"),
                 f"Normalized Mutation Spectrum: {col}"
             )
 
         for col in raw.columns:
             log(f"Plotting raw mutations for {col}")
-            self.plot_mutations(
+            render(plot_queue, self.plot_mutations,
                 raw[col], os.path.join(output_dir, f"{col}_raw.png"),
                 f"Raw Mutation Spectrum: {col}"
             )
 
         for col in trip.columns:
             log(f"Plotting triplet counts for {col}")
-            self.plot_triplets(
+            render(plot_queue, self.plot_triplets,
                 trip[col], os.path.join(output_dir, f"{col}_triplets.png"),
                 f"Triplet Spectrum: {col}"
             )
@@ -142,23 +147,165 @@ class MutationSpectraPlotter:
         if len(norm.columns) == 2:
             species1, species2 = norm.columns
             log(f"Plotting overlay for normalized spectra: {species1} vs {species2}")
-            self.plot_mutation_spectra_overlay(
+            render(plot_queue, self.plot_mutation_spectra_overlay,
                 norm[species1], norm[species2], labels=[species1, species2],
                 file_name=os.path.join(output_dir, f"{species1}_vs_{species2}_normalized_overlay.png")
             )
 
             log(f"Plotting overlay for scaled spectra: {species1} vs {species2}")
-            self.plot_mutation_spectra_overlay(
+            render(plot_queue, self.plot_mutation_spectra_overlay,
                 scaled[species1], scaled[species2], labels=[species1, species2],
                 file_name=os.path.join(output_dir, f"{species1}_vs_{species2}_overlay.png")
             )
 
 
 
+def list_interval_files(interval_dir):
+    return sorted(
+        os.path.join(interval_dir, f)
+        for f in os.listdir(interval_dir)
+        if f.endswith(".tsv") or f.endswith(".tsv.gz")
+    )
+
+
+def list_mutation_files(mutation_dir):
+    return sorted(os.path.join(mutation_dir, f) for f in os.listdir(mutation_dir) if f.endswith(".csv.gz"))
+
+
+def _group_by_chromosome(chromosomes, *columns):
+    """{chromosome: tuple of the column arrays restricted to it}, rows kept in file order."""
+    codes, names = pd.factorize(chromosomes)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))  # code -1 (missing) sorts first
+    return {
+        name: tuple(column[order[lo:hi]] for column in columns)
+        for name, lo, hi in zip(names, bounds[:-1], bounds[1:])
+    }
+
+
+def _load_intervals(interval_file):
+    df = pd.read_csv(
+        interval_file,
+        sep='\t',
+        compression='infer',
+        dtype={"chromosome": str, "start": np.int64, "end": np.int64},
+        header=0
+    )
+    return _group_by_chromosome(df["chromosome"], df["start"].to_numpy(), df["end"].to_numpy()), []
+
+
+def _load_mutations(mutation_file):
+    df = pd.read_csv(mutation_file, compression='infer', usecols=['chromosome', 'position', 'mutation'],
+                     dtype={"chromosome": str})
+    codes, classes = pd.factorize(df['mutation'])  # missing classes get code -1
+    return _group_by_chromosome(df["chromosome"], df["position"].to_numpy(np.int64), codes.astype(np.int32)), list(classes)
+
+
+class PlotDataCache:
+    """
+    Interval and mutation files parsed once into per-chromosome NumPy arrays and served from
+    memory to every plot. Files are evicted least recently used first once the arrays exceed
+    max_bytes, and re-read if they change on disk.
+    """
+    def __init__(self, max_bytes=DEFAULT_PLOT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.loads = 0
+        self._entries = OrderedDict()
+
+    def _get(self, kind, path, loader):
+        stat = os.stat(path)
+        key = (kind, os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+        data = loader(path)
+        size = sum(array.nbytes for arrays in data[0].values() for array in arrays)
+        self._entries[key] = (data, size)
+        self.nbytes += size
+        self.loads += 1
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.nbytes -= evicted
+        return data
+
+    def intervals(self, interval_file, chrom):
+        """(starts, ends) int64 arrays of the coverage intervals of one chromosome."""
+        by_chrom, _ = self._get("intervals", interval_file, _load_intervals)
+        empty = np.zeros(0, dtype=np.int64)
+        return by_chrom.get(chrom, (empty, empty))
+
+    def interval_chromosomes(self, interval_file):
+        """Chromosomes with at least one interval in the file."""
+        return list(self._get("intervals", interval_file, _load_intervals)[0])
+
+    def mutation_chromosomes(self, mutation_file):
+        """Chromosomes with at least one mutation in the file."""
+        return list(self._get("mutations", mutation_file, _load_mutations)[0])
+
+    def mutation_classes(self, mutation_file):
+        """Distinct mutation classes of a file; mutation_codes index into this list (-1: missing)."""
+        return self._get("mutations", mutation_file, _load_mutations)[1]
+
+    def mutation_codes(self, mutation_file, chrom):
+        """(int64 positions, int32 class codes) of the mutations of one chromosome."""
+        by_chrom, _ = self._get("mutations", mutation_file, _load_mutations)
+        return by_chrom.get(chrom, (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)))
+
+    def mutations(self, mutation_file, chrom, mut_regex=None):
+        """int64 positions of the mutations of one chromosome, optionally only classes matching mut_regex."""
+        classes = self.mutation_classes(mutation_file)
+        positions, codes = self.mutation_codes(mutation_file, chrom)
+        if mut_regex:
+            # The regex runs once per distinct class; rows are then selected by integer code
+            matching = np.array([bool(mut_regex.search(c)) for c in classes] + [False])  # code -1 is missing
+            positions = positions[matching[codes]]
+        return positions
+
+
+def covered_length(starts, ends, x):
+    """
+    C(x) = sum over intervals of |[start, end) & [0, x)| at every x (int64 array).
+
+    C is piecewise linear with breakpoints at the interval ends, so it is evaluated exactly from
+    prefix sums of the sorted starts and ends. Empty or reversed intervals contribute nothing.
+    """
+    keep = ends > starts
+    starts, ends = np.sort(starts[keep]), np.sort(ends[keep])
+    start_sums = np.concatenate(([0], np.cumsum(starts)))
+    end_sums = np.concatenate(([0], np.cumsum(ends)))
+    n_started = np.searchsorted(starts, x)
+    n_ended = np.searchsorted(ends, x)
+    return (n_started * x - start_sums[n_started]) - (n_ended * x - end_sums[n_ended])
+
+
+def binned_coverage(starts, ends, chrom_length, bin_size, slide):
+    """
+    Bin starts and the mean coverage of every [b, b + bin_size) window, b stepping by slide:
+    C(b + bin_size) - C(b) over bin_size, with C from covered_length.
+    """
+    bin_starts = np.arange(0, chrom_length - bin_size + 1, slide, dtype=np.int64)
+    covered = covered_length(starts, ends, np.concatenate((bin_starts, bin_starts + bin_size)))
+    overlap = covered[len(bin_starts):] - covered[:len(bin_starts)]
+    return bin_starts, overlap / bin_size
+
+
+def binned_counts(positions, chrom_length, bin_size, slide):
+    """Bin starts and the number of positions in every [b, b + bin_size) window, b stepping by slide."""
+    bin_starts = np.arange(0, chrom_length - bin_size + 1, slide, dtype=np.int64)
+    positions = np.sort(positions)
+    counts = np.searchsorted(positions, bin_starts + bin_size) - np.searchsorted(positions, bin_starts)
+    return bin_starts, counts
+
+
 class CoveragePlotter:
-    def __init__(self, fai_file, verbose = True):
+    def __init__(self, fai_file, verbose = True, cache = None, plot_queue = None, summary_tracks = None):
         self.chrom_lengths = self._parse_fai(fai_file)
         self.verbose = verbose
+        self.cache = cache if cache is not None else PlotDataCache()
+        self.plot_queue = plot_queue
+        self.summary_tracks = summary_tracks  # SummaryTracks answering bin sizes its zoom levels divide
 
     def _parse_fai(self, fai_file):
         chrom_lengths = {}
@@ -172,42 +319,18 @@ class CoveragePlotter:
 
     def compute_binned_coverage(self, interval_file, chrom, bin_size=1000, slide=1000):
         """
-        Used for plotting: returns midpoints and coverage values.
+        Used for plotting: returns midpoints and coverage values (arrays).
         """
         chrom_length = self.chrom_lengths.get(chrom)
         if chrom_length is None:
             raise ValueError(f"Chromosome {chrom} not found in .fai index.")
 
-        df = pd.read_csv(
-            interval_file,
-            sep='\t',
-            compression='infer',
-            dtype={"chromosome": str, "start": int, "end": int},
-            header=0
-        )
-        df = df[df["chromosome"] == chrom].sort_values("start").reset_index(drop=True)
-
-        starts = np.arange(0, chrom_length - bin_size + 1, slide)
-        coverage = []
-        current_index = 0
-        n = len(df)
-
-        for bin_start in starts:
-            bin_end = bin_start + bin_size
-            total_overlap = 0
-            while current_index < n and df.at[current_index, "end"] <= bin_start:
-                current_index += 1
-            check_index = current_index
-            while check_index < n and df.at[check_index, "start"] < bin_end:
-                read_start = df.at[check_index, "start"]
-                read_end = df.at[check_index, "end"]
-                overlap_start = max(read_start, bin_start)
-                overlap_end = min(read_end, bin_end)
-                total_overlap += max(0, overlap_end - overlap_start)
-                check_index += 1
-            coverage.append(total_overlap / bin_size)
-
-        midpoints = [start + bin_size // 2 for start in starts]
+        precomputed = self.summary_tracks and self.summary_tracks.coverage(interval_file, chrom, bin_size, slide)
+        if precomputed:
+            starts, coverage = precomputed
+        else:
+            starts, coverage = binned_coverage(*self.cache.intervals(interval_file, chrom), chrom_length, bin_size, slide)
+        midpoints = starts + bin_size // 2
         return midpoints, coverage
 
     def compute_coverage_for_normalization(self, interval_file, chrom, bin_size=1000, slide=1000):
@@ -218,6 +341,11 @@ class CoveragePlotter:
         return coverage
 
     def plot_coverage(self, midpoints_list, coverage_list, labels, chrom, output_path):
+        render(self.plot_queue, self.draw_coverage, midpoints_list, coverage_list, labels, chrom, output_path,
+               message=f"Saved coverage plot: {output_path}", verbose=self.verbose)
+
+    @staticmethod
+    def draw_coverage(midpoints_list, coverage_list, labels, chrom, output_path):
         plt.figure(figsize=(15, 5))
         for midpoints, coverage, label in zip(midpoints_list, coverage_list, labels):
             plt.plot(midpoints, coverage, label=label, lw=1.5)
@@ -231,8 +359,6 @@ class CoveragePlotter:
         plt.savefig(output_path, dpi=300)
         plt.close()
 
-        log(f"Saved coverage plot: {output_path}", self.verbose)
-
     def plot(
         self,
         interval_dir: str,
@@ -247,11 +373,7 @@ class CoveragePlotter:
         if chromosome not in self.chrom_lengths:
             raise ValueError(f"Chromosome {chromosome} not found in FAI file.")
 
-        interval_files = sorted([
-            os.path.join(interval_dir, f)
-            for f in os.listdir(interval_dir)
-            if f.endswith(".tsv") or f.endswith(".tsv.gz")
-        ])
+        interval_files = list_interval_files(interval_dir)
         labels = [os.path.splitext(os.path.splitext(os.path.basename(f))[0])[0] for f in interval_files]
 
         midpoints_list = []
@@ -266,9 +388,13 @@ class CoveragePlotter:
 
 
 class MutationDensityPlotter:
-    def __init__(self, fai_file: str, verbose: bool = True):
+    def __init__(self, fai_file: str, verbose: bool = True, cache: Optional[PlotDataCache] = None, plot_queue=None,
+                 summary_tracks=None):
         self.chrom_lengths = self._parse_fai(fai_file)
         self.verbose = verbose
+        self.cache = cache if cache is not None else PlotDataCache()
+        self.plot_queue = plot_queue
+        self.summary_tracks = summary_tracks  # SummaryTracks answering bin sizes its zoom levels divide
 
     def _parse_fai(self, fai_file: str) -> dict:
         chrom_lengths = {}
@@ -283,64 +409,41 @@ class MutationDensityPlotter:
     def compute_mutation_density(
         self, mutation_file: str, chrom: str, bin_size: int, slide: int,
         mut_regex: Optional[re.Pattern] = None
-    ) -> Tuple[List[int], List[int]]:
+    ) -> Tuple[np.ndarray, np.ndarray]:
         chrom_length = self.chrom_lengths.get(chrom)
-        df = pd.read_csv(mutation_file, compression='infer')
-        df = df[df['chromosome'] == chrom]
-        if mut_regex:
-            df = df[df["mutation"].str.contains(mut_regex, regex=True, na=False)]
-
-        starts = np.arange(0, chrom_length - bin_size + 1, slide)
-        mutation_counts = [
-            ((df['position'] >= start) & (df['position'] < start + bin_size)).sum()
-            for start in starts
-        ]
-        midpoints = [start + bin_size // 2 for start in starts]
+        precomputed = self.summary_tracks and self.summary_tracks.mutation_counts(mutation_file, chrom, bin_size, slide,
+                                                                                  mut_regex)
+        if precomputed:
+            starts, mutation_counts = precomputed
+        else:
+            positions = self.cache.mutations(mutation_file, chrom, mut_regex)
+            starts, mutation_counts = binned_counts(positions, chrom_length, bin_size, slide)
+        midpoints = starts + bin_size // 2
         return midpoints, mutation_counts
 
     def compute_coverage_for_normalization(
         self, interval_file: str, chrom: str, bin_size: int, slide: int
-    ) -> List[float]:
+    ) -> np.ndarray:
         chrom_length = self.chrom_lengths.get(chrom)
-        df = pd.read_csv(
-            interval_file,
-            sep='\t',
-            compression='infer',
-            dtype={"chromosome": str, "start": int, "end": int},
-            header=0
-        )
-        df = df[df["chromosome"] == chrom].sort_values("start").reset_index(drop=True)
-
-        starts = np.arange(0, chrom_length - bin_size + 1, slide)
-        coverage = []
-
-        current_index = 0
-        n = len(df)
-
-        for bin_start in starts:
-            bin_end = bin_start + bin_size
-            total_overlap = 0
-
-            while current_index < n and df.at[current_index, "end"] <= bin_start:
-                current_index += 1
-
-            check_index = current_index
-            while check_index < n and df.at[check_index, "start"] < bin_end:
-                read_start = df.at[check_index, "start"]
-                read_end = df.at[check_index, "end"]
-                overlap_start = max(read_start, bin_start)
-                overlap_end = min(read_end, bin_end)
-                total_overlap += max(0, overlap_end - overlap_start)
-                check_index += 1
-
-            coverage.append(total_overlap / bin_size)
-
+        precomputed = self.summary_tracks and self.summary_tracks.coverage(interval_file, chrom, bin_size, slide)
+        if precomputed:
+            return precomputed[1]
+        _, coverage = binned_coverage(*self.cache.intervals(interval_file, chrom), chrom_length, bin_size, slide)
         return coverage
 
     def plot_mutation_density(
         self, midpoints_list: List[List[int]], values_list: List[List[float]],
         labels: List[str], chrom: str, output_path: str,
         normalized: bool = False, regex = ''
+    ):
+        render(self.plot_queue, self.draw_mutation_density, midpoints_list, values_list, labels, chrom, output_path,
+               normalized, regex, message=f"Saved mutation density plot: {output_path}", verbose=self.verbose)
+
+    @staticmethod
+    def draw_mutation_density(
+        midpoints_list: List[List[int]], values_list: List[List[float]],
+        labels: List[str], chrom: str, output_path: str,
+        normalized: bool = False, regex = ''
     ):
         plt.figure(figsize=(15, 5))
         for midpoints, values, label in zip(midpoints_list, values_list, labels):
@@ -355,8 +458,6 @@ class MutationDensityPlotter:
         plt.savefig(output_path, dpi=300)
         plt.close()
 
-        log(f"Saved mutation density plot: {output_path}", self.verbose)
-
 
     def plot(
         self,
@@ -376,19 +477,11 @@ class MutationDensityPlotter:
         if chrom_length is None:
             raise ValueError(f"Chromosome {chrom} not found in FAI file.")
 
-        mutation_files = sorted([
-            os.path.join(mutation_dir, f)
-            for f in os.listdir(mutation_dir)
-            if f.endswith(".csv.gz")
-        ])
+        mutation_files = list_mutation_files(mutation_dir)
         labels = [os.path.basename(f).replace("_mutations.csv.gz", "") for f in mutation_files]
 
         if coverage_dir:
-            interval_files = sorted([
-                os.path.join(coverage_dir, f)
-                for f in os.listdir(coverage_dir)
-                if f.endswith(".tsv") or f.endswith(".tsv.gz")
-            ])
+            interval_files = list_interval_files(coverage_dir)
         else:
             interval_files = []
 
@@ -407,7 +500,7 @@ class MutationDensityPlotter:
                 coverage = self.compute_coverage_for_normalization(
                     coverage_file, chrom, bin_size, slide
                 )
-                mutations = [m / c if c > 0 else 0 for m, c in zip(mutations, coverage)]
+                mutations = np.divide(mutations, coverage, out=np.zeros(len(coverage)), where=coverage > 0)
 
             midpoints_list.append(midpoints)
             values_list.append(mutations)
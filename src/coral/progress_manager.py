@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from .utils import log
+
+DEFAULT_PROGRESS_INTERVAL = 30  # seconds between progress reports
+PROGRESS_BATCH = 100_000  # loop iterations between counter updates
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return "unknown"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class ProgressReporter:
+    """
+    Low-overhead progress reporting for long extraction and filtering loops.
+
+    The loop pushes cumulative counters with update() once per batch (PROGRESS_BATCH iterations);
+    a daemon thread reports throughput, QC pass rate, current chromosome and ETA every `interval`
+    seconds to the log and as JSON lines to `progress_path`. Coarse sub-steps can be timed with
+    stage(). Without a progress path and with verbose off, no thread is started.
+    """
+    def __init__(self, task, total_bytes=None, progress_path=None, interval=DEFAULT_PROGRESS_INTERVAL, verbose=True):
+        self.task = task
+        self.total_bytes = total_bytes
+        self.progress_path = progress_path
+        self.interval = interval
+        self.verbose = verbose
+
+        self.items = 0
+        self.passed = None
+        self.chromosome = None
+        self.compressed_bytes = None
+        self.decompressed_bytes = None
+        self.stage_seconds = defaultdict(float)
+
+        self._start_time = None
+        self._start_compressed = None
+        self._last_update = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._start_time = self._last_update = time.time()
+        if self.progress_path or self.verbose:
+            self._thread = threading.Thread(target=self._run, name=f"progress-{self.task}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.report(done=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.report(done=exc_type is None)
+
+    def update(self, items, passed=None, chromosome=None, compressed_bytes=None, decompressed_bytes=None):
+        """Record cumulative counters for this run."""
+        self.items = items
+        self.passed = passed
+        if chromosome is not None:
+            self.chromosome = chromosome
+        if compressed_bytes is not None:
+            if self._start_compressed is None:
+                self._start_compressed = compressed_bytes
+            self.compressed_bytes = compressed_bytes
+        self.decompressed_bytes = decompressed_bytes
+        self._last_update = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] += time.time() - start
+
+    def snapshot(self, done=False):
+        now = time.time()
+        elapsed = now - self._start_time if self._start_time else 0.0
+        rate = self.items / elapsed if elapsed > 0 else 0.0
+
+        eta = None
+        if done:
+            eta = 0.0
+        elif self.total_bytes and self.compressed_bytes and elapsed > 0:
+            consumed = self.compressed_bytes - (self._start_compressed or 0)
+            if consumed > 0:
+                eta = (self.total_bytes - self.compressed_bytes) * elapsed / consumed
+
+        return {
+            "time": round(now, 3),
+            "task": self.task,
+            "done": done,
+            "elapsed_seconds": round(elapsed, 3),
+            "seconds_since_update": round(now - self._last_update, 3) if self._last_update else None,
+            "items": self.items,
+            "items_per_second": round(rate, 1),
+            "qc_pass_rate": round(self.passed / self.items, 6) if self.passed is not None and self.items else None,
+            "chromosome": self.chromosome,
+            "compressed_bytes": self.compressed_bytes,
+            "decompressed_bytes": self.decompressed_bytes,
+            "total_bytes": self.total_bytes,
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "stages": {name: round(seconds, 3) for name, seconds in self.stage_seconds.items()},
+        }
+
+    def report(self, done=False):
+        snap = self.snapshot(done=done)
+        parts = [f"[{self.task}]", f"{snap['items']:,} items ({snap['items_per_second']:,.0f}/s)"]
+        if snap["chromosome"] is not None:
+            parts.append(f"at {snap['chromosome']}")
+        if snap["qc_pass_rate"] is not None:
+            parts.append(f"QC pass {snap['qc_pass_rate']:.1%}")
+        if snap["decompressed_bytes"] is not None:
+            parts.append(f"{snap['decompressed_bytes'] / 1024 ** 2:,.1f} MB decompressed")
+        if done:
+            parts.append(f"done in {_format_duration(snap['elapsed_seconds'])}")
+        else:
+            parts.append(f"ETA {_format_duration(snap['eta_seconds'])}")
+        log(" | ".join(parts), self.verbose)
+
+        if self.progress_path:
+            with open(self.progress_path, 'a') as f:
+                f.write(json.dumps(snap) + "\n")
+        return snap
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
@@ -2,21 +2,160 @@ import os
 from pathlib import Path
 import shutil
 import subprocess
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 from ete3 import Tree
-from .multiple_species_utils import annotate_tree_with_indices, load_random_rows
+from .multiple_species_utils import annotate_tree_with_indices
+from .parsimony import ParsimonyScorer, nni_neighbours, tree_splits
+from .site_matrix import SiteBlock, SiteSampler, count_site_patterns, read_site_blocks
 from .utils import log
 
+MAX_PHYLIP_SITES = 1000000
+WEIGHTED_COMMANDS = {"dnapars", "dnapenny", "dnacomp"}  # programs that read a weights file (W option)
+WEIGHT_CODES = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"  # PHYLIP site weights 0-35
+WRITE_CHUNK_SITES = 1000000
+
+# ASCII base code -> PHYLIP character (upper case, blank as gap)
+_PHYLIP_CODES = np.arange(256, dtype=np.uint8)
+_PHYLIP_CODES[ord('a'):ord('z') + 1] -= 32
+_PHYLIP_CODES[ord(' ')] = ord('-')
+
 
 def write_phylip_infile(df, outfile):
+    if isinstance(df, np.ndarray):
+        # taxa x sites uint8 block from a site matrix, written in column chunks
+        with open(outfile, 'wb') as f:
+            f.write(f"{df.shape[0]} {df.shape[1]}\n".encode())
+            for i, row in enumerate(df):
+                f.write(f"taxa{i}     ".encode())
+                for start in range(0, len(row), WRITE_CHUNK_SITES):
+                    f.write(_PHYLIP_CODES[row[start:start + WRITE_CHUNK_SITES]].tobytes())
+                f.write(b"\n")
+        return
     irrelevant_cols = ['chromosome','position','left','right']
     taxa_cols = df.columns[~df.columns.isin(irrelevant_cols)]
     with open(outfile, 'w') as f:
         f.write(f"{len(taxa_cols)} {len(df)}\n")
         for col in taxa_cols:
-            sequence = ''.join(df[col].astype(str).values).replace(' ', '-').upper()
-            # f.write(f"{col.ljust(30)}{sequence}\n")
-            f.write(f"{col}     {sequence}\n")
+            values = df[col].astype(str).values
+            f.write(f"{col}     ")
+            for start in range(0, len(values), WRITE_CHUNK_SITES):
+                f.write(''.join(values[start:start + WRITE_CHUNK_SITES]).replace(' ', '-').upper())
+            f.write("\n")
+
+
+def column_layout(max_counts):
+    """
+    PHYLIP columns for patterns seen up to max_counts times: (pattern index, split number) per
+    column, with every pattern spread over enough columns to stay within weight 35.
+    """
+    columns = np.maximum(-(-max_counts // (len(WEIGHT_CODES) - 1)), 1)
+    pattern_index = np.repeat(np.arange(len(max_counts)), columns)
+    offset = np.arange(len(pattern_index)) - np.repeat(np.cumsum(columns) - columns, columns)
+    return pattern_index, offset
+
+
+def column_weights(counts, layout):
+    """PHYLIP weights of the columns of a layout for the given pattern counts."""
+    pattern_index, offset = layout
+    max_weight = len(WEIGHT_CODES) - 1
+    return np.clip(counts[pattern_index] - offset * max_weight, 0, max_weight)
+
+
+def pattern_weights(patterns, counts):
+    """
+    Expand (patterns x taxa, counts) into a taxa x columns alignment and PHYLIP weights,
+    splitting patterns seen more than 35 times over several columns.
+    """
+    layout = column_layout(counts)
+    return np.ascontiguousarray(patterns[layout[0]].T), column_weights(counts, layout)
+
+
+def write_phylip_weights(weights, outfile, line_length=1000):
+    codes = np.frombuffer(WEIGHT_CODES.encode(), dtype=np.uint8)[weights]
+    with open(outfile, 'wb') as f:
+        for start in range(0, len(codes), line_length):
+            f.write(codes[start:start + line_length].tobytes() + b"\n")
+
+
+def load_pattern_counts(df_path, max_rows=None, seed=42, stratify=False, verbose=True):
+    """
+    Distinct site patterns (patterns x taxa uint8) of a site matrix or matching_bases.csv.gz and
+    their site counts. Uses every site unless max_rows is set.
+    """
+    if max_rows is None:
+        patterns, counts = count_site_patterns(read_site_blocks(df_path))
+    else:
+        alignment = load_site_alignment(df_path, max_rows=max_rows, seed=seed, stratify=stratify, verbose=verbose)
+        patterns, counts = count_site_patterns([SiteBlock(None, None, None, None, alignment.T)])
+    log(f"{int(counts.sum())} sites compressed to {len(patterns)} site patterns.", verbose)
+    return patterns, counts
+
+
+def load_site_patterns(df_path, max_rows=None, seed=42, stratify=False, verbose=True):
+    """
+    Weighted PHYLIP alignment of a site matrix or matching_bases.csv.gz: one column per distinct
+    site pattern (split above weight 35) and its weights. Uses every site unless max_rows is set.
+    """
+    patterns, counts = load_pattern_counts(df_path, max_rows=max_rows, seed=seed, stratify=stratify, verbose=verbose)
+    return pattern_weights(patterns, counts)
+
+
+def bootstrap_counts(counts, replicates, seed=42):
+    """replicates x patterns site-pattern counts of bootstrap resamples of all sites."""
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(int(counts.sum()), counts / counts.sum(), size=replicates)
+
+
+def read_phylip_trees(outtree_path):
+    """
+    Trees of a PHYLIP outtree and their weights, normalized to sum to 1: PHYLIP writes a [w]
+    weight after each of several equally parsimonious trees.
+    """
+    with open(outtree_path) as f:
+        chunks = [chunk.strip() for chunk in f.read().split(';') if chunk.strip()]
+    trees, weights = [], []
+    for chunk in chunks:
+        match = re.search(r"\[([0-9.eE+-]+)\]$", chunk)
+        weights.append(float(match.group(1)) if match else 1.0)
+        trees.append(Tree(re.sub(r"\[[^\]]*\]", "", chunk) + ";", format=1))
+    total = sum(weights)
+    return trees, [weight / total for weight in weights]
+
+
+def split_support(replicate_trees, reference):
+    """Fraction of replicates supporting each split; replicate_trees is a list of (trees, weights)."""
+    support = defaultdict(float)
+    for trees, weights in replicate_trees:
+        for tree, weight in zip(trees, weights):
+            for split in tree_splits(tree, reference):
+                support[split] += weight / len(replicate_trees)
+    return dict(support)
+
+
+def majority_rule_consensus(leaves, support, threshold=0.5):
+    """
+    Consensus tree of the splits supported by more than threshold of the replicates, rooted on
+    the reference leaf of the splits, with support percentages on internal nodes.
+    """
+    consensus = Tree()
+    for leaf in sorted(leaves):
+        consensus.add_child(name=leaf)
+    for split in sorted((s for s, value in support.items() if value > threshold), key=len, reverse=True):
+        parent = consensus
+        while True:  # majority splits are compatible: descend to the smallest cluster containing split
+            inner = [child for child in parent.children if split <= set(child.get_leaf_names())]
+            if not inner:
+                break
+            parent = inner[0]
+        node = Tree(support=round(100 * support[split], 1))
+        for child in [child for child in parent.children if set(child.get_leaf_names()) <= split]:
+            node.add_child(child.detach())
+        parent.add_child(node)
+    return consensus
 
 
 def write_intree(tree, outfile):
@@ -87,59 +226,168 @@ def extract_parsimony_score(outfile_path):
                     return float(match.group(1))
     raise ValueError(f"Could not find parsimony score in {outfile_path}")
 
-def run_phylip_command(df, output_dir, exe_path, tree=None, prefix="run1", phylip_input_args="Y\n", remove_infile=True, verbose=True):
+def _place_input(source, path, write):
+    """Link a prepared input file into a work dir, or write it there."""
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+    else:
+        write(source, path)
+
+
+def run_phylip_command(df, output_dir, exe_path, tree=None, prefix="run1", phylip_input_args="Y\n", remove_infile=True,
+                       weights=None, verbose=True):
+    """
+    Run one PHYLIP program in its own temporary work directory under output_dir (PHYLIP reads
+    and writes fixed file names in its working directory), so runs can go concurrently.
+    df and weights may be arrays/DataFrames or paths to already written infile/weights files.
+    Returns {'outfile': ..., 'outtree': ...} paths in output_dir.
+    """
     # Only convert to absolute path if it's actually a path (contains path separators)
     # If it's just a command name (e.g., "dnapars"), keep it as-is so PATH resolution works
     if os.sep in exe_path or (os.altsep and os.altsep in exe_path):
         exe_path = os.path.abspath(exe_path)
     os.makedirs(output_dir, exist_ok=True)
-    cwd = os.getcwd()
-    os.chdir(output_dir)
-
-    for fname in ["infile", "intree", "outfile", "outtree"]:
-        if os.path.exists(fname):
-            os.remove(fname)
-
-    write_phylip_infile(df, "infile")
-    log(f"PHYLIP input written to {os.path.abspath('infile')}", verbose)
-
-    if tree:
-        write_intree(tree, "intree")
-
-    result = subprocess.run([exe_path], input=phylip_input_args, text=True, capture_output=True)
-
-    with open("phylip_stdout.log", "w") as f:
-        f.write(result.stdout)
-    with open("phylip_stderr.log", "w") as f:
-        f.write(result.stderr)
-
-    if result.returncode != 0:
-        raise RuntimeError(
-            f"PHYLIP run failed.\nExit code: {result.returncode}\n"
-            f"stdout:\n{result.stdout}\n"
-            f"stderr:\n{result.stderr}"
-        )
-
-    out_paths = {}
-    if os.path.exists("outfile"):
-        new_out = f"{prefix}.outfile"
-        shutil.move("outfile", new_out)
-        out_paths['outfile'] = os.path.abspath(new_out)
-    if os.path.exists("outtree"):
-        new_tree = f"{prefix}.outtree"
-        shutil.move("outtree", new_tree)
-        out_paths['outtree'] = os.path.abspath(new_tree)
-
-    if remove_infile and os.path.exists("infile"):
-        os.remove("infile")
-
-    os.chdir(cwd)
+    work_dir = tempfile.mkdtemp(prefix=f".{prefix}_", dir=output_dir)
+    try:
+        infile = os.path.join(work_dir, "infile")
+        _place_input(df, infile, write_phylip_infile)
+        log(f"PHYLIP input written to {os.path.abspath(infile)}", verbose)
+
+        if tree:
+            write_intree(tree, os.path.join(work_dir, "intree"))
+
+        if weights is not None:
+            _place_input(weights, os.path.join(work_dir, "weights"), write_phylip_weights)
+            phylip_input_args = "W\n" + phylip_input_args
+
+        result = subprocess.run([exe_path], input=phylip_input_args, text=True, capture_output=True, cwd=work_dir)
+
+        with open(os.path.join(output_dir, "phylip_stdout.log"), "w") as f:
+            f.write(result.stdout)
+        with open(os.path.join(output_dir, "phylip_stderr.log"), "w") as f:
+            f.write(result.stderr)
+
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"PHYLIP run failed.\nExit code: {result.returncode}\n"
+                f"stdout:\n{result.stdout}\n"
+                f"stderr:\n{result.stderr}"
+            )
+
+        out_paths = {}
+        for fname in ["outfile", "outtree"]:
+            if os.path.exists(os.path.join(work_dir, fname)):
+                new_path = os.path.abspath(os.path.join(output_dir, f"{prefix}.{fname}"))
+                shutil.move(os.path.join(work_dir, fname), new_path)
+                out_paths[fname] = new_path
+
+        if not remove_infile:
+            for fname in ["infile", "weights"]:
+                if os.path.exists(os.path.join(work_dir, fname)):
+                    shutil.move(os.path.join(work_dir, fname), os.path.join(output_dir, fname))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
     return out_paths
 
 
+def load_site_alignment(df_path, max_rows=MAX_PHYLIP_SITES, seed=42, stratify=False, verbose=True):
+    """
+    taxa x sites uint8 block of a site matrix or matching_bases.csv.gz, randomly subsampled to
+    max_rows sites in a single read (optionally stratified by chromosome), in input order.
+    """
+    sampler = SiteSampler(max_rows, seed=seed, stratify=stratify)
+    for block in read_site_blocks(df_path):
+        sampler.add(block)
+    _, bases = sampler.sample()
+    log(f"Sampled {len(bases)} of {sampler.n_sites} sites{' by chromosome' if stratify else ''}.", verbose)
+    return np.ascontiguousarray(bases.T)
+
+
+def _write_bootstrap_consensus(replicate_outputs, tree, bootstrap_dir, mapping, verbose=True):
+    replicate_trees = [read_phylip_trees(output["outtree"]) for output in replicate_outputs]
+    leaves = replicate_trees[0][0][0].get_leaf_names()
+    reference = "taxa0" if "taxa0" in leaves else sorted(leaves)[0]
+    support = split_support(replicate_trees, reference)
+    consensus = majority_rule_consensus(leaves, support)
+
+    names = {f"taxa{index}": name for name, index in (mapping or {}).items() if isinstance(index, int)}
+    for leaf in consensus.iter_leaves():
+        leaf.name = names.get(leaf.name, leaf.name)
+    consensus_path = os.path.join(bootstrap_dir, "consensus.nwk")
+    consensus.write(outfile=consensus_path, format=2)
+    log(f"Majority-rule consensus of {len(replicate_trees)} bootstrap replicates saved to {consensus_path}", verbose)
+
+    if tree is not None:
+        given = tree.copy()
+        for node in given.traverse():
+            if not node.is_leaf() and not node.is_root():
+                leaves = frozenset(given.get_leaf_names())
+                side = frozenset(node.get_leaf_names())
+                if reference in side:
+                    side = leaves - side
+                trivial = not 1 < len(side) < len(leaves) - 1
+                node.support = 100.0 if trivial else round(100 * support.get(side, 0.0), 1)
+        for leaf in given.iter_leaves():
+            leaf.name = names.get(leaf.name, leaf.name)
+        support_path = os.path.join(bootstrap_dir, "given_tree_support.nwk")
+        given.write(outfile=support_path, format=2)
+        log(f"Bootstrap support of the given tree saved to {support_path}", verbose)
+
+
+def _score_trees(scorer, default_output, tree, verbose=True):
+    """Native scores of PHYLIP's most parsimonious tree(s) and of the given tree; reports its NNI neighbours."""
+    if "outtree" in default_output:
+        best_trees, _ = read_phylip_trees(default_output["outtree"])
+        default_score = float(scorer.score(best_trees).min())
+        phylip_score = extract_parsimony_score(default_output["outfile"])
+        if phylip_score != default_score:
+            log(f"Note: PHYLIP reports {phylip_score} for its tree, the native score is {default_score}.", verbose)
+    else:
+        default_score = extract_parsimony_score(default_output["outfile"])
+
+    neighbours = nni_neighbours(tree)
+    scores = scorer.score([tree] + neighbours)
+    given_score = float(scores[0])
+    if neighbours:
+        shorter = int((scores[1:] < scores[0]).sum())
+        log(f"{shorter} of {len(neighbours)} NNI neighbours of the given tree are shorter "
+            f"(best neighbour: {int(scores[1:].min())} changes).", verbose)
+    return default_score, given_score
 
-def run_phylip(command, df_path, tree_path, output_dir, prefix, input_string, mapping, verbose=True):
-    df = load_random_rows(df_path, verbose=verbose).astype(str)
+
+def run_phylip(command, df_path, tree_path, output_dir, prefix, input_string, mapping, max_sites=None,
+               stratify=False, seed=42, bootstrap=0, workers=None, verbose=True):
+    """
+    Programs in WEIGHTED_COMMANDS get every variable site (or a max_sites sample) as weighted
+    site patterns; the others get a random sample of max_sites (default MAX_PHYLIP_SITES) sites.
+    For the weighted (parsimony) programs, PHYLIP only searches for the most parsimonious tree:
+    that tree, the given tree and its NNI neighbours are scored with ParsimonyScorer.
+
+    With bootstrap > 0, that many replicates are resampled as multinomial pattern weights over
+    the same infile and run alongside the main analysis on `workers` threads; their trees give
+    a majority-rule consensus (and support for the given tree) in {prefix}_bootstrap/.
+    """
+    if bootstrap and command not in WEIGHTED_COMMANDS:
+        raise ValueError(f"Bootstrap replicates need a program that reads site weights: {sorted(WEIGHTED_COMMANDS)}")
+    weights = None
+    replicate_weights = []
+    if command in WEIGHTED_COMMANDS:
+        patterns, counts = load_pattern_counts(df_path, max_rows=max_sites, seed=seed, stratify=stratify,
+                                               verbose=verbose)
+        replicate_counts = bootstrap_counts(counts, bootstrap, seed=seed)
+        # one column layout wide enough for every replicate, so all runs share the infile
+        layout = column_layout(np.maximum(counts, replicate_counts.max(axis=0, initial=0)))
+        df = np.ascontiguousarray(patterns[layout[0]].T)
+        weights = column_weights(counts, layout)
+        replicate_weights = [column_weights(replicate, layout) for replicate in replicate_counts]
+        scorer = ParsimonyScorer(patterns, counts)
+    else:
+        scorer = None
+        df = load_site_alignment(df_path, max_rows=max_sites or MAX_PHYLIP_SITES, seed=seed, stratify=stratify,
+                                 verbose=verbose)
     # df = pd.read_csv(df_path, index_col=0).astype(str)
     tree = Tree(tree_path, format=1) if tree_path else None
 
@@ -155,36 +403,81 @@ def run_phylip(command, df_path, tree_path, output_dir, prefix, input_string, ma
 
     no_tree_dir = os.path.join(output_dir, f"{prefix}_no_tree")
     tree_dir = os.path.join(output_dir, f"{prefix}_with_tree")
+    bootstrap_dir = os.path.join(output_dir, f"{prefix}_bootstrap")
 
-    log(f"Running PHYLIP {command} without a starting tree...", verbose)
-    default_output = run_phylip_command(
-        df,
-        output_dir=no_tree_dir,
-        exe_path=exe_path,
-        tree=None,
-        prefix=prefix,
-        phylip_input_args=input_string,
-        verbose=verbose
-    )
-    log(f"PHYLIP outputs (no tree): {default_output}", verbose)
+    replicate_outputs = []
+    # Write the alignment once; every run links it into its own work directory
+    os.makedirs(output_dir, exist_ok=True)
+    input_dir = tempfile.mkdtemp(prefix=f".{prefix}_input_", dir=output_dir)
+    try:
+        infile = os.path.join(input_dir, "infile")
+        write_phylip_infile(df, infile)
+        if weights is not None:
+            write_phylip_weights(weights, os.path.join(input_dir, "weights"))
+            weights = os.path.join(input_dir, "weights")
+
+        with ThreadPoolExecutor(max_workers=max(2, workers or os.cpu_count() or 1)) as pool:
+            log(f"Running PHYLIP {command} without a starting tree...", verbose)
+            default_future = pool.submit(
+                run_phylip_command,
+                infile,
+                output_dir=no_tree_dir,
+                exe_path=exe_path,
+                tree=None,
+                prefix=prefix,
+                phylip_input_args=input_string,
+                weights=weights,
+                verbose=verbose
+            )
+            if tree_path and scorer is None:
+                log(f"Running PHYLIP {command} with a starting tree...", verbose)
+                tree_future = pool.submit(
+                    run_phylip_command,
+                    infile,
+                    output_dir=tree_dir,
+                    exe_path=exe_path,
+                    tree=tree,
+                    prefix="given_tree_run",
+                    phylip_input_args='U\n' + input_string,
+                    weights=weights,
+                    verbose=verbose
+                )
+            if replicate_weights:
+                log(f"Running {len(replicate_weights)} bootstrap replicates of PHYLIP {command}...", verbose)
+            replicate_futures = []
+            for i, replicate in enumerate(replicate_weights):
+                replicate_path = os.path.join(input_dir, f"weights{i}")
+                write_phylip_weights(replicate, replicate_path)
+                replicate_futures.append(pool.submit(
+                    run_phylip_command,
+                    infile,
+                    output_dir=os.path.join(bootstrap_dir, f"replicate{i:03d}"),
+                    exe_path=exe_path,
+                    tree=None,
+                    prefix=f"replicate{i:03d}",
+                    phylip_input_args=input_string,
+                    weights=replicate_path,
+                    verbose=False
+                ))
+            default_output = default_future.result()
+            log(f"PHYLIP outputs (no tree): {default_output}", verbose)
+            if tree_path and scorer is None:
+                tree_output = tree_future.result()
+                log(f"PHYLIP outputs (with tree): {tree_output}", verbose)
+            replicate_outputs = [future.result() for future in replicate_futures]
+    finally:
+        shutil.rmtree(input_dir, ignore_errors=True)
+
+    if replicate_outputs:
+        _write_bootstrap_consensus(replicate_outputs, tree, bootstrap_dir, mapping, verbose)
 
     if tree_path:
-        log(f"Running PHYLIP {command} with a starting tree...", verbose)
-        tree_output = run_phylip_command(
-            df,
-            output_dir=tree_dir,
-            exe_path=exe_path,
-            tree=tree,
-            prefix="given_tree_run",
-            phylip_input_args='U\n' + input_string,
-            verbose=verbose
-        )
-        log(f"PHYLIP outputs (with tree): {tree_output}", verbose)
-
-        
         # === Compare scores ===
-        default_score = extract_parsimony_score(default_output["outfile"])
-        given_score = extract_parsimony_score(tree_output["outfile"])
+        if scorer is None:
+            default_score = extract_parsimony_score(default_output["outfile"])
+            given_score = extract_parsimony_score(tree_output["outfile"])
+        else:
+            default_score, given_score = _score_trees(scorer, default_output, tree, verbose)
 
         log("\nParsimony Score Comparison:", verbose)
         log(f" - Most Parsimonious Tree Score: {default_score}", verbose)
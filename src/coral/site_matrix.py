@@ -0,0 +1,375 @@
+import csv
+import gzip
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SITE_CHUNK = 1_000_000  # sites per chunk when iterating a site matrix
+WRITE_BUFFER_SITES = 100_000
+
+_ASCII = np.array([chr(code) for code in range(256)], dtype=object)
+
+
+def site_matrix_path(output_dir):
+    return os.path.join(output_dir, "matching_bases.sites")
+
+
+class SiteBlock:
+    """
+    A run of variable sites held as arrays: chromosome names, positions, ASCII-coded (uint8)
+    left/right flanks and a sites x taxa uint8 block of ASCII base codes (taxa0 = outgroup).
+    """
+    def __init__(self, chromosomes, positions, lefts, rights, bases):
+        self.chromosomes = chromosomes
+        self.positions = positions
+        self.lefts = lefts
+        self.rights = rights
+        self.bases = bases
+
+    def __len__(self):
+        return len(self.positions)
+
+    @staticmethod
+    def _codes(values):
+        return np.asarray(values).astype('S1').view(np.uint8)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build a block from a matching_bases DataFrame (chromosome, position, left, right, taxa0..)."""
+        taxa_cols = sorted((c for c in df.columns if c.startswith("taxa")), key=lambda c: int(c[4:]))
+        bases = cls._codes(df[taxa_cols].to_numpy()).reshape(len(df), len(taxa_cols))
+        return cls(df["chromosome"].to_numpy(), df["position"].to_numpy(),
+                   cls._codes(df["left"].to_numpy()), cls._codes(df["right"].to_numpy()), bases)
+
+    def left_chars(self):
+        return _ASCII[self.lefts]
+
+    def right_chars(self):
+        return _ASCII[self.rights]
+
+
+def read_site_blocks(path, chunk_size=DEFAULT_SITE_CHUNK):
+    """Iterate SiteBlocks of a site matrix directory or a matching_bases.csv.gz, in one streaming read."""
+    if SiteMatrix.exists(path):
+        yield from SiteMatrix(path).chunks(chunk_size)
+        return
+    for df in pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False):
+        yield SiteBlock.from_frame(df)
+
+
+class SiteSampler:
+    """
+    Uniform random sample of at most max_sites sites from a stream of SiteBlocks.
+
+    Every site draws a random key and the sample is the max_sites smallest keys (a reservoir
+    that works on whole blocks), so memory is bounded by the sample size and the input is read
+    once. With stratify=True each chromosome gets a share of the sample proportional to its
+    number of sites (largest remainder). Chromosomes are expected to be contiguous, as written
+    by the extractor: the pools of chromosomes already passed are trimmed to the largest share
+    they can still end up with.
+    """
+    def __init__(self, max_sites, seed=42, stratify=False):
+        self.max_sites = max_sites
+        self.stratify = stratify
+        self.rng = np.random.default_rng(seed)
+        self.n_sites = 0
+        self.counts = {}
+        self.pools = {}  # chromosome (or None) -> (keys, site indices, sites x taxa bases)
+
+    @staticmethod
+    def _smallest(pool, size):
+        keys, indices, bases = pool
+        if len(keys) <= size:
+            return pool
+        if size == 0:
+            return keys[:0], indices[:0], bases[:0]
+        keep = np.argpartition(keys, size - 1)[:size]
+        return keys[keep], indices[keep], bases[keep]
+
+    def _merge(self, group, keys, indices, bases, size):
+        if group in self.pools:
+            pool_keys, pool_indices, pool_bases = self.pools[group]
+            if len(pool_keys) >= size:
+                new = keys < pool_keys.max()
+                keys, indices, bases = keys[new], indices[new], bases[new]
+            keys = np.concatenate([pool_keys, keys])
+            indices = np.concatenate([pool_indices, indices])
+            bases = np.concatenate([pool_bases, bases])
+        self.pools[group] = self._smallest((keys, indices, bases), size)
+
+    def add(self, block):
+        n = len(block)
+        if not n:
+            return
+        keys = self.rng.random(n)
+        indices = np.arange(self.n_sites, self.n_sites + n, dtype=np.int64)
+        self.n_sites += n
+        if not self.stratify:
+            self._merge(None, keys, indices, block.bases, self.max_sites)
+            return
+
+        chromosomes, inverse = np.unique(block.chromosomes, return_inverse=True)
+        for i, chromosome in enumerate(chromosomes.tolist()):
+            rows = inverse == i
+            self.counts[chromosome] = self.counts.get(chromosome, 0) + int(rows.sum())
+            self._merge(chromosome, keys[rows], indices[rows], block.bases[rows], self.max_sites)
+
+        current = block.chromosomes[-1]
+        for chromosome, count in self.counts.items():
+            if chromosome != current:
+                share = -(-self.max_sites * count // self.n_sites)  # ceil; only shrinks as sites are added
+                self.pools[chromosome] = self._smallest(self.pools[chromosome], share)
+
+    def _quotas(self):
+        exact = {c: self.max_sites * count / self.n_sites for c, count in self.counts.items()}
+        quotas = {c: int(value) for c, value in exact.items()}
+        by_remainder = sorted(exact, key=lambda c: quotas[c] - exact[c])
+        for chromosome in by_remainder[:self.max_sites - sum(quotas.values())]:
+            quotas[chromosome] += 1
+        return quotas
+
+    def sample(self):
+        """Returns (site indices in input order, sites x taxa uint8 bases)."""
+        if not self.pools:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.uint8)
+        if self.stratify and self.n_sites > self.max_sites:
+            quotas = self._quotas()
+            pools = [self._smallest(self.pools[c], quotas[c]) for c in self.pools if quotas[c]]
+        else:
+            pools = list(self.pools.values())
+        indices = np.concatenate([pool[1] for pool in pools])
+        bases = np.concatenate([pool[2] for pool in pools])
+        order = np.argsort(indices, kind='stable')
+        return indices[order], bases[order]
+
+
+class SiteMatrixWriter:
+    """
+    Streams variable sites into a site-matrix directory.
+
+    Sites are appended to raw column files; close() lays them out as .npy arrays (the taxa block
+    transposed to taxa x sites) and writes meta.json, which marks the matrix as complete.
+    checkpoint() flushes and returns a state that a resumed writer truncates back to.
+    """
+    def __init__(self, path, n_taxa, resume=None, chunk_size=DEFAULT_SITE_CHUNK):
+        self.path = path
+        self.n_taxa = n_taxa
+        self.chunk_size = chunk_size
+        self.chromosomes = list(resume["chromosomes"]) if resume else []
+        self._chromosome_ids = {name: i for i, name in enumerate(self.chromosomes)}
+        self.n_sites = resume["sites"] if resume else 0
+        self._buffer = []
+
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        self._files = {}
+        for name, dtype, width in self._columns():
+            raw_path = os.path.join(path, f"{name}.bin")
+            if resume:
+                f = open(raw_path, 'r+b')
+                f.truncate(self.n_sites * np.dtype(dtype).itemsize * width)
+                f.seek(0, os.SEEK_END)
+            else:
+                f = open(raw_path, 'wb')
+            self._files[name] = f
+
+    def _columns(self):
+        return [("chromosome", np.int32, 1), ("position", np.int32, 1),
+                ("left", np.uint8, 1), ("right", np.uint8, 1), ("taxa", np.uint8, self.n_taxa)]
+
+    def chromosome_id(self, name):
+        if name not in self._chromosome_ids:
+            self._chromosome_ids[name] = len(self.chromosomes)
+            self.chromosomes.append(name)
+        return self._chromosome_ids[name]
+
+    def append(self, chromosome, position, left, right, bases):
+        """Add one site; bases is a sequence of n_taxa single characters."""
+        self._buffer.append((self.chromosome_id(chromosome), int(position), left, right, ''.join(bases)))
+        if len(self._buffer) >= WRITE_BUFFER_SITES:
+            self.flush()
+
+    def append_block(self, chromosome_ids, positions, lefts, rights, bases):
+        """Add sites as arrays; chromosome_ids must come from chromosome_id()."""
+        self.flush()
+        self._write(chromosome_ids, positions, lefts, rights, bases)
+
+    def _write(self, chromosome_ids, positions, lefts, rights, bases):
+        arrays = {
+            "chromosome": np.asarray(chromosome_ids, dtype=np.int32),
+            "position": np.asarray(positions, dtype=np.int32),
+            "left": np.asarray(lefts, dtype=np.uint8),
+            "right": np.asarray(rights, dtype=np.uint8),
+            "taxa": np.ascontiguousarray(bases, dtype=np.uint8).reshape(-1, self.n_taxa),
+        }
+        for name, array in arrays.items():
+            self._files[name].write(array.tobytes())
+        self.n_sites += len(arrays["position"])
+
+    def flush(self):
+        if not self._buffer:
+            return
+        chromosome_ids, positions, lefts, rights, bases = zip(*self._buffer)
+        self._buffer = []
+        self._write(
+            chromosome_ids, positions,
+            np.frombuffer(''.join(lefts).encode('ascii'), dtype=np.uint8),
+            np.frombuffer(''.join(rights).encode('ascii'), dtype=np.uint8),
+            np.frombuffer(''.join(bases).encode('ascii'), dtype=np.uint8),
+        )
+
+    def checkpoint(self):
+        self.flush()
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        return {"sites": self.n_sites, "chromosomes": list(self.chromosomes)}
+
+    def close(self, callable_contexts=None, sources=None):
+        """
+        Lay out the .npy arrays (plus callable_contexts.npy if given) and mark the matrix complete.
+        sources (JSON-serializable) records what the matrix was built from, for cache checks.
+        """
+        self.flush()
+        for f in self._files.values():
+            f.close()
+
+        for name, dtype, width in self._columns():
+            raw_path = os.path.join(self.path, f"{name}.bin")
+            shape = (self.n_sites, width) if name == "taxa" else (self.n_sites,)
+            out_shape = (width, self.n_sites) if name == "taxa" else shape
+            npy_path = os.path.join(self.path, f"{name}.npy")
+            if not self.n_sites:
+                np.save(npy_path, np.zeros(out_shape, dtype=dtype))  # empty files cannot be mapped
+            else:
+                out = np.lib.format.open_memmap(npy_path, mode='w+', dtype=dtype, shape=out_shape)
+                raw = np.memmap(raw_path, dtype=dtype, mode='r', shape=shape)
+                for start in range(0, self.n_sites, self.chunk_size):
+                    stop = min(start + self.chunk_size, self.n_sites)
+                    if name == "taxa":
+                        out[:, start:stop] = raw[start:stop].T
+                    else:
+                        out[start:stop] = raw[start:stop]
+                out.flush()
+                del raw, out
+            os.remove(raw_path)
+
+        contexts_path = os.path.join(self.path, "callable_contexts.npy")
+        if callable_contexts is not None:
+            np.save(contexts_path, np.asarray(callable_contexts, dtype=np.int64))
+        elif os.path.exists(contexts_path):
+            os.remove(contexts_path)
+
+        with open(os.path.join(self.path, "meta.json"), 'w') as f:
+            json.dump({"n_sites": self.n_sites, "n_taxa": self.n_taxa, "chunk_size": self.chunk_size,
+                       "chromosomes": self.chromosomes, "sources": sources}, f, indent=2)
+
+
+class SiteMatrix:
+    """
+    Read-only, memory-mapped view of a site-matrix directory:
+
+        chromosome.npy  int32 ids into meta.json "chromosomes"
+        position.npy    int32 positions
+        left.npy        uint8 ASCII 5' flank base
+        right.npy       uint8 ASCII 3' flank base
+        taxa.npy        uint8 ASCII bases, taxa x sites (row 0 = outgroup)
+        callable_contexts.npy  optional int64 trinucleotide counts of the callable invariant sites
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.n_sites = meta["n_sites"]
+        self.n_taxa = meta["n_taxa"]
+        self.chunk_size = meta["chunk_size"]
+        self.chromosomes = np.array(meta["chromosomes"], dtype=object)
+        self.sources = meta.get("sources")
+
+        mmap_mode = 'r' if self.n_sites else None  # empty files cannot be mapped
+        self.chromosome = np.load(os.path.join(path, "chromosome.npy"), mmap_mode=mmap_mode)
+        self.position = np.load(os.path.join(path, "position.npy"), mmap_mode=mmap_mode)
+        self.left = np.load(os.path.join(path, "left.npy"), mmap_mode=mmap_mode)
+        self.right = np.load(os.path.join(path, "right.npy"), mmap_mode=mmap_mode)
+        self.taxa = np.load(os.path.join(path, "taxa.npy"), mmap_mode=mmap_mode)
+        contexts_path = os.path.join(path, "callable_contexts.npy")
+        self.callable_contexts = np.load(contexts_path) if os.path.exists(contexts_path) else None
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "meta.json"))
+
+    def __len__(self):
+        return self.n_sites
+
+    def block(self, start, stop):
+        return SiteBlock(
+            self.chromosomes[self.chromosome[start:stop]],
+            np.asarray(self.position[start:stop]),
+            np.asarray(self.left[start:stop]),
+            np.asarray(self.right[start:stop]),
+            np.ascontiguousarray(self.taxa[:, start:stop].T),
+        )
+
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        for start in range(0, self.n_sites, chunk_size):
+            yield self.block(start, min(start + chunk_size, self.n_sites))
+
+    def alignment(self, indices=None):
+        """taxa x sites uint8 block, optionally restricted to the given site indices."""
+        if indices is None:
+            return np.asarray(self.taxa)
+        return self.taxa[:, indices]
+
+    def to_csv(self, csv_path):
+        """Export in the matching_bases.csv.gz text layout."""
+        header = ["chromosome", "position", "left", "right"] + [f"taxa{i}" for i in range(self.n_taxa)]
+        with gzip.open(csv_path, 'wt', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for block in self.chunks():
+                bases = block.bases.view(f"S{self.n_taxa}").reshape(-1)
+                for chrom, pos, left, right, row in zip(block.chromosomes, block.positions.tolist(),
+                                                        block.left_chars(), block.right_chars(), bases.tolist()):
+                    writer.writerow([chrom, pos, left, right, *row.decode()])
+
+
+def _unique_rows(rows, counts=None):
+    rows = np.ascontiguousarray(rows)
+    keys = rows.view(np.dtype((np.void, rows.shape[1]))).reshape(-1)
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    weights = np.ones(len(rows), dtype=np.int64) if counts is None else counts
+    return rows[first], np.bincount(inverse.reshape(-1), weights=weights, minlength=len(first)).astype(np.int64)
+
+
+def count_site_patterns(blocks):
+    """
+    Distinct taxa columns (site patterns) over a stream of SiteBlocks and how many sites have
+    each: (patterns x taxa uint8, counts). Memory is bounded by the number of distinct patterns.
+    """
+    patterns, counts = None, None
+    pending, pending_rows = [], 0
+    for block in blocks:
+        if not len(block):
+            continue
+        pending.append(_unique_rows(block.bases))
+        pending_rows += len(pending[-1][0])
+        if pending_rows > 2 * (0 if patterns is None else len(patterns)) + DEFAULT_SITE_CHUNK:
+            patterns, counts = _merge_patterns(patterns, counts, pending)
+            pending, pending_rows = [], 0
+    if pending:
+        patterns, counts = _merge_patterns(patterns, counts, pending)
+    if patterns is None:
+        return np.zeros((0, 0), dtype=np.uint8), np.zeros(0, dtype=np.int64)
+    return patterns, counts
+
+
+def _merge_patterns(patterns, counts, pending):
+    if patterns is not None:
+        pending = [(patterns, counts)] + pending
+    return _unique_rows(np.concatenate([p for p, _ in pending]), np.concatenate([c for _, c in pending]))
@@ -0,0 +1,186 @@
+import json
+import os
+
+import numpy as np
+
+from .plot_utils import PlotDataCache, covered_length
+from .utils import log
+
+ZOOM_LEVELS = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def summary_tracks_path(output_dir):
+    return os.path.join(output_dir, "summary_tracks.npz")
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _window_sums(values, zoom, chrom_length, bin_size, slide):
+    """Bin starts and the sums of every [b, b + bin_size) window over per-zoom bin values."""
+    bin_starts = np.arange(0, chrom_length - bin_size + 1, slide, dtype=np.int64)
+    prefix = np.concatenate(([0], np.cumsum(values)))
+    return bin_starts, prefix[(bin_starts + bin_size) // zoom] - prefix[bin_starts // zoom]
+
+
+def _concatenate(parts, dtype):
+    """One array of the per-chromosome parts and the [start, end) slice of each chromosome in it."""
+    offsets, position = {}, 0
+    for chrom, part in parts.items():
+        offsets[chrom] = [position, position + len(part)]
+        position += len(part)
+    array = np.concatenate(list(parts.values())) if parts else np.zeros(0)
+    return array.astype(dtype), offsets
+
+
+def write_summary_tracks(path, chrom_lengths, interval_files=(), mutation_files=(), zooms=ZOOM_LEVELS,
+                         cache=None, verbose=True):
+    """
+    Precompute coverage and per-class mutation counts at every zoom level into one .npz.
+
+    Per chromosome and zoom z, only the L // z full bins are stored: any window of a size and
+    slide that z divides is a sum of whole bins, so it is rebuilt exactly from a prefix sum.
+    Coverage is the covered base count per bin; mutation counts are sparse (bin, class, count)
+    triples over the file's distinct classes (len(classes) for a missing one). Every file, zoom
+    and kind is one array over all chromosomes, sliced by per-chromosome offsets in the index;
+    chromosomes without rows in a file take no space, and chromosomes shorter than the smallest
+    zoom or without rows in any file are not indexed. Sources are keyed by their path relative
+    to the file's directory and recorded with size and mtime, so stale tracks are ignored on read.
+    """
+    cache = cache if cache is not None else PlotDataCache()
+    root = os.path.dirname(os.path.abspath(path))
+    index = {"zooms": list(zooms), "coverage": {}, "mutations": {}}
+    arrays = {}
+    indexed = set()
+
+    def chromosomes(names):
+        return [chrom for chrom in names if chrom_lengths.get(chrom, 0) >= min(zooms)]
+
+    for i, interval_file in enumerate(interval_files):
+        parts = {zoom: {} for zoom in zooms}
+        for chrom in chromosomes(cache.interval_chromosomes(interval_file)):
+            starts, ends = cache.intervals(interval_file, chrom)
+            for zoom in zooms:
+                if chrom_lengths[chrom] >= zoom:
+                    edges = np.arange(0, chrom_lengths[chrom] // zoom + 1, dtype=np.int64) * zoom
+                    parts[zoom][chrom] = np.diff(covered_length(starts, ends, edges))
+            indexed.add(chrom)
+        offsets = {}
+        for zoom in zooms:
+            arrays[f"coverage/{i}/{zoom}"], offsets[zoom] = _concatenate(parts[zoom], np.int64)
+        index["coverage"][os.path.relpath(os.path.abspath(interval_file), root)] = dict(
+            _signature(interval_file), id=i, offsets=offsets)
+
+    for i, mutation_file in enumerate(mutation_files):
+        classes = cache.mutation_classes(mutation_file)
+        n_classes = len(classes) + 1
+        keys, counts = {zoom: {} for zoom in zooms}, {zoom: {} for zoom in zooms}
+        for chrom in chromosomes(cache.mutation_chromosomes(mutation_file)):
+            positions, codes = cache.mutation_codes(mutation_file, chrom)
+            codes = np.where(codes < 0, len(classes), codes).astype(np.int64)  # missing class: len(classes)
+            for zoom in zooms:
+                bins = positions // zoom
+                in_range = (positions >= 0) & (bins < chrom_lengths[chrom] // zoom)
+                if in_range.any():
+                    keys[zoom][chrom], counts[zoom][chrom] = np.unique(bins[in_range] * n_classes + codes[in_range],
+                                                                       return_counts=True)
+            indexed.add(chrom)
+        offsets = {}
+        for zoom in zooms:
+            zoom_keys, offsets[zoom] = _concatenate(keys[zoom], np.int64)
+            arrays[f"mutations/{i}/{zoom}/bins"] = (zoom_keys // n_classes).astype(np.int32)
+            arrays[f"mutations/{i}/{zoom}/classes"] = (zoom_keys % n_classes).astype(np.int16)
+            arrays[f"mutations/{i}/{zoom}/counts"] = _concatenate(counts[zoom], np.int32)[0]
+        index["mutations"][os.path.relpath(os.path.abspath(mutation_file), root)] = dict(
+            _signature(mutation_file), id=i, classes=classes, offsets=offsets)
+
+    index["chromosomes"] = [[name, length] for name, length in chrom_lengths.items() if name in indexed]
+    arrays["index"] = np.frombuffer(json.dumps(index).encode(), dtype=np.uint8)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    log(f"Summary tracks written to: {path}", verbose)
+    return path
+
+
+class SummaryTracks:
+    """
+    Reader of a summary_tracks.npz. Queries are answered from the largest zoom level dividing
+    both the bin size and the slide, and return None when no level fits, the chromosome is not
+    indexed, or the source file is missing from the tracks or has changed since, so callers can
+    fall back to the raw files. Each array is read from the file once, on first use.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self._npz = np.load(path)
+        index = json.loads(self._npz["index"].tobytes())
+        self.zooms = index["zooms"]
+        self.chrom_lengths = {name: length for name, length in index["chromosomes"]}
+        self._arrays = {}
+        self._coverage = index["coverage"]
+        self._mutations = index["mutations"]
+
+    def zoom_for(self, bin_size, slide):
+        fitting = [zoom for zoom in self.zooms if bin_size % zoom == 0 and slide % zoom == 0]
+        return max(fitting) if fitting else None
+
+    def _source(self, sources, path):
+        entry = sources.get(os.path.relpath(os.path.abspath(path), self.root))
+        if entry is None or not os.path.exists(path) or _signature(path) != {"size": entry["size"], "mtime": entry["mtime"]}:
+            return None
+        return entry
+
+    def _lookup(self, sources, path, chrom, bin_size, slide):
+        zoom = self.zoom_for(bin_size, slide)
+        if zoom is None or chrom not in self.chrom_lengths:
+            return None, None
+        entry = self._source(sources, path)
+        return (entry, zoom) if entry is not None else (None, None)
+
+    def _slice(self, key, entry, chrom, zoom):
+        """The part of a concatenated array belonging to chrom, or None if the file has no rows there."""
+        offsets = entry["offsets"][str(zoom)].get(chrom)
+        if offsets is None:
+            return None
+        if key not in self._arrays:
+            self._arrays[key] = self._npz[key]
+        return self._arrays[key][offsets[0]:offsets[1]]
+
+    def coverage(self, interval_file, chrom, bin_size, slide):
+        """(bin starts, mean coverage per window) as CoveragePlotter computes it, or None."""
+        entry, zoom = self._lookup(self._coverage, interval_file, chrom, bin_size, slide)
+        if entry is None:
+            return None
+        values = self._slice(f"coverage/{entry['id']}/{zoom}", entry, chrom, zoom)
+        if values is None:
+            values = np.zeros(self.chrom_lengths[chrom] // zoom, dtype=np.int64)
+        bin_starts, overlap = _window_sums(values, zoom, self.chrom_lengths[chrom], bin_size, slide)
+        return bin_starts, overlap / bin_size
+
+    def mutation_counts(self, mutation_file, chrom, bin_size, slide, mut_regex=None):
+        """(bin starts, mutations per window), optionally only classes matching mut_regex, or None."""
+        entry, zoom = self._lookup(self._mutations, mutation_file, chrom, bin_size, slide)
+        if entry is None:
+            return None
+        key = f"mutations/{entry['id']}/{zoom}"
+        bins, classes, counts = (self._slice(f"{key}/{name}", entry, chrom, zoom) for name in ["bins", "classes", "counts"])
+        if bins is None:
+            bins, classes, counts = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int32)
+        if mut_regex:
+            matching = np.array([bool(mut_regex.search(c)) for c in entry["classes"]] + [False])
+            bins, counts = bins[matching[classes]], counts[matching[classes]]
+        values = np.bincount(bins, weights=counts, minlength=self.chrom_lengths[chrom] // zoom).astype(np.int64)
+        return _window_sums(values, zoom, self.chrom_lengths[chrom], bin_size, slide)
+
+    def close(self):
+        self._arrays = {}
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
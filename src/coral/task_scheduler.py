@@ -0,0 +1,97 @@
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .utils import log
+
+
+class TaskScheduler:
+    """
+    Dependency-aware task runner: every task is submitted to a pool of `jobs` workers as soon as
+    all of its dependencies have finished, so independent branches of the graph run concurrently.
+
+    Tasks are registered by name and re-adding a name is a no-op, which is how work shared by
+    several consumers (a genome, an alignment) is done exactly once. When a task fails, everything
+    depending on it is skipped while independent tasks run to completion; the failures are then
+    raised together. Tasks run in worker processes by default, so their callables and arguments
+    must be picklable.
+    """
+    def __init__(self, jobs=1, executor_class=ProcessPoolExecutor, verbose=True):
+        self.jobs = max(1, int(jobs or 1))
+        self.executor_class = executor_class
+        self.verbose = verbose
+        self.tasks = {}
+
+    def add(self, name, func, *args, deps=(), **kwargs):
+        if name not in self.tasks:
+            self.tasks[name] = (func, args, kwargs, tuple(dict.fromkeys(deps)))
+        return name
+
+    def order(self):
+        """Task names in a dependency-respecting order; raises ValueError on unknown dependencies or cycles."""
+        waiting, dependents = {}, defaultdict(list)
+        for name, (_, _, _, deps) in self.tasks.items():
+            unknown = [dep for dep in deps if dep not in self.tasks]
+            if unknown:
+                raise ValueError(f"Task {name!r} depends on unknown tasks: {', '.join(unknown)}")
+            waiting[name] = len(deps)
+            for dep in deps:
+                dependents[dep].append(name)
+
+        ready = deque(name for name, count in waiting.items() if count == 0)
+        order = []
+        while ready:
+            name = ready.popleft()
+            order.append(name)
+            for dependent in dependents[name]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        if len(order) != len(self.tasks):
+            raise ValueError(f"Dependency cycle among tasks: {', '.join(sorted(set(self.tasks) - set(order)))}")
+        return order
+
+    def run(self):
+        """Run every task; returns {name: result}."""
+        order = self.order()
+        waiting = {name: len(self.tasks[name][3]) for name in order}
+        dependents = defaultdict(list)
+        for name in order:
+            for dep in self.tasks[name][3]:
+                dependents[dep].append(name)
+
+        results, failures = {}, {}
+        with self.executor_class(max_workers=self.jobs) as pool:
+            running = {}
+
+            def submit(name):
+                func, args, kwargs, _ = self.tasks[name]
+                log(f"[scheduler] Starting {name}", self.verbose)
+                running[pool.submit(func, *args, **kwargs)] = name
+
+            for name in order:
+                if waiting[name] == 0:
+                    submit(name)
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except (Exception, SystemExit) as e:
+                        failures[name] = e
+                        log(f"[scheduler] {name} failed: {e!r}", self.verbose)
+                        continue
+                    log(f"[scheduler] Finished {name}", self.verbose)
+                    for dependent in dependents[name]:
+                        waiting[dependent] -= 1
+                        if waiting[dependent] == 0:
+                            submit(dependent)
+
+        if failures:
+            skipped = [name for name in order if name not in results and name not in failures]
+            message = "; ".join(f"{name}: {error!r}" for name, error in failures.items())
+            if skipped:
+                message += f" (skipped dependents: {', '.join(skipped)})"
+            raise RuntimeError(f"{len(failures)} task(s) failed: {message}")
+        return results
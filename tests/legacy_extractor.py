@@ -0,0 +1,66 @@
+"""Per-line window QC and recursive Fitch of the original multi-species extractor, kept as test references."""
+
+
+def all_same(seq):
+    return len(seq) > 0 and all(ch == seq[0] for ch in seq)
+
+
+def quality_check(fields):
+    sample_fields = fields[3:]
+    return (
+        sample_fields
+        and all('*' not in field for field in sample_fields)
+        and all(all_same(field.translate(str.maketrans('', '', '^$[]'))) for field in sample_fields)
+    )
+
+
+def detect_mutations(buffer):
+    triplets = [fields[3:] for fields in buffer]
+    prev_bases, curr_bases, next_bases = triplets
+    if all_same(prev_bases) and all_same(next_bases) and len(set(curr_bases)) > 1:
+        return [
+            buffer[1][0],  # chrom
+            buffer[1][1],  # pos
+            prev_bases[0].upper(),
+            next_bases[0].upper(),
+            buffer[1][2].upper()
+        ] + [b.upper() for b in curr_bases]
+    return None
+
+
+def _recursive_state_check(node, row, mapping):
+    if node.is_leaf():
+        node.add_feature("state", {row[f"taxa{mapping[node.name]}"]})
+        return node.state
+    child_states = [_recursive_state_check(child, row, mapping) for child in node.children]
+    # Intersect all child states if any intersection exists, otherwise union
+    node_state = child_states[0]
+    for child_state in child_states[1:]:
+        intersect = node_state & child_state
+        node_state = intersect if intersect else node_state | child_state
+    node.add_feature("state", node_state)
+    return node_state
+
+
+def _recursive_fitch(node, parent_state, row, mutation_dict, ambiguous_count):
+    next_state = parent_state
+    if parent_state not in node.state:
+        if len(node.state) > 1:
+            return mutation_dict, ambiguous_count + 1
+        next_state = list(node.state)[0]
+        parent_name = node.up.custom_name if node.up else "ROOT"
+        branch_key = f"{parent_name}→{node.custom_name}"
+        mutation = f"{row['left']}[{parent_state}>{next_state}]{row['right']}"
+        mutation_dict.setdefault(branch_key, []).append((row['chromosome'], row['position'], mutation))
+    if not node.is_leaf():
+        for child in node.children:
+            mutation_dict, ambiguous_count = _recursive_fitch(child, next_state, row, mutation_dict, ambiguous_count)
+    return mutation_dict, ambiguous_count
+
+
+def fitch(tree_root, row, mutation_dict, mapping):
+    """Mutations of one matching-bases row appended to mutation_dict, and the ambiguous count."""
+    root_state = _recursive_state_check(tree_root, row, mapping)
+    if len(root_state) == 1:
+        return _recursive_fitch(tree_root, list(root_state)[0], row, mutation_dict, 0)
+    return mutation_dict, 1
@@ -0,0 +1,78 @@
+"""Shared-store planning and dependency scheduling of cohort runs."""
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+
+def test_scheduler_runs_independent_tasks_concurrently_and_skips_failed_branches():
+    from coral.task_scheduler import TaskScheduler
+
+    finished, barrier = [], threading.Barrier(2, timeout=5)
+
+    def task(name, wait_for_peer=False, fail=False):
+        if wait_for_peer:
+            barrier.wait()  # only returns if both independent branches run at the same time
+        if fail:
+            raise RuntimeError(f"{name} broke")
+        time.sleep(0.01)
+        finished.append(name)
+        return name
+
+    scheduler = TaskScheduler(jobs=3, executor_class=ThreadPoolExecutor, verbose=False)
+    scheduler.add("genome", task, "genome")
+    scheduler.add("align_a", task, "align_a", True, deps=["genome"])
+    scheduler.add("align_b", task, "align_b", True, deps=["genome"])
+    scheduler.add("align_a", task, "duplicate", deps=["genome"])
+    scheduler.add("triad_ab", task, "triad_ab", deps=["align_a", "align_b"])
+    assert scheduler.order() == ["genome", "align_a", "align_b", "triad_ab"]
+    assert scheduler.run() == {name: name for name in ["genome", "align_a", "align_b", "triad_ab"]}
+    assert finished[0] == "genome" and finished[-1] == "triad_ab"
+
+    finished.clear()
+    scheduler = TaskScheduler(jobs=2, executor_class=ThreadPoolExecutor, verbose=False)
+    scheduler.add("bad", task, "bad", fail=True)
+    scheduler.add("after_bad", task, "after_bad", deps=["bad"])
+    scheduler.add("good", task, "good")
+    with pytest.raises(RuntimeError, match="bad broke.*skipped dependents: after_bad"):
+        scheduler.run()
+    assert finished == ["good"]
+
+    scheduler.add("loop", task, "loop", deps=["loop2"])
+    scheduler.add("loop2", task, "loop2", deps=["loop"])
+    with pytest.raises(ValueError, match="cycle"):
+        scheduler.order()
+
+
+def test_cohort_aligns_each_species_outgroup_pair_once(tmp_path):
+    from coral.pipeline import CohortPipeline
+
+    o, p, a, b, c = (["O", "GCF_1"], ["P", "GCF_2"], ["A", "GCF_3"], ["B", "GCF_4"], ["C", "GCF_5"])
+    cohort = CohortPipeline([{"outgroup": o, "species": [a, b]},
+                             {"outgroup": o, "species": [a, c]},
+                             {"outgroup": o, "species": [b, c], "mapq": 30},
+                             {"outgroup": p, "species": [a, b]},
+                             {"outgroup": a, "species": [b, c]}],
+                            base_output_dir=str(tmp_path), jobs=4, verbose=False)
+    tasks = cohort.build_tasks().tasks
+
+    aligns = sorted(name.split(":")[1] for name in tasks if name.startswith("align:"))
+    assert aligns == sorted(["A->O", "B->O", "C->O", "B->O", "C->O", "A->P", "B->P", "B->A", "C->A"])
+    assert len([name for name in tasks if name.startswith("genome:")]) == 5
+    assert len([name for name in tasks if name.startswith("triad:")]) == 5
+
+    _, args, _, deps = tasks["triad:O__A__C"]
+    assert deps == ("align:A->O:mapq60_low1_continuity_bwa", "align:C->O:mapq60_low1_continuity_bwa")
+    assert args[3] == str(tmp_path / "cohort" / "Store" / "Alignments" / "O" / "mapq60_low1_continuity_bwa")
+    _, args, _, _ = tasks["genome:A"]
+    assert args[2] == "bwa" and args[3]  # A is an outgroup in one triad and an ingroup in others
+
+    with pytest.raises(ValueError, match="different accessions"):
+        CohortPipeline([{"outgroup": o, "species": [a, b]}, {"outgroup": o, "species": [["A", "GCF_9"], c]}],
+                       base_output_dir=str(tmp_path)).build_tasks()
@@ -0,0 +1,517 @@
+"""Tests for pileup-based mutation extraction on a small synthetic pileup."""
+
+import gzip
+import json
+import os
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+
+def _random_field(rng, ref):
+    roll = rng.random()
+    if roll < 0.05:
+        return "*"
+    if roll < 0.10:
+        return ".A"
+    if roll < 0.25:
+        return rng.choice("ACGTacgt") * 2
+    return rng.choice([".", ",", "..", "^]."])
+
+
+def write_pileup(path, n_lines=3000, n_samples=2, seed=0):
+    rng = random.Random(seed)
+    with gzip.open(path, "wt") as f:
+        for i in range(n_lines):
+            chrom = "chr1" if i < n_lines // 2 else "chr2"
+            ref = rng.choice("ACGTACGTN")
+            cols = [chrom, str(i + 1), ref]
+            for _ in range(n_samples):
+                field = _random_field(rng, ref)
+                cols += [str(len(field)), field, "I" * len(field)]
+            f.write("\t".join(cols) + "\n")
+    return path
+
+
+def test_kmer_extractor_matches_fixed_extractors(tmp_path):
+    from coral.mutation_extractor_manager import FiveMerExtractor, KmerExtractor, MutationExtractor
+    from coral.kmer_utils import SparseKmerCounts
+
+    pileup = write_pileup(tmp_path / "test.pileup.gz")
+    mut_dir, trip_dir = str(tmp_path / "Mutations"), str(tmp_path / "Triplets")
+
+    MutationExtractor("R", "A", "B", pileup, mut_dir, trip_dir, verbose=False).extract()
+    FiveMerExtractor("R", "A", "B", pileup, mut_dir, verbose=False).extract()
+    paths = KmerExtractor("R", "A", "B", pileup, mut_dir, trip_dir, kmer_sizes=(3, 5), verbose=False).extract()
+
+    def acgt_only(d):
+        return {k: v for k, v in d.items() if all(c in "ACGT[]>" for c in k)}
+
+    with open(os.path.join(mut_dir, "A__B__R__mutations.json")) as f:
+        assert SparseKmerCounts.load(paths[3]["mut1"]).to_dict() == acgt_only(json.load(f))
+    with open(os.path.join(trip_dir, "B__A__R__triplets.json")) as f:
+        assert SparseKmerCounts.load(paths[3]["ctx2"]).to_dict() == acgt_only(json.load(f))
+    with open(os.path.join(mut_dir, "B__A__R__5mers.json")) as f:
+        assert SparseKmerCounts.load(paths[5]["mut2"]).to_dict() == acgt_only(json.load(f))
+
+
+def test_kmer_normalizer_matches_triplet_normalizer(tmp_path):
+    import pandas as pd
+    from coral.mutation_extractor_manager import KmerExtractor, MutationExtractor, MutationNormalizer
+
+    pileup = write_pileup(tmp_path / "test.pileup.gz", seed=1)
+    mut_dir, trip_dir = str(tmp_path / "Mutations"), str(tmp_path / "Triplets")
+    MutationExtractor("R", "A", "B", pileup, mut_dir, trip_dir, verbose=False).extract()
+    KmerExtractor("R", "A", "B", pileup, mut_dir, trip_dir, kmer_sizes=(3,), verbose=False).extract()
+
+    MutationNormalizer(str(tmp_path), verbose=False).normalize()
+    MutationNormalizer(str(tmp_path), verbose=False, k=3).normalize_kmers()
+
+    tables = tmp_path / "Tables"
+    for name in ["collapsed_mutations", "normalized_scaled"]:
+        legacy = pd.read_csv(tables / f"{name}.tsv", sep="\t", index_col=0).fillna(0).sort_index()
+        kmer = pd.read_csv(tables / f"{name}_3mer.tsv", sep="\t", index_col=0).fillna(0).sort_index()
+        kmer.columns = [c.replace("__3mer_mutations", "__mutations") for c in kmer.columns]
+        pd.testing.assert_frame_equal(legacy[sorted(legacy.columns)], kmer[sorted(kmer.columns)], check_dtype=False)
+
+
+def _bgzip_copy(src, dst):
+    import pysam
+    with gzip.open(src, "rb") as fin, pysam.BGZFile(str(dst), "wb") as fout:
+        fout.write(fin.read())
+    return dst
+
+
+def test_mutation_extractor_resumes_from_checkpoint(tmp_path, monkeypatch):
+    import pytest
+    from coral.mutation_extractor_manager import MutationExtractor
+
+    plain = write_pileup(tmp_path / "plain.pileup.gz", seed=2)
+    for pileup in [plain, _bgzip_copy(plain, tmp_path / "bgzf.pileup.gz")]:
+        ref_dir, run_dir = tmp_path / f"{pileup.stem}_ref", tmp_path / f"{pileup.stem}_run"
+        MutationExtractor("R", "A", "B", pileup, str(ref_dir), str(ref_dir), verbose=False).extract()
+
+        calls = {"n": 0}
+        original = MutationExtractor.detect_mutation_triplet
+
+        def crashing(self, triplets):
+            calls["n"] += 1
+            if calls["n"] == 400:
+                raise KeyboardInterrupt
+            return original(self, triplets)
+
+        extractor = MutationExtractor("R", "A", "B", pileup, str(run_dir), str(run_dir),
+                                      checkpoint_interval=250, verbose=False)
+        monkeypatch.setattr(MutationExtractor, "detect_mutation_triplet", crashing)
+        with pytest.raises(KeyboardInterrupt):
+            extractor.extract()
+        monkeypatch.setattr(MutationExtractor, "detect_mutation_triplet", original)
+        assert os.path.exists(extractor.checkpoint_path)
+
+        extractor.extract()
+        assert not os.path.exists(extractor.checkpoint_path)
+        for name in os.listdir(ref_dir):
+            if name.endswith(".json"):
+                assert json.loads((ref_dir / name).read_text()) == json.loads((run_dir / name).read_text())
+            else:
+                assert gzip.open(ref_dir / name).read() == gzip.open(run_dir / name).read()
+
+
+def test_filter_profiles_share_one_pass(tmp_path):
+    from coral.mutation_extractor_manager import MutationExtractor
+
+    pileup = write_pileup(tmp_path / "test.pileup.gz", seed=3)
+    MutationExtractor("R", "A", "B", pileup, str(tmp_path / "M"), str(tmp_path / "T"), verbose=False).extract()
+    profiles = [{"name": "default"}, {"name": "relaxed", "max_discordant": 1, "allow_flank_deletions": True}]
+    MutationExtractor("R", "A", "B", pileup, str(tmp_path / "PM"), str(tmp_path / "PT"),
+                      filter_profiles=profiles, verbose=False).extract()
+
+    for name in os.listdir(tmp_path / "T"):
+        default = json.loads((tmp_path / "PT" / "default" / name).read_text())
+        relaxed = json.loads((tmp_path / "PT" / "relaxed" / name).read_text())
+        assert default == json.loads((tmp_path / "T" / name).read_text())
+        assert sum(relaxed.values()) > sum(default.values())
+
+
+def test_relaxed_profile_counts_discordance_after_ref_matching():
+    from coral.mutation_extractor_manager import FilterProfile
+
+    strict, relaxed = FilterProfile("strict"), FilterProfile("relaxed", max_discordant=1)
+    assert relaxed.call_base("...,,A", "C", False) == "C"  # one discordant read, not three
+    assert relaxed.call_base("..,,aA", "C", False) is None
+    assert relaxed.call_base("gGgA", "C", False) == "G"
+    assert relaxed.call_base("T.T", "C", False) == "T"
+    assert strict.call_base("...", "C", False) == "C"
+    assert strict.call_base("..,", "C", False) is None  # strict keeps the read-identity rule
+    assert strict.call_base("gG", "C", False) is None
+
+
+def test_kmer_extractor_counts_each_filter_profile(tmp_path):
+    from coral.kmer_utils import SparseKmerCounts
+    from coral.mutation_extractor_manager import KmerExtractor, MutationExtractor
+
+    pileup = write_pileup(tmp_path / "test.pileup.gz", seed=4)
+    profiles = [{"name": "default"}, {"name": "relaxed", "max_discordant": 1, "allow_flank_deletions": True}]
+    mut_dir, trip_dir = tmp_path / "Mutations", tmp_path / "Triplets"
+    MutationExtractor("R", "A", "B", pileup, str(mut_dir), str(trip_dir), filter_profiles=profiles,
+                      verbose=False).extract()
+    extractor = KmerExtractor("R", "A", "B", pileup, str(mut_dir), str(trip_dir), kmer_sizes=(3, 5),
+                              filter_profiles=profiles, verbose=False)
+    extractor.extract()
+
+    def acgt_only(d):
+        return {k: v for k, v in d.items() if all(c in "ACGT[]>" for c in k)}
+
+    for name in ["default", "relaxed"]:
+        paths = extractor.outputs[name][3]
+        assert paths["mut1"] == str(mut_dir / name / "A__B__R__3mer_mutations.npz")
+        with open(mut_dir / name / "B__A__R__mutations.json") as f:
+            assert SparseKmerCounts.load(paths["mut2"]).to_dict() == acgt_only(json.load(f))
+        with open(trip_dir / name / "A__B__R__triplets.json") as f:
+            assert SparseKmerCounts.load(paths["ctx1"]).to_dict() == acgt_only(json.load(f))
+    assert (SparseKmerCounts.load(extractor.outputs["relaxed"][5]["ctx1"]).to_dict()
+            != SparseKmerCounts.load(extractor.outputs["default"][5]["ctx1"]).to_dict())
+
+
+
+def test_pairwise_extraction_matches_two_taxon_runs(tmp_path, monkeypatch):
+    import itertools
+    import pytest
+    from coral.mutation_extractor_manager import MutationExtractor, PairwiseMutationExtractor
+
+    taxa = ["A", "B", "C", "D"]
+    pileup = write_pileup(tmp_path / "all.pileup.gz", n_samples=len(taxa), seed=8)
+    profiles = [{"name": "default"}, {"name": "relaxed", "max_discordant": 1, "allow_flank_deletions": True}]
+
+    extractor = PairwiseMutationExtractor("R", taxa, pileup, str(tmp_path / "M"), str(tmp_path / "T"),
+                                          filter_profiles=profiles, checkpoint_interval=300, verbose=False)
+    calls = {"n": 0}
+    original = PairwiseMutationExtractor._position_sites
+
+    def crashing(self, parsed):
+        calls["n"] += 1
+        if calls["n"] == 1000:
+            raise KeyboardInterrupt
+        return original(self, parsed)
+
+    monkeypatch.setattr(PairwiseMutationExtractor, "_position_sites", crashing)
+    with pytest.raises(KeyboardInterrupt):
+        extractor.extract()
+    monkeypatch.setattr(PairwiseMutationExtractor, "_position_sites", original)
+    extractor.extract()
+    assert not os.path.exists(extractor.checkpoint_path)
+
+    lines = [line.rstrip("\n").split("\t") for line in gzip.open(pileup, "rt")]
+    for a, b in itertools.combinations(range(len(taxa)), 2):
+        pair_pileup = tmp_path / f"{taxa[a]}{taxa[b]}.pileup.gz"
+        with gzip.open(pair_pileup, "wt") as f:
+            for cols in lines:
+                f.write("\t".join(cols[:3] + cols[3 + 3 * a:6 + 3 * a] + cols[3 + 3 * b:6 + 3 * b]) + "\n")
+        pair_dir = tmp_path / f"pair_{taxa[a]}{taxa[b]}"
+        MutationExtractor("R", taxa[a], taxa[b], pair_pileup, str(pair_dir / "M"), str(pair_dir / "T"),
+                          filter_profiles=profiles, verbose=False).extract()
+        for kind in ["M", "T"]:
+            for profile in ["default", "relaxed"]:
+                for name in os.listdir(pair_dir / kind / profile):
+                    expected, actual = pair_dir / kind / profile / name, tmp_path / kind / profile / name
+                    if name.endswith(".json"):
+                        assert json.loads(actual.read_text()) == json.loads(expected.read_text())
+                    else:
+                        assert gzip.open(actual).read() == gzip.open(expected).read()
+    assert len(os.listdir(tmp_path / "M" / "default")) == 2 * 12
+
+
+def test_progress_is_reported_to_jsonl(tmp_path, monkeypatch):
+    from coral import mutation_extractor_manager
+    from coral.mutation_extractor_manager import MutationExtractor
+
+    monkeypatch.setattr(mutation_extractor_manager, "PROGRESS_BATCH", 500)
+    pileup = write_pileup(tmp_path / "test.pileup.gz", seed=4)
+    progress_path = tmp_path / "progress.jsonl"
+    MutationExtractor("R", "A", "B", pileup, str(tmp_path / "M"), str(tmp_path / "T"),
+                      progress_path=str(progress_path), verbose=False).extract()
+
+    final = json.loads(progress_path.read_text().splitlines()[-1])
+    assert final["done"] and final["items"] == 2998
+    assert 0 < final["qc_pass_rate"] < 1
+    assert final["compressed_bytes"] == final["total_bytes"] == os.path.getsize(pileup)
+    assert "write" in final["stages"]
+
+
+def test_counts_only_matches_full_extraction(tmp_path):
+    from coral.mutation_extractor_manager import MutationExtractor
+
+    pileup = write_pileup(tmp_path / "test.pileup.gz", seed=5)
+    profiles = [{"name": "default"}, {"name": "relaxed", "max_discordant": 1, "allow_flank_deletions": True}]
+    MutationExtractor("R", "A", "B", pileup, str(tmp_path / "M"), str(tmp_path / "T"),
+                      filter_profiles=profiles, verbose=False).extract()
+    MutationExtractor("R", "A", "B", pileup, str(tmp_path / "CM"), str(tmp_path / "CT"),
+                      filter_profiles=profiles, no_full_mutations=True, verbose=False).extract()
+
+    for full_dir, counts_dir in [("M", "CM"), ("T", "CT")]:
+        for profile in ["default", "relaxed"]:
+            full, counts = tmp_path / full_dir / profile, tmp_path / counts_dir / profile
+            assert sorted(os.listdir(counts)) == sorted(n for n in os.listdir(full) if n.endswith(".json"))
+            for name in os.listdir(counts):
+                assert (counts / name).read_text() == (full / name).read_text()
+
+
+def _legacy_matching_rows(extractor, pileup):
+    from legacy_extractor import detect_mutations, quality_check
+    rows, buffer, qc = [], [None, None, None], [False, False, False]
+    with gzip.open(pileup, "rt") as f:
+        for line in f:
+            buffer = buffer[1:] + [extractor._parse_line(line)]
+            qc = qc[1:] + [quality_check(buffer[-1])]
+            if all(qc):
+                result = detect_mutations(buffer)
+                if result:
+                    rows.append(",".join(result))
+    return rows
+
+
+def _legacy_callable_contexts(extractor, pileup):
+    from collections import Counter
+    from legacy_extractor import all_same, quality_check
+    contexts, buffer, qc = Counter(), [None, None, None], [False, False, False]
+    with gzip.open(pileup, "rt") as f:
+        for line in f:
+            buffer = buffer[1:] + [extractor._parse_line(line)]
+            qc = qc[1:] + [quality_check(buffer[-1])]
+            if all(qc) and all(all_same(fields[3:]) for fields in buffer) \
+                    and buffer[1][2].upper() == buffer[1][3].upper():
+                context = "".join(fields[3].upper() for fields in buffer)
+                if set(context) <= set("ACGT"):
+                    contexts[context] += 1
+    return contexts
+
+
+def test_block_scanner_matches_line_scan_on_irregular_lines(tmp_path):
+    from coral.multiple_species_mutation_extractor_manager import MultipleSpeciesMutationExtractor, PileupBlockScanner
+    from coral.site_matrix import SiteMatrix, SiteMatrixWriter
+
+    n_samples = 60
+    rng = random.Random(11)
+    pileup = tmp_path / "wide.pileup.gz"
+    with gzip.open(pileup, "wt") as f:
+        for i in range(4000):
+            ref = rng.choice("ACGTN")
+            cols = ["chr1", str(i + 1), ref]
+            base = rng.choice(["."] * 6 + ["A", "c", "g", "*", "^]G", "$"])
+            for _ in range(n_samples):
+                field = base if rng.random() < 0.98 else rng.choice(["T", ",", "a", ""])
+                cols += ["1", field, "I"]
+            line = "\t".join(cols)
+            roll = rng.random()
+            if roll < 0.01:
+                line += "\r"
+            elif roll < 0.02:
+                line += " "
+            f.write(line + "\n")
+
+    mapping = {f"s{i}": i for i in range(n_samples + 1)}
+    extractor = MultipleSpeciesMutationExtractor(str(pileup), str(tmp_path), n_species=n_samples + 1,
+                                                 species_list=[[name] for name in mapping], mapping=mapping)
+    expected = _legacy_matching_rows(extractor, pileup)
+
+    writer = SiteMatrixWriter(str(tmp_path / "wide.sites"), n_samples + 1)
+    scanner = PileupBlockScanner(n_samples + 1, extractor._parse_line)
+    lines = gzip.open(pileup, "rt").readlines()
+    for start in range(0, len(lines), 333):
+        scanner.scan("".join(lines[start:start + 333]), writer)
+    writer.close()
+
+    matrix = SiteMatrix(str(tmp_path / "wide.sites"))
+    rows = [",".join([str(block.chromosomes[i]), str(block.positions[i]), block.left_chars()[i],
+                      block.right_chars()[i], *block.bases[i].tobytes().decode()])
+            for block in matrix.chunks() for i in range(len(block))]
+    assert rows == expected and len(rows) > 20
+    from coral.parsimony import CONTEXTS
+    callable_contexts = _legacy_callable_contexts(extractor, pileup)
+    assert scanner.contexts.tolist() == [callable_contexts[context] for context in CONTEXTS]
+
+
+def test_site_matrix_resumes_and_exports_matching_bases(tmp_path, monkeypatch):
+    import pytest
+    from coral import multiple_species_mutation_extractor_manager as manager
+    from coral.multiple_species_mutation_extractor_manager import MultipleSpeciesMutationExtractor
+    from coral.site_matrix import SiteMatrix, site_matrix_path
+
+    pileup = write_pileup(tmp_path / "multi.pileup.gz", n_lines=20000, n_samples=3, seed=6)
+    mapping = {name: i for i, name in enumerate("OABC")}
+    species = [[name] for name in "OABC"]
+
+    extractor = MultipleSpeciesMutationExtractor(str(pileup), str(tmp_path), n_species=4, species_list=species,
+                                                 mapping=mapping, checkpoint_interval=2000, export_csv=True)
+    monkeypatch.setattr(manager, "SCAN_BATCH_LINES", 700)
+    calls = {"n": 0}
+    original = manager.PileupBlockScanner.scan
+
+    def crashing(self, batch, writer):
+        calls["n"] += 1
+        if calls["n"] == 10:
+            raise KeyboardInterrupt
+        return original(self, batch, writer)
+
+    monkeypatch.setattr(manager.PileupBlockScanner, "scan", crashing)
+    with pytest.raises(KeyboardInterrupt):
+        extractor.extract()
+    monkeypatch.setattr(manager.PileupBlockScanner, "scan", original)
+    extractor.extract()
+
+    expected = _legacy_matching_rows(extractor, pileup)
+    exported = gzip.open(tmp_path / "matching_bases.csv.gz", "rt").read().splitlines()
+    assert exported == [",".join(["chromosome", "position", "left", "right"] + [f"taxa{i}" for i in range(4)])] + expected
+
+    matrix = SiteMatrix(site_matrix_path(tmp_path))
+    assert len(matrix) == len(expected) and matrix.taxa.shape == (4, len(expected))
+    assert matrix.alignment()[:, 0].tobytes().decode() == "".join(expected[0].split(",")[4:])
+    from coral.parsimony import CONTEXTS
+    callable_contexts = _legacy_callable_contexts(extractor, pileup)
+    assert matrix.callable_contexts.tolist() == [callable_contexts[context] for context in CONTEXTS]
+    assert sum(callable_contexts.values()) > 100
+
+    import pandas as pd
+    from coral.multiple_species_utils import annotate_tree_with_indices
+    from coral.parsimony import CompiledTree
+    tree, tree_mapping = annotate_tree_with_indices("((A:1,B:1):1,C:1,O:1);", "O", verbose=False)
+    from_matrix, from_csv = {}, {}
+    for block in matrix.chunks(50):
+        CompiledTree(tree, tree_mapping).fitch(block, from_matrix)
+    CompiledTree(tree, tree_mapping).fitch(pd.read_csv(tmp_path / "matching_bases.csv.gz"), from_csv)
+    assert from_matrix == from_csv and from_matrix
+
+
+def test_site_sampler_reads_matrix_and_csv_alike(tmp_path):
+    import numpy as np
+    from coral.run_phylip import load_site_alignment
+    from coral.site_matrix import SiteMatrix, SiteMatrixWriter
+
+    rng = np.random.default_rng(3)
+    path = str(tmp_path / "sampled.sites")
+    writer = SiteMatrixWriter(path, n_taxa=4, chunk_size=700)
+    sizes = {"chr1": 3000, "chr2": 1200, "chrM": 40}
+    for chromosome, size in sizes.items():
+        ids = np.full(size, writer.chromosome_id(chromosome))
+        bases = np.frombuffer(b"ACGT", dtype=np.uint8)[rng.integers(0, 4, (size, 4))]
+        writer.append_block(ids, np.arange(size) + 1, bases[:, 0], bases[:, 1], bases)
+    writer.close()
+    SiteMatrix(path).to_csv(tmp_path / "sampled.csv.gz")
+    full = SiteMatrix(path).alignment()
+
+    everything = load_site_alignment(path, max_rows=10_000, verbose=False)
+    assert np.array_equal(everything, full)
+
+    for stratify in (False, True):
+        sample = load_site_alignment(path, max_rows=500, stratify=stratify, verbose=False)
+        assert sample.shape == (4, 500)
+        assert np.array_equal(sample, load_site_alignment(str(tmp_path / "sampled.csv.gz"), max_rows=500,
+                                                          stratify=stratify, verbose=False))
+        assert not np.array_equal(sample, load_site_alignment(path, max_rows=500, stratify=stratify, seed=7,
+                                                              verbose=False))
+
+    from coral.site_matrix import SiteSampler, read_site_blocks
+    sampler = SiteSampler(500, stratify=True)
+    for block in read_site_blocks(path, chunk_size=300):
+        sampler.add(block)
+    indices, bases = sampler.sample()
+    assert np.array_equal(bases.T, full[:, indices]) and np.all(np.diff(indices) > 0)
+    matrix = SiteMatrix(path)
+    per_chromosome = np.bincount(matrix.chromosome[indices], minlength=3).tolist()
+    assert per_chromosome == [354, 141, 5]
+
+
+def test_weighted_site_patterns_cover_every_site(tmp_path):
+    import numpy as np
+    from coral.run_phylip import load_site_patterns, write_phylip_infile, write_phylip_weights
+    from coral.site_matrix import SiteMatrix, SiteMatrixWriter, count_site_patterns, read_site_blocks
+
+    rng = np.random.default_rng(5)
+    path = str(tmp_path / "patterns.sites")
+    writer = SiteMatrixWriter(path, n_taxa=3, chunk_size=250)
+    codes = np.frombuffer(b"ACGTa ", dtype=np.uint8)
+    bases = codes[rng.choice(6, size=(2000, 3), p=[0.6, 0.1, 0.1, 0.1, 0.05, 0.05])]
+    writer.append_block(np.full(2000, writer.chromosome_id("chr1")), np.arange(2000), bases[:, 0], bases[:, 0], bases)
+    writer.close()
+
+    patterns, counts = count_site_patterns(read_site_blocks(path, chunk_size=170))
+    full = SiteMatrix(path).alignment()
+    assert counts.sum() == 2000 and len(patterns) == len({col.tobytes() for col in full.T})
+
+    alignment, weights = load_site_patterns(path, verbose=False)
+    assert weights.max() <= 35 and weights.sum() == 2000
+    expanded = sorted(col.tobytes() for col, w in zip(alignment.T, weights) for _ in range(w))
+    assert expanded == sorted(col.tobytes() for col in full.T)
+
+    write_phylip_infile(alignment, tmp_path / "infile")
+    write_phylip_weights(weights, tmp_path / "weights", line_length=64)
+    lines = (tmp_path / "infile").read_text().splitlines()
+    assert lines[0] == f"3 {alignment.shape[1]}"
+    assert lines[1] == "taxa0     " + alignment[0].tobytes().decode().replace(" ", "-").upper()
+    assert len("".join((tmp_path / "weights").read_text().split())) == alignment.shape[1]
+
+
+def test_site_matrix_joined_from_base_call_tracks_matches_pileup_scan(tmp_path, monkeypatch):
+    import numpy as np
+    import pysam
+    from coral.base_call_tracks import BaseCallTrackWriter, fasta_chromosome_lengths
+    from coral.multiple_species_mutation_extractor_manager import MultipleSpeciesMutationExtractor
+    from coral.site_matrix import SiteMatrix, site_matrix_path
+
+    rng = random.Random(12)
+    fasta = tmp_path / "ref.fasta"
+    sequences = {"chr1": "".join(rng.choice("ACGTacgtN") for _ in range(3000)),
+                 "chr2": "".join(rng.choice("ACGT") for _ in range(2000))}
+    fasta.write_text("".join(f">{name}\n{seq}\n" for name, seq in sequences.items()))
+    pysam.faidx(str(fasta))
+
+    n_samples = 3
+    multi_lines, sample_lines = [], [[] for _ in range(n_samples)]
+    for name, seq in sequences.items():
+        for pos in range(1, len(seq) + 1):
+            if rng.random() < 0.02:
+                continue  # no sample covers it: samtools prints no line
+            fields = [rng.choice([".", ",", ".", ",", ".", ",", "..", "A", "c", "*", "^].", ".$"]) if rng.random() < 0.95 else None
+                      for _ in range(n_samples)]
+            if all(field is None for field in fields):
+                fields[0] = "."
+            cols = [name, str(pos), seq[pos - 1]]
+            for i, field in enumerate(fields):
+                cols += ["0", "*", "*"] if field is None else [str(len(field)), field, "I" * len(field)]
+                if field is not None:
+                    sample_lines[i].append("\t".join([name, str(pos), seq[pos - 1], str(len(field)), field,
+                                                      "I" * len(field)]) + "\n")
+            multi_lines.append("\t".join(cols) + "\n")
+
+    pileup = tmp_path / "multi.pileup.gz"
+    with gzip.open(pileup, "wt") as f:
+        f.writelines(multi_lines)
+    mapping = {name: i for i, name in enumerate("OABC")}
+    pileup_dir, track_dir = tmp_path / "pileup_run", tmp_path / "track_run"
+    pileup_dir.mkdir()
+    track_dir.mkdir()
+    MultipleSpeciesMutationExtractor(str(pileup), str(pileup_dir), n_species=n_samples + 1,
+                                     species_list=[[name] for name in mapping], mapping=mapping).extract()
+
+    monkeypatch.setattr("coral.multiple_species_mutation_extractor_manager.TRACK_JOIN_BLOCK", 257)
+    tracks = []
+    for i, lines in enumerate(sample_lines):
+        path = str(tmp_path / f"S{i}.track")
+        writer = BaseCallTrackWriter(path, fasta_chromosome_lengths(str(fasta)))
+        for start in range(0, len(lines), 700):
+            writer.add("".join(lines[start:start + 700]).encode())
+        writer.close({"bam": f"S{i}.bam"})
+        tracks.append(path)
+
+    for n in [2, 3]:  # the third species is added to an existing run
+        MultipleSpeciesMutationExtractor(None, str(track_dir), n_species=n + 1,
+                                         species_list=[[name] for name in "OABC"[:n + 1]], mapping=mapping,
+                                         tracks=tracks[:n], reference_fasta=str(fasta)).extract()
+
+    expected, actual = SiteMatrix(site_matrix_path(pileup_dir)), SiteMatrix(site_matrix_path(track_dir))
+    assert actual.n_taxa == n_samples + 1 and actual.n_sites == expected.n_sites > 50
+    assert list(actual.chromosomes[actual.chromosome]) == list(expected.chromosomes[expected.chromosome])
+    for name in ["position", "left", "right", "taxa", "callable_contexts"]:
+        assert np.array_equal(getattr(actual, name), getattr(expected, name))
@@ -0,0 +1,123 @@
+"""Equivalence of the compiled Fitch engine with the per-row recursive implementation."""
+
+import random
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+NEWICK = "((A:1,(B:1,C:1,D:1):1):1,((E:1,F:1):1,G:1):1,O:1);"
+
+
+def random_matching_bases(n_taxa, n_rows=2000, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_rows):
+        bases = [rng.choice("ACGT") for _ in range(n_taxa)]
+        for j in rng.sample(range(n_taxa), rng.randint(1, 3)):
+            bases[j] = rng.choice("ACGTACGTN-")
+        rows.append([rng.choice(["chr1", "chr2"]), i + 1, rng.choice("ACGT"), rng.choice("ACGT")] + bases)
+    columns = ["chromosome", "position", "left", "right"] + [f"taxa{i}" for i in range(n_taxa)]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def test_compiled_fitch_matches_recursive_fitch(tmp_path):
+    from coral.multiple_species_utils import annotate_tree_with_indices
+    from coral.parsimony import CompiledTree
+    from legacy_extractor import fitch
+
+    tree, mapping = annotate_tree_with_indices(NEWICK, "O", verbose=False)
+    df = random_matching_bases(n_taxa=8)
+
+    expected, expected_ambiguous = {}, 0
+    for _, row in df.iterrows():
+        expected, ambiguous = fitch(tree.copy(), row, expected, mapping)
+        expected_ambiguous += ambiguous
+
+    for cache_size in [5, 100_000]:
+        compiled = CompiledTree(tree, mapping, cache_size=cache_size)
+        actual, actual_ambiguous = {}, 0
+        for start in range(0, len(df), 300):
+            actual_ambiguous += compiled.fitch(df.iloc[start:start + 300], actual)
+
+        assert len(compiled.cache) <= cache_size
+        assert compiled.patterns_reconstructed < compiled.sites
+        assert actual_ambiguous == expected_ambiguous
+        assert list(actual) == list(expected)
+        for branch, mutations in expected.items():
+            assert [(c, int(p), m) for c, p, m in actual[branch]] == [(c, int(p), m) for c, p, m in mutations]
+
+
+def test_parallel_fitch_merges_chunks_in_order():
+    from coral.multiple_species_utils import annotate_tree_with_indices
+    from coral.parsimony import CompiledTree, run_fitch
+
+    tree, mapping = annotate_tree_with_indices(NEWICK, "O", verbose=False)
+    df = random_matching_bases(n_taxa=8, n_rows=3000, seed=1)
+
+    def merged(workers):
+        chunks = (df.iloc[start:start + 250] for start in range(0, len(df), 250))
+        mutation_dict, total_ambiguous = {}, 0
+        for chunk_mutations, _, ambiguous, *_ in run_fitch(chunks, CompiledTree(tree, mapping), workers):
+            for branch, mutations in chunk_mutations.items():
+                mutation_dict.setdefault(branch, []).extend(mutations)
+            total_ambiguous += ambiguous
+        return mutation_dict, total_ambiguous
+
+    serial, parallel = merged(1), merged(3)
+    assert parallel[1] == serial[1]
+    assert list(parallel[0]) == list(serial[0])
+    assert parallel[0] == serial[0]
+
+
+def test_streamed_branch_outputs_match_in_memory_results(tmp_path, monkeypatch):
+    import gzip
+    from coral.multiple_species_mutation_extractor_manager import MultipleSpeciesMutationExtractor
+    from coral.multiple_species_utils import annotate_tree_with_indices, collapse_mutations, filter_mutations_dict
+    from coral.plot_utils import MutationSpectraPlotter
+    from legacy_extractor import fitch
+
+    monkeypatch.setattr(MutationSpectraPlotter, "plot_mutations", staticmethod(lambda *args: None))
+    tree, mapping = annotate_tree_with_indices(NEWICK, "O", verbose=False)
+    df = random_matching_bases(n_taxa=8, n_rows=1500, seed=2)
+    df.to_csv(tmp_path / "matching_bases.csv.gz", index=False)
+    (tmp_path / "unused.pileup.gz").write_bytes(b"")
+
+    extractor = MultipleSpeciesMutationExtractor(str(tmp_path / "unused.pileup.gz"), str(tmp_path), n_species=8,
+                                                 tree=tree, mapping=mapping)
+    expected = {}
+    for _, row in pd.read_csv(tmp_path / "matching_bases.csv.gz").iterrows():
+        expected, _ = fitch(tree.copy(), row, expected, mapping)
+    extractor.extract()
+
+    spectra = pd.read_csv(tmp_path / "mutation_spectras.tsv", sep="\t", index_col=0)
+    assert list(spectra.columns) == list(expected)
+    for branch, mutations in expected.items():
+        lines = gzip.open(tmp_path / "CSVs" / f"{branch}.csv.gz", "rt").read().splitlines()
+        assert lines == [f"{c}\t{p}\t{m}" for c, p, m in mutations]
+        legacy = filter_mutations_dict(collapse_mutations(pd.Series([m for _, _, m in mutations]).value_counts()))
+        assert spectra[branch].dropna().astype(int).to_dict() == dict(legacy)
+
+
+def test_branch_contexts_use_reconstructed_parent_base():
+    import numpy as np
+    from coral.multiple_species_utils import annotate_tree_with_indices
+    from coral.parsimony import CONTEXTS, CompiledTree
+
+    tree, mapping = annotate_tree_with_indices("((A:1,B:1):1,C:1,O:1);", "O", verbose=False)
+    columns = ["chromosome", "position", "left", "right"] + [f"taxa{mapping[name]}" for name in "OABC"]
+    df = pd.DataFrame([["chr1", 1, "A", "G", "C", "T", "C", "C"],
+                       ["chr1", 2, "T", "A", "A", "G", "G", "A"]], columns=columns)
+    compiled = CompiledTree(tree, mapping)
+    contexts = np.zeros((compiled.n_nodes, len(CONTEXTS)), dtype=np.int64)
+    compiled.fitch(df, {}, contexts=contexts)
+
+    parent_contexts = [{CONTEXTS[i]: int(n) for i, n in enumerate(row) if n} for row in contexts]
+    nodes = list(tree.traverse("preorder"))
+    ab_node = tree.get_common_ancestor("A", "B")
+    expected = {node: {"ACG": 1, "TGA": 1} if node.name in ("A", "B") else {"ACG": 1, "TAA": 1} for node in nodes}
+    expected[ab_node] = {"ACG": 1, "TAA": 1}
+    expected[tree] = {}
+    assert parent_contexts == [expected[node] for node in nodes]
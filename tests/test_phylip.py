@@ -0,0 +1,162 @@
+"""PHYLIP driver tests against a stand-in dnapars that follows PHYLIP's file conventions."""
+
+import json
+import os
+import stat
+import sys
+import textwrap
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+FAKE_DNAPARS = textwrap.dedent("""\
+    #!{python}
+    import json, os, sys, time
+    menu = sys.stdin.read()
+    start = time.time()
+    time.sleep(0.5)
+    ntaxa, nsites = map(int, open("infile").readline().split())
+    weights = "".join(open("weights").read().split()) if os.path.exists("weights") else "1" * nsites
+    score = sum(int(w, 36) for w in weights) + (7 if os.path.exists("intree") else 0)
+    with open("outfile", "w") as f:
+        f.write(f"requires a total of {{score}}.000\\n")
+    with open("outtree", "w") as f:
+        if ntaxa < 4:
+            f.write("(taxa0,taxa1,taxa2);\\n")
+        elif sum(int(w, 36) for w in weights[::2]) >= sum(int(w, 36) for w in weights[1::2]):
+            f.write("((taxa1:1,taxa2:1):1,taxa0:1,taxa3:1);\\n")
+        else:
+            f.write("((taxa1:1,taxa2:1):1,taxa0:1,taxa3:1)[0.5000];\\n((taxa1:1,taxa3:1):1,taxa0:1,taxa2:1)[0.5000];\\n")
+    with open({log!r}, "a") as f:
+        f.write(json.dumps({{"menu": menu, "start": start, "end": time.time(), "cwd": os.getcwd()}}) + "\\n")
+""")
+
+
+def install_fake_dnapars(tmp_path, monkeypatch, name="dnapars"):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    exe = bin_dir / name
+    exe.write_text(FAKE_DNAPARS.format(python=sys.executable, log=str(tmp_path / "runs.jsonl")))
+    exe.chmod(exe.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return tmp_path / "runs.jsonl"
+
+
+def write_site_matrix(path, n_sites=500, n_taxa=3, seed=0):
+    from coral.site_matrix import SiteMatrixWriter
+    rng = np.random.default_rng(seed)
+    writer = SiteMatrixWriter(str(path), n_taxa=n_taxa)
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)[rng.integers(0, 4, (n_sites, n_taxa))]
+    writer.append_block(np.full(n_sites, writer.chromosome_id("chr1")), np.arange(n_sites), bases[:, 0],
+                        bases[:, 1], bases)
+    writer.close()
+    return str(path)
+
+
+def test_runs_are_isolated_and_concurrent(tmp_path, monkeypatch):
+    from coral.run_phylip import run_phylip
+
+    runs_log = install_fake_dnapars(tmp_path, monkeypatch, name="dnamlk")
+    matrix = write_site_matrix(tmp_path / "matching_bases.sites")
+    (tmp_path / "tree.nwk").write_text("((A:1,B:1):1,O:1);")
+    out_dir = tmp_path / "phylip"
+    cwd = os.getcwd()
+
+    run_phylip("dnamlk", matrix, str(tmp_path / "tree.nwk"), str(out_dir), "run", "Y\n",
+               mapping={"O": 0, "A": 1, "B": 2}, verbose=False)
+
+    assert os.getcwd() == cwd
+    runs = [json.loads(line) for line in runs_log.read_text().splitlines()]
+    assert len(runs) == 2 and runs[0]["cwd"] != runs[1]["cwd"]
+    assert sorted(run["menu"] for run in runs) == ["U\nY\n", "Y\n"]
+    assert max(run["start"] for run in runs) < min(run["end"] for run in runs)
+
+    no_tree = (out_dir / "run_no_tree" / "run.outfile").read_text()
+    with_tree = (out_dir / "run_with_tree" / "given_tree_run.outfile").read_text()
+    assert no_tree == "requires a total of 500.000\n" and with_tree == "requires a total of 507.000\n"
+    assert sorted(p.name for p in out_dir.iterdir()) == ["run_no_tree", "run_with_tree"]
+    assert sorted(p.name for p in (out_dir / "run_no_tree").iterdir()) == [
+        "phylip_stderr.log", "phylip_stdout.log", "run.outfile", "run.outtree"]
+
+
+def test_majority_rule_consensus_support():
+    import pytest
+    from ete3 import Tree
+    from coral.run_phylip import majority_rule_consensus, split_support
+
+    replicates = [
+        ([Tree("((A,B),(C,D),E);")], [1.0]),
+        ([Tree("((A,B),(C,E),D);")], [1.0]),
+        ([Tree("((A,C),(B,D),E);"), Tree("((A,B),(C,D),E);")], [0.5, 0.5]),
+    ]
+    support = split_support(replicates, reference="E")
+    assert support[frozenset("AB")] == pytest.approx(2.5 / 3)
+    assert support[frozenset("CD")] == pytest.approx(1.5 / 3)
+    assert support[frozenset("ABD")] == pytest.approx(1 / 3)  # (C,E) seen from E
+
+    consensus = majority_rule_consensus("ABCDE", support)
+    clade = consensus.get_common_ancestor("A", "B")
+    assert sorted(clade.get_leaf_names()) == ["A", "B"] and clade.support == 83.3
+    cd = consensus.get_common_ancestor("C", "D")
+    assert cd is consensus and len(consensus.children) == 4
+
+
+def test_bootstrap_replicates_share_one_infile(tmp_path, monkeypatch):
+    from ete3 import Tree
+    from coral.run_phylip import run_phylip
+
+    runs_log = install_fake_dnapars(tmp_path, monkeypatch)
+    matrix = write_site_matrix(tmp_path / "matching_bases.sites", n_sites=2000, n_taxa=4, seed=1)
+    (tmp_path / "tree.nwk").write_text("((A:1,B:1):1,C:1,O:1);")
+    out_dir = tmp_path / "phylip"
+
+    run_phylip("dnapars", matrix, str(tmp_path / "tree.nwk"), str(out_dir), "run", "Y\n",
+               mapping={"O": 0, "A": 1, "B": 2, "C": 3, "0": "O", "1": "A", "2": "B", "3": "C"},
+               bootstrap=12, workers=4, verbose=False)
+
+    runs = [json.loads(line) for line in runs_log.read_text().splitlines()]
+    assert len(runs) == 13 and len({run["cwd"] for run in runs}) == 13
+    assert all(run["menu"] == "W\nY\n" for run in runs)
+    assert not (out_dir / "run_with_tree").exists()
+    replicate_dirs = sorted(p.name for p in (out_dir / "run_bootstrap").iterdir() if p.is_dir())
+    assert replicate_dirs == [f"replicate{i:03d}" for i in range(12)]
+
+    consensus = Tree(str(out_dir / "run_bootstrap" / "consensus.nwk"), format=2)
+    clade = consensus.get_common_ancestor("A", "B")
+    assert sorted(clade.get_leaf_names()) == ["A", "B"] and 50 < clade.support <= 100
+    given = Tree(str(out_dir / "run_bootstrap" / "given_tree_support.nwk"), format=2)
+    assert given.get_common_ancestor("A", "B").support == clade.support
+    assert not [p for p in out_dir.iterdir() if p.name.startswith(".")]
+
+
+def test_native_scores_match_exhaustive_parsimony():
+    import random
+    from ete3 import Tree
+    from coral.parsimony import SCORE_MASKS, ParsimonyScorer, nni_neighbours
+
+    def exhaustive(node, pattern, state):
+        if node.is_leaf():
+            return 0 if SCORE_MASKS[ord(pattern[int(node.name[4:])])] >> state & 1 else 10 ** 6
+        return sum(min(exhaustive(child, pattern, s) + (s != state) for s in range(5)) for child in node.children)
+
+    rng = random.Random(1)
+    patterns = ["".join(rng.choice("ACGT-NRYacgt") for _ in range(5)) for _ in range(200)]
+    counts = np.array([rng.randint(1, 50) for _ in patterns])
+    newicks = ["((taxa0,taxa1),(taxa2,taxa3),taxa4);", "(taxa0,taxa1,taxa2,taxa3,taxa4);",
+               "((taxa0,taxa1,taxa2),(taxa3,taxa4));", "(((taxa0,taxa1),taxa2,taxa3),taxa4);"]
+    codes = np.frombuffer("".join(patterns).encode(), dtype=np.uint8).reshape(len(patterns), 5)
+
+    scorer = ParsimonyScorer(codes, counts, block_bytes=4096)
+    expected = [sum(c * min(exhaustive(Tree(n, format=1), p, s) for s in range(5)) for p, c in zip(patterns, counts))
+                for n in newicks]
+    assert scorer.score(newicks).tolist() == expected
+
+    tree = Tree("(((taxa0,taxa1),(taxa2,taxa3)),(taxa4,taxa5),taxa6);", format=1)
+    neighbours = nni_neighbours(tree)
+    assert len(neighbours) == 8
+    codes7 = np.frombuffer(bytes(rng.choice(b"ACGT") for _ in range(7 * 300)), dtype=np.uint8).reshape(300, 7)
+    scorer7 = ParsimonyScorer(codes7, np.ones(300, dtype=np.int64))
+    batched = scorer7.score([tree] + neighbours)
+    assert batched.tolist() == [int(scorer7.score([t])[0]) for t in [tree] + neighbours]
@@ -0,0 +1,213 @@
+"""Binning kernels behind the coverage and mutation density plots."""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+
+def _legacy_binned_coverage(intervals, chrom_length, bin_size, slide):
+    """The per-bin interval walk the plotters used before the prefix-sum kernel."""
+    intervals = sorted(intervals)
+    coverage, current, n = [], 0, len(intervals)
+    for bin_start in range(0, chrom_length - bin_size + 1, slide):
+        bin_end = bin_start + bin_size
+        total = 0
+        while current < n and intervals[current][1] <= bin_start:
+            current += 1
+        i = current
+        while i < n and intervals[i][0] < bin_end:
+            total += max(0, min(intervals[i][1], bin_end) - max(intervals[i][0], bin_start))
+            i += 1
+        coverage.append(total / bin_size)
+    return coverage
+
+
+def test_coverage_kernel_matches_interval_walk(tmp_path):
+    from coral.plot_utils import CoveragePlotter, MutationDensityPlotter
+
+    rng = np.random.default_rng(3)
+    chrom_length = 20_000
+    starts = rng.integers(0, chrom_length, 3000)
+    intervals = [(int(s), int(s + length)) for s, length in zip(starts, rng.integers(-5, 400, 3000))]
+    fai = tmp_path / "ref.fasta.fai"
+    fai.write_text(f"chr1\t{chrom_length}\t6\t60\t61\nchr2\t500\t0\t60\t61\n")
+    interval_file = tmp_path / "A.tsv"
+    interval_file.write_text("chromosome\tstart\tend\n"
+                             + "".join(f"chr1\t{s}\t{e}\n" for s, e in intervals)
+                             + "chr2\t0\t500\n")
+
+    coverage_plotter, density_plotter = CoveragePlotter(str(fai), verbose=False), MutationDensityPlotter(str(fai), verbose=False)
+    for bin_size, slide in [(1000, 1000), (1000, 250), (777, 333), (1, 1), (20_000, 7)]:
+        expected = _legacy_binned_coverage(intervals, chrom_length, bin_size, slide)
+        midpoints, coverage = coverage_plotter.compute_binned_coverage(str(interval_file), "chr1", bin_size, slide)
+        assert np.array_equal(coverage, expected)
+        assert list(midpoints) == [s + bin_size // 2 for s in range(0, chrom_length - bin_size + 1, slide)]
+        assert np.array_equal(density_plotter.compute_coverage_for_normalization(str(interval_file), "chr1", bin_size, slide),
+                              expected)
+
+
+def test_mutation_density_matches_per_bin_scan(tmp_path):
+    import re
+
+    import pandas as pd
+    from coral.plot_utils import MutationDensityPlotter
+
+    rng = np.random.default_rng(5)
+    chrom_length = 10_000
+    classes = ["A[C>T]G", "T[C>T]G", "A[C>A]T", "G[T>C]C", None]
+    df = pd.DataFrame({"chromosome": rng.choice(["chr1", "chr2"], 2000),
+                       "position": rng.integers(0, chrom_length, 2000),
+                       "mutation": rng.choice(np.array(classes, dtype=object), 2000)})
+    mutation_file = tmp_path / "A_mutations.csv.gz"
+    df.to_csv(mutation_file, index=False)
+    fai = tmp_path / "ref.fasta.fai"
+    fai.write_text(f"chr1\t{chrom_length}\t6\t60\t61\nchr2\t{chrom_length}\t0\t60\t61\n")
+
+    plotter = MutationDensityPlotter(str(fai), verbose=False)
+    for regex in [None, re.compile(r"[ACTG][C>T]G"), re.compile("C>")]:
+        expected = df[df["chromosome"] == "chr1"]
+        if regex:
+            expected = expected[expected["mutation"].str.contains(regex, regex=True, na=False)]
+        for bin_size, slide in [(1000, 1000), (1000, 100), (333, 7)]:
+            starts = range(0, chrom_length - bin_size + 1, slide)
+            midpoints, counts = plotter.compute_mutation_density(str(mutation_file), "chr1", bin_size, slide, regex)
+            assert list(counts) == [((expected["position"] >= s) & (expected["position"] < s + bin_size)).sum()
+                                    for s in starts]
+            assert list(midpoints) == [s + bin_size // 2 for s in starts]
+
+
+def test_plot_data_cache_parses_each_file_once(tmp_path):
+    import re
+
+    import pandas as pd
+    from coral.plot_utils import CoveragePlotter, MutationDensityPlotter, PlotDataCache
+
+    fai = tmp_path / "ref.fasta.fai"
+    fai.write_text("chr1\t5000\t6\t60\t61\nchr2\t3000\t0\t60\t61\n")
+    mutation_dir = tmp_path / "Mutations"
+    mutation_dir.mkdir()
+    rng = np.random.default_rng(9)
+    for name in ["A", "B"]:
+        pd.DataFrame({"chromosome": rng.choice(["chr1", "chr2"], 500), "position": rng.integers(0, 3000, 500),
+                      "mutation": rng.choice(["A[C>T]G", "A[C>A]T"], 500)}).to_csv(mutation_dir / f"{name}_mutations.csv.gz", index=False)
+    interval_file = tmp_path / "A.tsv"
+    interval_file.write_text("chromosome\tstart\tend\nchr1\t0\t4000\nchr2\t100\t200\n")
+
+    cache = PlotDataCache()
+    coverage_plotter = CoveragePlotter(str(fai), verbose=False, cache=cache)
+    density_plotter = MutationDensityPlotter(str(fai), verbose=False, cache=cache)
+    for chrom in ["chr1", "chr2"]:
+        for regex in [None, r"[ACTG][C>T]G"]:
+            density_plotter.plot(str(mutation_dir), chrom, str(tmp_path), bin_size=1000, mutation_category=regex)
+        coverage_plotter.compute_binned_coverage(str(interval_file), chrom, 1000, 500)
+        density_plotter.compute_coverage_for_normalization(str(interval_file), chrom, 1000, 500)
+    assert cache.loads == 3
+    _, coverage = coverage_plotter.compute_binned_coverage(str(interval_file), "chr2", 1000, 1000)
+    assert list(coverage) == [0.1, 0, 0]
+
+    df = pd.read_csv(mutation_dir / "B_mutations.csv.gz")
+    _, counts = density_plotter.compute_mutation_density(str(mutation_dir / "B_mutations.csv.gz"), "chr2", 1000, 1000,
+                                                         re.compile("C>T"))
+    expected = df[(df["chromosome"] == "chr2") & (df["mutation"] == "A[C>T]G")]["position"] // 1000
+    assert list(counts) == [int((expected == i).sum()) for i in range(3)]
+
+    small = PlotDataCache(max_bytes=1)  # keeps only the most recent file
+    small.mutations(str(mutation_dir / "A_mutations.csv.gz"), "chr1")
+    small.mutations(str(mutation_dir / "B_mutations.csv.gz"), "chr1")
+    small.mutations(str(mutation_dir / "B_mutations.csv.gz"), "chr2")
+    small.mutations(str(mutation_dir / "A_mutations.csv.gz"), "chr1")
+    assert small.loads == 3 and len(small._entries) == 1
+
+
+def test_plot_queue_draws_in_background_processes(tmp_path):
+    import io
+
+    import pandas as pd
+    import pytest
+    from coral.alignment_manager import filter_sam
+    from coral.plot_queue import PlotQueue
+    from coral.plot_utils import MutationSpectraPlotter
+
+    sam = "@HD\tVN:1.6\n" + "".join(f"r{i}\t0\tchr1\t{i + 1}\t{q}\t4M\t*\t0\t0\tACGT\tIIII\n"
+                                     for i, q in enumerate([60, 60, 3, 0, 60]))
+    output = io.StringIO()
+    with PlotQueue(jobs=2, verbose=False) as queue:
+        filter_sam(io.StringIO(sam), output, mapq_threshold=60, mapq_hist_folder=str(tmp_path / "Plots"),
+                   hist_name="A_to_O.png", verbose=False, plot_queue=queue)
+        for branch in ["b0", "b1", "b2"]:
+            queue.submit(MutationSpectraPlotter.plot_mutations, pd.Series({"A[C>T]G": 3, "T[T>G]A": 1}),
+                         str(tmp_path / f"{branch}_spectra.png"), branch)
+    assert output.getvalue().count("\tchr1\t") == 3
+    assert sorted(p.name for p in tmp_path.rglob("*.png")) == ["A_to_O.png", "b0_spectra.png", "b1_spectra.png",
+                                                               "b2_spectra.png"]
+
+    queue = PlotQueue(jobs=1, verbose=False)
+    queue.submit(MutationSpectraPlotter.plot_mutations, pd.Series({"not a class": 1}), str(tmp_path / "bad.png"), "bad")
+    with pytest.raises(RuntimeError, match="1 of 1 plot"):
+        queue.close()
+
+    with pytest.raises(KeyError):  # a failing stage stops the workers without drawing what is queued
+        with PlotQueue(jobs=1, verbose=False) as queue:
+            queue.submit(MutationSpectraPlotter.plot_mutations, pd.Series({"A[C>T]G": 1}), str(tmp_path / "x.png"), "x")
+            raise KeyError("stage failed")
+    assert queue._pool is None and not queue._pending
+
+
+def test_summary_tracks_match_raw_binning(tmp_path):
+    import os
+    import re
+
+    import pandas as pd
+    from coral.plot_utils import CoveragePlotter, MutationDensityPlotter
+    from coral.summary_tracks import SummaryTracks, write_summary_tracks
+
+    rng = np.random.default_rng(11)
+    chrom_lengths = {"chr1": 254_321, "chr2": 31_000, "chr3": 20_000, "chrS": 500, "chrE": 50_000}
+    fai = tmp_path / "ref.fasta.fai"
+    fai.write_text("".join(f"{name}\t{length}\t0\t60\t61\n" for name, length in chrom_lengths.items()))
+    (tmp_path / "Intervals").mkdir()
+    (tmp_path / "Mutations").mkdir()
+    interval_file = tmp_path / "Intervals" / "A.tsv.gz"
+    starts = rng.integers(0, 254_321, 5000)
+    pd.DataFrame({"chromosome": rng.choice(["chr1", "chr2"], 5000), "start": starts,
+                  "end": starts + rng.integers(-10, 3000, 5000)}).to_csv(interval_file, sep="\t", index=False)
+    mutation_file = tmp_path / "Mutations" / "A_mutations.csv.gz"
+    pd.DataFrame({"chromosome": rng.choice(["chr1", "chr2", "chr3", "chrS", "chrM"], 4000),
+                  "position": rng.integers(0, 260_000, 4000),
+                  "mutation": rng.choice(np.array(["A[C>T]G", "T[C>A]A", "G[T>C]C", None], dtype=object), 4000)}
+                 ).to_csv(mutation_file, index=False)
+
+    path = write_summary_tracks(str(tmp_path / "summary_tracks.npz"), chrom_lengths, [str(interval_file)],
+                                [str(mutation_file)], verbose=False)
+    tracks = SummaryTracks(path)
+    assert tracks.zoom_for(100_000, 20_000) == 10_000 and tracks.zoom_for(1500, 1000) is None
+    # one array per file, zoom and kind; chrS is shorter than every zoom and chrE has no rows
+    assert len(np.load(path).files) == 1 + 4 + 3 * 4
+    assert list(tracks.chrom_lengths) == ["chr1", "chr2", "chr3"]
+    assert tracks.coverage(str(interval_file), "chrE", 1000, 1000) is None
+    assert tracks.mutation_counts(str(mutation_file), "chrS", 1000, 1000) is None
+
+    raw = [CoveragePlotter(str(fai), verbose=False), MutationDensityPlotter(str(fai), verbose=False)]
+    fast = [CoveragePlotter(str(fai), verbose=False, summary_tracks=tracks),
+            MutationDensityPlotter(str(fai), verbose=False, summary_tracks=tracks)]
+    for chrom in ["chr1", "chr2", "chr3"]:
+        for bin_size, slide in [(1000, 1000), (10_000, 2000), (100_000, 100_000), (3000, 1000)]:
+            expected = raw[0].compute_binned_coverage(str(interval_file), chrom, bin_size, slide)
+            actual = fast[0].compute_binned_coverage(str(interval_file), chrom, bin_size, slide)
+            assert all(np.array_equal(a, e) for a, e in zip(actual, expected))
+            for regex in [None, re.compile("C>")]:
+                expected = raw[1].compute_mutation_density(str(mutation_file), chrom, bin_size, slide, regex)
+                actual = fast[1].compute_mutation_density(str(mutation_file), chrom, bin_size, slide, regex)
+                assert all(np.array_equal(a, e) for a, e in zip(actual, expected))
+    assert tracks.coverage(str(interval_file), "chr1", 1500, 1000) is None
+
+    os.utime(mutation_file, (0, 0))  # a changed source is no longer served from the tracks
+    assert tracks.mutation_counts(str(mutation_file), "chr1", 1000, 1000) is None
+    tracks.close()
+
+    with SummaryTracks(path) as tracks:
+        assert tracks.coverage(str(interval_file), "chr2", 1000, 1000) is not None
+    assert tracks._npz.fid is None